@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import argparse
+import os.path
+import sys
+import time
+
+import ssd1306_image_reader
+
+# By default the virtual filesystem has the sector size of most SPI NOR flashes (and the
+# block size of littlefs on them)
+DEFAULT_SECTOR_SIZE = 4096
+
+debug = False
+
+
+class VirtualFlashFile:
+    """File wrapper counting the reads as a flash filesystem sees them: the read calls, the
+       bytes read, the sectors read without cache (each read reads all the sectors it touches)
+       and the unaligned reads (not starting on a sector or not a whole number of sectors)."""
+
+    def __init__(self, f, sector_size):
+        self.f = f
+        self.sector_size = sector_size
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.bytes = 0
+        self.sectors = 0
+        self.unaligned_reads = 0
+
+    def __add_read(self, pos, size):
+        if not size:
+            return
+        self.reads += 1
+        self.bytes += size
+        self.sectors += (pos + size - 1) // self.sector_size - pos // self.sector_size + 1
+        if pos % self.sector_size or size % self.sector_size:
+            self.unaligned_reads += 1
+
+    def read(self, size=-1):
+        pos = self.f.tell()
+        buf = self.f.read(size)
+        self.__add_read(pos, len(buf))
+        return buf
+
+    def readinto(self, buf):
+        pos = self.f.tell()
+        size = self.f.readinto(buf)
+        self.__add_read(pos, size or 0)
+        return size
+
+    def seek(self, offset, whence=0):
+        return self.f.seek(offset, whence)
+
+    def tell(self):
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+def benchmark(input_filename, sector_size, loops):
+    if not os.path.isfile(input_filename):
+        print("Error: file {} does not exit!".format(input_filename), file=sys.stderr)
+        exit(1) # exit with error
+
+    img_reader = ssd1306_image_reader.SSD1306_ImageReader(input_filename)
+    img_reader.f = VirtualFlashFile(img_reader.f, sector_size)
+    frames = img_reader.frames * loops
+
+    time_start = time.perf_counter()
+    for frame in range(frames):
+        img_reader.next_frame()
+    time_s = time.perf_counter() - time_start
+    f = img_reader.f
+    img_reader.close()
+
+    print("{:40} {:>8} {:>7} {:>8} {:>8} {:>10} {:>8.1f}".format(
+        os.path.basename(input_filename), os.path.getsize(input_filename), f.reads, f.unaligned_reads,
+        f.sectors, f.bytes // frames, frames / time_s))
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS] filename [filename ...]",
+        description=
+        """
+Benchmark the reads of SSD1306_ImageReader on a virtual flash filesystem: play the images
+(--loops times) and count the read calls, the unaligned reads and the flash sectors read
+(without cache), then print the decoding speed of this computer (frames per second).
+
+Notes:
+ - Compare for instance "my_animation.128x64.42img.z" with "my_animation.128x64.42img.zb"
+   (see --aligned in convert_animated_gif_to_ssd1306_images.py) and the same --sector-size.""",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("--sector-size",    help="flash sector size in bytes (default: %(default)s)", type=int, default=DEFAULT_SECTOR_SIZE)
+    parser.add_argument("-l", "--loops",    help="animation loops (default: %(default)s)", type=int, default=2)
+    return parser
+
+def main() -> None:
+    parser = init_argparse()
+    args = parser.parse_args()
+    if debug:
+        print(args)
+
+    print("{:40} {:>8} {:>7} {:>8} {:>8} {:>10} {:>8}".format(
+        "file", "size", "reads", "unalign.", "sectors", "B/frame", "frames/s"))
+    for filename in args.filenames:
+        benchmark(filename, args.sector_size, args.loops)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import argparse
+import os.path
+import struct
+import sys
+
+import ssd1306_image_reader
+
+debug = False
+
+
+def get_image_name(filename) -> str:
+    """Get the image name from its filename ("path/name.widthxheight.nimg.z" gives "name")."""
+    return os.path.basename(filename).rsplit(".", 3)[0]
+
+
+def bundle(verbose, overwrite, output_filename, input_filenames):
+    # Check if input files exit & get their config
+    entries = []
+    names = set()
+    for input_filename in input_filenames:
+        if not os.path.isfile(input_filename):
+            print("Error: file {} does not exit!".format(input_filename), file=sys.stderr)
+            exit(1) # exit with error
+        name = get_image_name(input_filename)
+        if name in names:
+            print("Error: image name {} is used by several input files!".format(name), file=sys.stderr)
+            exit(1) # exit with error
+        if len(name.encode()) > 255:
+            print("Error: image name {} is too long!".format(name), file=sys.stderr)
+            exit(1) # exit with error
+        names.add(name)
+        img_reader = ssd1306_image_reader.SSD1306_ImageReader(input_filename)
+        img_reader.close()
+        if img_reader.x or img_reader.y:
+            # The bundle directory has no room for the position on the panel
+            print("Error: sprite image {} can not be bundled!".format(input_filename), file=sys.stderr)
+            exit(1) # exit with error
+        config = (img_reader.width, img_reader.height, img_reader.frames, img_reader.compression)
+        entries.append((name, config, img_reader.encoding, input_filename, os.path.getsize(input_filename)))
+
+    # Check if output file already exists...
+    if os.path.isfile(output_filename):
+        if not overwrite:
+            print("Error: file {} already exits, please delete it or use the proper option to overwrite it!".format(output_filename),
+                  file=sys.stderr)
+            exit(1) # exit with error
+        else:
+            if verbose:
+                print("Warning: file {} already exits and will be overwritten.".format(output_filename))
+
+    # Compute the directory size then the images offsets
+    offset = struct.calcsize(ssd1306_image_reader.BUNDLE_HEADER_FORMAT)
+    for (name, config, encoding, input_filename, size) in entries:
+        offset += 1 + len(name.encode()) + struct.calcsize(ssd1306_image_reader.BUNDLE_ENTRY_FORMAT)
+
+    bundle_out_file = open(output_filename, "wb") # TODO better manage errors
+
+    # Header & directory
+    bundle_out_file.write(struct.pack(ssd1306_image_reader.BUNDLE_HEADER_FORMAT,
+                                      ssd1306_image_reader.BUNDLE_MAGIC, ssd1306_image_reader.BUNDLE_VERSION,
+                                      0, len(entries)))
+    for (name, config, encoding, input_filename, size) in entries:
+        (width, height, frames, compression) = config
+        bundle_out_file.write(bytes([len(name.encode())]) + name.encode())
+        bundle_out_file.write(struct.pack(ssd1306_image_reader.BUNDLE_ENTRY_FORMAT,
+                                          width, height, frames, (encoding << 1) | (1 if compression else 0), offset, size))
+        if verbose:
+            print("{:>8} {:>8} {} ({}x{}, {} frames, compression {})".format(offset, size, name, width, height, frames, compression))
+        offset += size
+
+    # Images data
+    for (name, config, encoding, input_filename, size) in entries:
+        with open(input_filename, "rb") as f:
+            bundle_out_file.write(f.read())
+
+    bundle_out_file.close()
+
+    if verbose:
+        print("{} successfully generated :-)".format(output_filename))
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS] -o output.bundle filename [filename ...]",
+        description=
+        """
+Pack several image files for ssd1306-like OLED panel into a single bundle file.
+
+Notes:
+ - The images are named in the bundle after their filename without the WidthxHeight.Nimg.raw suffix.
+   For example "my_animation.128x64.42img.z" is named "my_animation".
+ - Use SSD1306_ImageBundle("output.bundle").open("my_animation") to read an image from the bundle.""",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("-o", "--output",   help="bundle filename", required=True)
+    parser.add_argument("-f", "--force",    action="store_true", help="force overwrite")
+    parser.add_argument("-v", "--verbose",  action="store_true", help="explain what is being done")
+    return parser
+
+def main() -> None:
+    parser = init_argparse()
+    args = parser.parse_args()
+    if debug:
+        print(args)
+
+    bundle(args.verbose, args.force, args.output, args.filenames)
+
+if __name__ == "__main__":
+    main()
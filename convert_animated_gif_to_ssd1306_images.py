@@ -1,119 +1,84 @@
 #!/usr/bin/env python3
 
 import argparse
-import os.path
 import sys
-import zlib
 
-from PIL import Image
-from PIL.GifImagePlugin import GifImageFile
-
-import ssd1306_image_converter
+import ssd1306_image_encoder
+import ssd1306_image_layout
 import ssd1306_image_reader
-
-# By default, we use do not use the dithering when converting the GIF to 1-bit per pixel
-# It may be useful when the animated GIF uses a lot of colors (videos...)
-default_dither_method = Image.NONE # or Image.FLOYDSTEINBERG
+import ssd1306_image_scheduler
 
 debug = False
 
 
-def get_pil_image_info_str(img) -> str:
-    str = "{}x{} mode {}".format(img.width, img.height, img.mode)
-    if img.format != None:
-        str += ", {}".format(img.format)
-    if hasattr(img, 'n_frames'):
-        str += ", {} frames".format(img.n_frames) if img.n_frames > 1 else "single frame"
-    if hasattr(img, 'filename'):
-        str += ", {}".format(img.filename)
-    return str
-
-
-def convert(verbose, compression, overwrite, input_filename,
-            zlib_window_size=ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE,
-            dither_method=default_dither_method):
-    # Check if input file exits
-    if not os.path.isfile(input_filename):
-        print("Error: file {} does not exit!".format(input_filename), file=sys.stderr)
-        exit(1) # exit with error
-
-    # Load animation file with PIL
-    img_in = Image.open(input_filename)
-    if verbose:
-        print("input image : {}".format(get_pil_image_info_str(img_in)))
-
-    #img_in.seek(0)
-    #img_in.show("default")
-
-    # Determine the number of frames
-    if hasattr(img_in, 'n_frames'):
-        n_frames = img_in.n_frames  # Animated GIF case
-    else:
-        n_frames = 1                # Single frame image (PNG, GIF...)
-
-    # Prepare the output filename (from "filename.gif" to "filename.widthxheight.nimg.z" or ".raw")
-    output_filename = "{}.{}x{}.{}img".format(input_filename.rsplit('.', 1)[0], img_in.width, img_in.height, n_frames)
-    if compression:
-        output_filename = "{}.z".format(output_filename)
-    else:
-        output_filename = "{}.raw".format(output_filename)
-    if verbose:
-        print("output image: {}".format(output_filename))
-
-    # Check if output file already exists...
-    if os.path.isfile(output_filename):
-        if not overwrite:
-            print("Error: file {} already exits, please delete it or use the proper option to overwrite it!".format(output_filename),
-                  file=sys.stderr)
-            exit(1) # exit with error
-        else:
-            if verbose:
-                print("Warning: file {} already exits and will be overwritten.".format(output_filename))
-
-    img_out_file = open(output_filename, "wb") # TODO better manage errors
-
-    # Prepare the compression if necessary
-    if compression:
-        img_out_compress = zlib.compressobj(9, zlib.DEFLATED, zlib_window_size)
-
-    for frame in range(n_frames):
-        if verbose:
-            print("{:5}/{} in progress...".format(frame + 1, n_frames))
-
-        img_in.seek(frame)
-
-        # Convert in 1-bit (black & white), stored with 1 pixel per byte in PIL buffer (0, 1)
-        img_tmp = img_in.convert("1", dither = dither_method)
-        if debug:
-            print("tmp image: {}".format(get_pil_image_info_str(img_tmp)))
-
-        # Extract the buffer from the current frame
-        img_tmp_buf = img_tmp.tobytes(encoder_name = "raw")
-
-        # Convert to ssd1306 format (TODO add a documentation link somewhere) 
-        img_out_buf = bytearray((img_in.width * img_in.height) // 8)
-        ssd1306_image_converter.to_ssd1306(img_in.width, img_in.height, img_tmp_buf, img_out_buf)
-
-        # Compress the buffer if requested
-        if compression:
-            # TODO check compress returned value?
-            img_out_compressed_buf = img_out_compress.compress(img_out_buf)
-            # Save the buffer to disk
-            img_out_file.write(img_out_compressed_buf) # TODO better manage errors
-        else:
-            # Save the buffer to disk
-            img_out_file.write(img_out_buf) # TODO better manage errors
-
-    # Close the file
-    if compression:
-        img_out_compressed_buf = img_out_compress.flush()
-        # Save the buffer to disk
-        img_out_file.write(img_out_compressed_buf) # TODO better manage errors
-
-    img_out_file.close()
-
-    if verbose:
-        print("{} successfully generated :-)".format(output_filename))
+def get_positive_int(value) -> int:
+    """argparse type of the options needing an integer greater than 0."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is not an integer greater than 0".format(value))
+    return number
+
+
+def get_layout_params(args):
+    """Return the panel layout parameters of the command line, None for the default layout."""
+    layout_params = {}
+    if args.rotate:
+        layout_params["rotation"] = args.rotate
+    if args.mirror_x:
+        layout_params["mirror_x"] = True
+    if args.mirror_y:
+        layout_params["mirror_y"] = True
+    if args.vertical_addressing:
+        layout_params["addressing"] = ssd1306_image_layout.ADDRESSING_VERTICAL
+    if args.sh1106:
+        layout_params["ram_width"] = ssd1306_image_layout.SH1106_RAM_WIDTH
+        layout_params["column_offset"] = ssd1306_image_layout.SH1106_COLUMN_OFFSET
+    return layout_params or None
+
+
+def add_encode_arguments(parser):
+    """Add the options of the image file encoding (the options of ssd1306_image_encoder.encode(),
+       see get_encode_options()), also used by ssd1306_image_client.py."""
+    parser.add_argument("-c", "--compress", action="store_true", help="compress output (zlib)")
+    parser.add_argument("--full-frames",    action="store_true", help="convert full frames (disable GIF partial updates)")
+    encoding = parser.add_mutually_exclusive_group()
+    encoding.add_argument("-t", "--tiles",  action="store_true", help="8x8 tiles dictionary encoding (.t or .tz)")
+    encoding.add_argument("--scroll",       action="store_true", help="display start line & changed pages encoding (.s or .sz)")
+    encoding.add_argument("-a", "--adaptive", action="store_true", help="key, repeat or delta frames encoding (.a or .az)")
+    encoding.add_argument("--gray",         help="4 (2 planes) or 8 (3 planes) gray levels with weighted bitplanes (.gr or .grz)", type=int, choices=(2, 3), metavar="PLANES")
+    encoding.add_argument("--aligned",      action="store_true", help="compressed blocks aligned on the flash sectors (.zb)")
+    parser.add_argument("--block-size",     help="block size in bytes for --aligned (default: %(default)s)", type=int, default=ssd1306_image_reader.DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--decode-weight",  help="weight of the decoding cost for --adaptive, 0 for the smallest file (default: %(default)s)", type=float, default=ssd1306_image_encoder.DEFAULT_DECODE_WEIGHT)
+    parser.add_argument("--fps",            help="resample at this frame rate & fit the bus bandwidth (scroll encoding)", type=float, required=False)
+    parser.add_argument("--bus-hz",         help="bus clock in Hz for --fps (default: %(default)s)", type=int, default=ssd1306_image_scheduler.DEFAULT_BUS_HZ)
+    parser.add_argument("--rotate",         help="clockwise rotation in degrees of the image on the panel (default: %(default)s)", type=int, choices=ssd1306_image_layout.ROTATIONS, default=0)
+    parser.add_argument("--mirror-x",       action="store_true", help="horizontal mirroring of the panel")
+    parser.add_argument("--mirror-y",       action="store_true", help="vertical mirroring of the panel")
+    parser.add_argument("--vertical-addressing", action="store_true", help="store the frames column after column (vertical addressing mode)")
+    parser.add_argument("--sh1106",         action="store_true", help="SH1106 panel (132 columns RAM, the panel starts at the column 2)")
+    parser.add_argument("--sprite",         action="store_true", help="crop the frames to the box of their lit pixels (partial-screen animations)")
+
+
+def get_encode_options(args) -> dict:
+    """Return the keyword arguments of ssd1306_image_encoder.encode() of the command line."""
+    encoding = ssd1306_image_reader.ENCODING_FRAMES
+    if args.tiles:
+        encoding = ssd1306_image_reader.ENCODING_TILES
+    elif args.scroll:
+        encoding = ssd1306_image_reader.ENCODING_SCROLL
+    elif args.adaptive:
+        encoding = ssd1306_image_reader.ENCODING_ADAPTIVE
+    elif args.aligned:
+        encoding = ssd1306_image_reader.ENCODING_BLOCKS
+    elif args.gray is not None:
+        encoding = ssd1306_image_reader.ENCODING_GRAY
+    return {"compression": args.compress or args.aligned, "partial_update": not args.full_frames,
+            "encoding": encoding, "fps": args.fps, "bus_hz": args.bus_hz, "decode_weight": args.decode_weight,
+            "layout_params": get_layout_params(args), "block_size": args.block_size, "sprite": args.sprite,
+            "gray_planes": args.gray}
 
 
 def init_argparse() -> argparse.ArgumentParser:
@@ -125,13 +90,67 @@ Convert an animated GIF (or a single image GIF) to an image file for ssd1306-lik
 
 Notes:
  - The ssd1306 image filename uses the format filename.WidthxHeight.Nimg.raw (.z if compressed).
-   For example "my_animation.128x64.42img.z".""",
+   For example "my_animation.128x64.42img.z".
+ - The outputs are written to "filename.tmp" files renamed when the conversion is complete, so
+   a failed conversion keeps the previous outputs.
+ - The input may also be any image PIL can open (animated PNG, animated WebP...), a directory of
+   numbered PNG/BMP files ("my_animation/frame_0001.png"...) or a raw 8-bit gray frames dump
+   "my_animation.128x64.gray", the frames are decoded one at a time.
+ - With --tiles, the 8x8 cells of the frames are stored once in a tiles table and the frames
+   are tile indices (.t, .tz if compressed), smaller & faster to decode for text & UI animations.
+ - With --scroll, the frames are display start line & changed pages updates (.s, .sz if
+   compressed), vertical scrolls only send the newly exposed pages (see SSD1306.show_update()).
+ - With --fps, the animation is resampled at this frame rate with the GIF frames durations and
+   its updates fit in the --bus-hz bandwidth (frames dropped & merged if needed), so it plays
+   in real-time at this frame rate. The scroll encoding is used and the expected bus
+   utilization is reported for each second.
+ - With --adaptive, each frame is stored as a key frame, a repeat or a XOR delta with the
+   previous frame, the one with the smallest size & decoding cost (see --decode-weight) is
+   kept (.a, .az if compressed).
+ - With --rotate, --mirror-x, --mirror-y, --vertical-addressing or --sh1106, the frames are
+   stored in the panel RAM order so the device sends them as they are (see
+   ssd1306_image_layout.py), the size in the filename is the RAM size (132x64 with --sh1106).
+ - With --panels COLUMNSxROWS, the image is a wall of panels (for example 2x1 for a 256x64
+   GIF on two 128x64 panels): each frame is converted once then split in one stream per panel
+   "my_animation_panel<column>_<row>.128x64.42img.z", all the streams have the same frames
+   (see SSD1306_TiledImageReader to update the panels in lockstep).
+ - With --outputs, the frames are also written to these outputs in the same conversion pass
+   (each frame is decoded, dithered & packed once): "raw" & "z" (frames encoding) and "gif",
+   the preview "my_animation-generated.gif" of convert_ssd1306_images_to_animated_gif.py with
+   the GIF frames durations. For example "--compress --outputs raw,gif --stats stats.csv".
+ - With --aligned, the frames are compressed in independent blocks of --block-size bytes
+   aligned on the flash sectors (.zb, always compressed), the device only does aligned reads
+   of whole blocks. With --shard-size, long animations are split in shards of whole blocks
+   "my_animation_shard<n>.128x64.<frames>img.zb" (see SSD1306_ShardedImageReader).
+ - With --gray PLANES, the frames are quantized in 4 (2 planes) or 8 (3 planes) gray levels
+   and stored as weighted bitplanes changed pages updates (.gr, .grz if compressed), the player
+   shows each plane during its weight in display slots (see play_gray() in main.py). The
+   display slot fitting the --bus-hz bandwidth & the plane rates are reported, with a warning
+   when the gray levels flicker (below 50 gray frames/s).
+ - With --sprite, the frames are cropped to the box of all their lit pixels (aligned on 8
+   pixels) and its position on the panel is added to the size "my_animation.32x32+48+16.42img.z",
+   the device only sends this window (see SSD1306.show_sprite()), for partial-screen animations.
+ - With --checkpoint N, the output "my_animation.128x64.42img.z.tmp" is made valid every N
+   frames and the checkpoints are written in a journal "my_animation.128x64.42img.z.journal":
+   if the conversion is interrupted, both are kept and the same command resumes it from the
+   last checkpoint. The output replaces the previous one & the journal is removed at the end.
+ - With --incremental, a manifest "my_animation.128x64.42img.z.manifest" is written next to the
+   image file, the next conversions reuse the frames not modified since the previous one.""",
         formatter_class=argparse.RawTextHelpFormatter,
     )
     parser.add_argument("filename")
-    parser.add_argument("-c", "--compress", action="store_true", help="compress output (zlib)")
     parser.add_argument("-f", "--force",    action="store_true", help="force overwrite")
     parser.add_argument("-v", "--verbose",  action="store_true", help="explain what is being done")
+    add_encode_arguments(parser)
+    parser.add_argument("-i", "--incremental", action="store_true", help="reuse the unmodified frames of the previous conversion")
+    parser.add_argument("--chunk-frames",   help="frames per compressed chunk for --incremental (default: %(default)s)", type=get_positive_int, default=ssd1306_image_encoder.DEFAULT_CHUNK_FRAMES)
+    parser.add_argument("-j", "--jobs",     help="compression threads (default: %(default)s)", type=int, default=1)
+    parser.add_argument("--block-frames",   help="frames per compressed block for --jobs (default: %(default)s)", type=int, default=ssd1306_image_encoder.DEFAULT_BLOCK_FRAMES)
+    parser.add_argument("--shard-size",     help="split --aligned images in shards of this size in bytes at most", type=int, default=0)
+    parser.add_argument("--checkpoint",     help="write a resume checkpoint every CHECKPOINT frames (long videos)", type=int, default=0)
+    parser.add_argument("-o", "--outputs",  help="also write these outputs in the same pass: raw, z, gif (comma separated)", required=False)
+    parser.add_argument("--panels",         help="split the image in COLUMNSxROWS panel streams (for example 2x1)", required=False)
+    parser.add_argument("-s", "--stats",    help="save per-frame statistics to this file (.csv or .json)", required=False)
     return parser
 
 def main() -> None:
@@ -140,7 +159,33 @@ def main() -> None:
     if debug:
         print(args)
 
-    convert(args.verbose, args.compress, args.force, args.filename)
+    outputs = ()
+    if args.outputs is not None:
+        outputs = tuple(args.outputs.split(","))
+        if not set(outputs) <= set(ssd1306_image_encoder.OUTPUTS):
+            print("Error: --outputs {} is not a list of {}".format(args.outputs, ", ".join(ssd1306_image_encoder.OUTPUTS)),
+                  file=sys.stderr)
+            exit(1) # exit with error
+
+    panels = None
+    if args.panels is not None:
+        try:
+            panels = tuple(int(n) for n in args.panels.split("x"))
+        except ValueError:
+            panels = ()
+        if len(panels) != 2 or min(panels) < 1:
+            print("Error: --panels {} is not COLUMNSxROWS (for example 2x1)".format(args.panels), file=sys.stderr)
+            exit(1) # exit with error
+
+    try:
+        ssd1306_image_encoder.convert_file(
+            args.filename, verbose=args.verbose, overwrite=args.force, incremental=args.incremental,
+            chunk_frames=args.chunk_frames, jobs=args.jobs, block_frames=args.block_frames, stats_filename=args.stats,
+            panels=panels, outputs=outputs, checkpoint_frames=args.checkpoint, shard_size=args.shard_size,
+            **get_encode_options(args))
+    except ssd1306_image_encoder.SSD1306_ConversionError as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        exit(1) # exit with error
 
 if __name__ == "__main__":
     main()
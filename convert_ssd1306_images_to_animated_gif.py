@@ -3,13 +3,13 @@
 import argparse
 import os.path
 import sys
+import time
 
-from PIL import Image
-from PIL.GifImagePlugin import GifImageFile
-
-import ssd1306_image_converter
 import ssd1306_image_reader
 
+# Note: PIL and the other helper modules are imported only when converting, so "--help" and
+# "info" (which only needs ssd1306_image_reader) start fast.
+
 DEFAULT_DELAY_MS = 50
 
 debug = False
@@ -25,7 +25,38 @@ def get_pil_image_info_str(img) -> str:
     return str
 
 
-def convert(verbose, overwrite, input_filename, delay_ms):
+def info(input_filename):
+    """Print the information of an image file (or of the images of a bundle)."""
+    if input_filename.endswith(".bundle"):
+        img_bundle = ssd1306_image_reader.SSD1306_ImageBundle(input_filename)
+        print(str(img_bundle))
+        for name in img_bundle.names():
+            img_reader = img_bundle.open(name)
+            print("{}: {}x{}, {} frame{}, compression {}, {} bytes".format(
+                name, img_reader.width, img_reader.height, img_reader.frames, "s" if img_reader.frames > 1 else "",
+                img_reader.compression, img_reader.size))
+            img_reader.close()
+        return
+
+    if not os.path.isfile(input_filename):
+        print("Error: file {} does not exit!".format(input_filename), file=sys.stderr)
+        exit(1) # exit with error
+    img_reader = ssd1306_image_reader.SSD1306_ImageReader(input_filename)
+    img_reader.close()
+    size = os.path.getsize(input_filename)
+    raw_size = img_reader.frames * img_reader.buf_size_in_bytes
+    print(str(img_reader))
+    print("frame size: {} bytes, file size: {} bytes ({:.1f}% of {} bytes)".format(
+        img_reader.buf_size_in_bytes, size, size * 100 / raw_size, raw_size))
+    if not img_reader.compression and img_reader.encoding == ssd1306_image_reader.ENCODING_FRAMES and size != raw_size:
+        print("Warning: file size does not match {} frames ({} frames in the file)".format(
+            img_reader.frames, size / img_reader.buf_size_in_bytes))
+
+
+def convert(verbose, overwrite, input_filename, delay_ms, stats_filename=None):
+    import ssd1306_image_encoder
+    import ssd1306_image_stats
+
     img_reader = ssd1306_image_reader.SSD1306_ImageReader(input_filename)
     w = img_reader.width
     h = img_reader.height
@@ -47,31 +78,35 @@ def convert(verbose, overwrite, input_filename, delay_ms):
             if verbose:
                 print("Warning: file {} already exits and will be overwritten.".format(output_filename))
 
-    img_out = [] # a table of frames (or a single frame)
+    img_out_file = open(output_filename, "wb")
+    img_out_writer = ssd1306_image_encoder.SSD1306_PreviewWriter(img_out_file, w, h, delay_ms)
+
+    img_stats = None
+    if stats_filename is not None:
+        img_stats = ssd1306_image_stats.SSD1306_FrameStats(w, h,
+                                                           ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE if img_reader.compression else None)
 
     for frame in range(img_reader.frames):
         if verbose:
             print("{:5}/{} in progress...".format(frame + 1, img_reader.frames))
 
         # Get the current frame
+        time_start = time.perf_counter()
         img_buf = img_reader.next_frame()
+        if img_stats is not None:
+            img_stats.add_frame(img_buf, (time.perf_counter() - time_start) * 1000)
 
-        # Convert to 2d image
-        tmp = bytearray(img_reader.buf_size_in_bytes) # zeroified by default
-        ssd1306_image_converter.from_ssd1306(w, h, img_buf, tmp)
-
-        # Create a 1-bit PIL image then convert it in palette mode (gif needs palette mode)
-        img_pil = Image.frombuffer("1", (w, h), bytes(tmp), "raw", "1", 0, 1)
-        img_pil = img_pil.convert("P")
-        #if verbose:
-        #    print(get_pil_image_info_str(img))
-
-        img_out.append(img_pil)
+        img_out_writer.write_frame(img_buf)
 
     # Save as animated gif with infinite loop
-    # TODO maybe add a parameter for default duration
     # TODO maybe add a parameter for default loop
-    img_out[0].save(output_filename, save_all = True, append_images = img_out[1:], optimize = True, duration = delay_ms, loop = 0)
+    img_out_writer.finish()
+    img_out_file.close()
+
+    if img_stats is not None:
+        img_stats.save(stats_filename)
+        if verbose:
+            print("{} statistics saved".format(stats_filename))
 
     if verbose:
         print("{} successfully generated :-)".format(output_filename))
@@ -87,22 +122,38 @@ Convert an image file for ssd1306-like OLED panel to an animated GIF (or a singl
 Notes:
  - The ssd1306 image filename uses the format filename.WidthxHeight.Nimg.raw (.z if compressed).
    For example "my_animation.128x64.42img.z".
- - The animated GIF filename is "my_animation-generated.gif".""",
+ - The animated GIF filename is "my_animation-generated.gif".
+ - Use "%(prog)s info filename" to print the image file information only.""",
         formatter_class=argparse.RawTextHelpFormatter,
     )
     parser.add_argument("filename")
     parser.add_argument("-f", "--force",    action="store_true", help="force overwrite")
     parser.add_argument("-v", "--verbose",  action="store_true", help="explain what is being done")
     parser.add_argument("-d", "--delay_ms", help="animation delay in ms (default: %(default)s)", type=int, required=False, default=DEFAULT_DELAY_MS)
+    parser.add_argument("-s", "--stats",    help="save per-frame statistics to this file (.csv or .json)", required=False)
+    return parser
+
+def init_info_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s info filename",
+        description="Print the information (size, frames, compression...) of an image file for ssd1306-like OLED panel or of a bundle.",
+    )
+    parser.add_argument("filename")
     return parser
 
 def main() -> None:
+    # "info" subcommand (a file named "info" can still be converted with "./info")
+    if sys.argv[1:2] == ["info"]:
+        args = init_info_argparse().parse_args(sys.argv[2:])
+        info(args.filename)
+        return
+
     parser = init_argparse()
     args = parser.parse_args()
     if debug:
         print(args)
 
-    convert(args.verbose, args.force, args.filename, args.delay_ms)
+    convert(args.verbose, args.force, args.filename, args.delay_ms, args.stats)
 
 if __name__ == "__main__":
     main()
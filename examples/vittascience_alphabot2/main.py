@@ -1,26 +1,98 @@
 import machine
+import time
 from stm32_alphabot_v2 import AlphaBot_v2
 from stm32_ssd1306 import SSD1306, SSD1306_I2C
 
 import ssd1306_image_reader
 
+# I2C bus clock, the display slot of the gray levels depends on it (see play_gray())
+I2C_BUS_HZ = 400000
+
+# Gray levels flicker when their cycle (all the display slots of a gray frame) is shown less
+# often than this, see GRAY_MIN_REFRESH_HZ of ssd1306_image_scheduler.py
+GRAY_MIN_REFRESH_HZ = 50
+
 alphabot = AlphaBot_v2()
-oled = SSD1306_I2C(128, 64, machine.I2C(1))
+oled = SSD1306_I2C(128, 64, machine.I2C(1, freq=I2C_BUS_HZ))
 
-def test_ssd1306_image_reader(filename):
+def test_ssd1306_image_reader(filename, frame_ms=0):
     img_reader = ssd1306_image_reader.SSD1306_ImageReader(filename)
     print(str(img_reader))
 
-    # Play the animation 2 times to check the loop
+    # Play the animation 2 times to check the loop, a frame every frame_ms if not 0
     frames = img_reader.frames * 2
+    tick = time.ticks_ms()
     for frame in range(frames):
-        print("{:5}/{} in progress...".format(frame + 1, frames))
+        if frame_ms:
+            tick = time.ticks_add(tick, frame_ms)
+            time.sleep_ms(max(0, time.ticks_diff(tick, time.ticks_ms())))
+        else:
+            print("{:5}/{} in progress...".format(frame + 1, frames))
+
+        if img_reader.encoding == ssd1306_image_reader.ENCODING_SCROLL:
+            # Display start line & changed pages only
+            oled.show_update(*img_reader.next_update())
+            continue
 
         # Get the current frame
         img_buf = img_reader.next_frame()
 
-        # Display it
-        oled.send_buffer(img_buf)
+        # Display it, sprites only in their window
+        if img_reader.x or img_reader.y or img_reader.width != oled.width or img_reader.height != oled.height:
+            oled.show_sprite(img_reader.x, img_reader.y, img_reader.width, img_reader.height, img_buf)
+        else:
+            oled.send_buffer(img_buf)
+
+def get_gray_slot_us(img_reader, bus_hz):
+    # Shortest display slot sending each plane update within its slots (the slot reported by the
+    # converter), with the I2C bus model of ssd1306_image_scheduler.py: 9 bits per byte & 2 more
+    # bits per transaction, a transaction of 13 bytes of address window commands & the pages data
+    # per run of changed pages. Also return the display slots of a gray frame.
+    width = img_reader.width
+    slot_us = 0
+    max_slots = 1
+    for plane in range(img_reader.frames):
+        (slots, pages, buf) = img_reader.next_plane()
+        bits = 0
+        while pages:
+            while not pages & 1:
+                pages >>= 1
+            run = 0
+            while pages & 1:
+                pages >>= 1
+                run += 1
+            bits += (1 + 13 + run * width) * 9 + 2
+        slot_us = max(slot_us, -(-bits * 1000000 // (slots * bus_hz)))
+        max_slots = max(max_slots, slots)
+    return (slot_us, (max_slots << 1) - 1)
+
+def play_gray(filename, bus_hz, loops=10):
+    # Grayscale bitplanes (--gray): tight loop sending each plane then waiting for its display
+    # slots, the next plane is read while the current one is displayed
+    img_reader = ssd1306_image_reader.SSD1306_ImageReader(filename)
+    print(str(img_reader))
+    (slot_us, frame_slots) = get_gray_slot_us(img_reader, bus_hz)
+    refresh_hz = 1000000 // (frame_slots * slot_us)
+    print("display slot of {} us at {} Hz, {} gray frames/s".format(slot_us, bus_hz, refresh_hz))
+    if refresh_hz < GRAY_MIN_REFRESH_HZ:
+        print("the gray levels flicker below {} Hz, use a faster bus or smaller images".format(GRAY_MIN_REFRESH_HZ))
+    next_plane = img_reader.next_plane
+    show_update = oled.show_update
+    ticks_us = time.ticks_us
+    ticks_add = time.ticks_add
+    ticks_diff = time.ticks_diff
+
+    planes = img_reader.frames * loops
+    (slots, pages, buf) = next_plane()
+    start = deadline = ticks_us()
+    for plane in range(planes):
+        show_update(0, pages, buf)
+        deadline = ticks_add(deadline, slots * slot_us)
+        (slots, pages, buf) = next_plane()
+        while ticks_diff(deadline, ticks_us()) > 0:
+            pass
+    elapsed_us = ticks_diff(ticks_us(), start)
+    print("{} planes in {} us: {} planes/s".format(planes, elapsed_us, planes * 1000000 // elapsed_us))
 
 
 print("TESTING an animation with compression")
@@ -42,3 +114,20 @@ input("Press enter")
 print("TESTING an animation from a video with compression")
 test_ssd1306_image_reader("video_Big_Buck_Bunny_monow.128x64.200img.z")
 input("Press enter")
+
+print("TESTING an animation with the scroll encoding and compression")
+test_ssd1306_image_reader("animated_python.128x64.36img.sz")
+input("Press enter")
+
+print("TESTING a video scheduled at 25 fps (--fps 25) in real-time")
+test_ssd1306_image_reader("video_Big_Buck_Bunny_monow.128x64.500img.sz", 1000 // 25)
+input("Press enter")
+
+print("TESTING a sprite animation (--sprite) in its window only")
+test_ssd1306_image_reader("ball.32x24+48+16.10img.z")
+input("Press enter")
+
+# The display slot is computed from the planes & the bus clock, at 400 kHz the 2 planes of the
+# full 128x64 frames take 3 slots of 23360 us: 14 gray frames/s, the levels flicker (see the README)
+print("TESTING 4 gray levels (--gray 2) with the display slot of the bus")
+play_gray("animated_python.128x64.72img.grz", I2C_BUS_HZ)
@@ -23,20 +23,54 @@ SET_PRECHARGE = const(0xD9)
 SET_VCOM_DESEL = const(0xDB)
 SET_CHARGE_PUMP = const(0x8D)
 
+
+# NEW CLASS: Optional bus accounting, useful to measure the gain of the batched transfers.
+# Enable it with "oled.bus_stats = SSD1306_BusStats()", disable it with "oled.bus_stats = None".
+class SSD1306_BusStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0  # bus transactions since the last reset
+        self.bytes = 0         # bus bytes (address byte included) since the last reset
+        self.frames = 0        # frames sent since the last reset
+        self.frame_transactions = 0  # bus transactions of the last frame
+        self.frame_bytes = 0         # bus bytes of the last frame
+        self._frame_start = (0, 0)
+
+    def add(self, nbytes):
+        self.transactions += 1
+        self.bytes += nbytes + 1  # +1 for the i2c address byte
+
+    def end_frame(self):
+        self.frames += 1
+        self.frame_transactions = self.transactions - self._frame_start[0]
+        self.frame_bytes = self.bytes - self._frame_start[1]
+        self._frame_start = (self.transactions, self.bytes)
+
+    def __str__(self):
+        return "{} frames, {} transactions, {} bytes, last frame: {} transactions, {} bytes".format(
+            self.frames, self.transactions, self.bytes, self.frame_transactions, self.frame_bytes)
+
+
 # Subclassing FrameBuffer provides support for graphics primitives
 # http://docs.micropython.org/en/latest/pyboard/library/framebuf.html
 class SSD1306(framebuf.FrameBuffer):
-    def __init__(self, width, height, external_vcc):
+    def __init__(self, width, height, external_vcc, batch=True):
         self.width = width
         self.height = height
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        # batch=True sends command lists in a single bus transaction, batch=False sends
+        # one transaction per command byte (original behavior, kept for comparison)
+        self.batch = batch
+        self.bus_stats = None
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
     def init_display(self):
-        for cmd in (
+        self.write_cmds((
             SET_DISP,  # display off
             # address setting
             SET_MEM_ADDR,
@@ -67,8 +101,8 @@ class SSD1306(framebuf.FrameBuffer):
             SET_CHARGE_PUMP,
             0x10 if self.external_vcc else 0x14,
             SET_DISP | 0x01,  # display on
-        ):  # on
-            self.write_cmd(cmd)
+        ))
+        self.start_line = 0
         self.fill(0)
         self.show()
 
@@ -79,50 +113,77 @@ class SSD1306(framebuf.FrameBuffer):
         self.write_cmd(SET_DISP | 0x01)
 
     def contrast(self, contrast):
-        self.write_cmd(SET_CONTRAST)
-        self.write_cmd(contrast)
+        self.write_cmds((SET_CONTRAST, contrast))
 
     def invert(self, invert):
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
     def rotate(self, rotate):
-        self.write_cmd(SET_COM_OUT_DIR | ((rotate & 1) << 3))
-        self.write_cmd(SET_SEG_REMAP | (rotate & 1))
+        self.write_cmds((SET_COM_OUT_DIR | ((rotate & 1) << 3), SET_SEG_REMAP | (rotate & 1)))
+
+    def addressing(self, vertical):
+        # Images converted with --vertical-addressing are sent column after column
+        self.write_cmds((SET_MEM_ADDR, vertical & 1))
 
     def show(self):
-        x0 = 0
-        x1 = self.width - 1
-        if self.width == 64:
-            # displays with width of 64 pixels are shifted by 32
-            x0 += 32
-            x1 += 32
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        self.send_buffer(self.buffer)
 
     # NEW FUNCTION: Send a full screen buffer (ssd1306 format)
     def send_buffer(self, buffer):
-        x0 = 0
-        x1 = self.width - 1
+        self.send_window(0, self.width - 1, 0, self.pages - 1, buffer)
+
+    # NEW FUNCTION: Set the columns [x0, x1] & pages [p0, p1] address window then send
+    # the buffer (ssd1306 format) into it, in a single bus transaction when batching
+    def send_window(self, x0, x1, p0, p1, buffer, end_frame=True):
         if self.width == 64:
             # displays with width of 64 pixels are shifted by 32
             x0 += 32
             x1 += 32
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(buffer)
+        self.write_cmds_and_data((SET_COL_ADDR, x0, x1, SET_PAGE_ADDR, p0, p1), buffer)
+        if end_frame and self.bus_stats is not None:
+            self.bus_stats.end_frame()
+
+    # NEW FUNCTION: Display a sprite image (converted with --sprite) frame at its position,
+    # only its window of the panel is sent (x & width on 8 pixels, y & height on the pages)
+    def show_sprite(self, x, y, width, height, buffer):
+        self.send_window(x, x + width - 1, y // 8, (y + height) // 8 - 1, buffer)
+
+    # NEW FUNCTION: Display an update of a scroll image (see SSD1306_ImageReader.next_update()):
+    # set the display start line if changed then send the changed pages (bit n for page n),
+    # consecutive pages in a single address window
+    def show_update(self, start_line, pages, buffer):
+        if start_line != self.start_line:
+            self.write_cmd(SET_DISP_START_LINE | start_line)
+            self.start_line = start_line
+        buffer = memoryview(buffer)
+        pos = 0
+        page = 0
+        while pages >> page:
+            if not (pages >> page) & 1:
+                page += 1
+                continue
+            p0 = page
+            while (pages >> page) & 1:
+                page += 1
+            size = (page - p0) * self.width
+            self.send_window(0, self.width - 1, p0, page - 1, buffer[pos : pos + size], False)
+            pos += size
+        if self.bus_stats is not None:
+            self.bus_stats.end_frame()
+
+    # NEW FUNCTION: Send a list of commands (generic version, one transaction per command)
+    def write_cmds(self, cmds):
+        for cmd in cmds:
+            self.write_cmd(cmd)
+
+    # NEW FUNCTION: Send a list of commands then data (generic version)
+    def write_cmds_and_data(self, cmds, buf):
+        self.write_cmds(cmds)
+        self.write_data(buf)
 
 
 class SSD1306_I2C(SSD1306):
-    def __init__(self, width, height, i2c, addr=SSD1306_I2C_ADDR, external_vcc=False):
+    def __init__(self, width, height, i2c, addr=SSD1306_I2C_ADDR, external_vcc=False, batch=True):
         if i2c == None:
             raise ValueError("I2C object 'SSD1306' needed as argument!")
         self._i2c = i2c
@@ -134,13 +195,45 @@ class SSD1306_I2C(SSD1306):
         self._addr = addr
         self.temp = bytearray(2)
         self.write_list = [b"\x40", None]  # Co=0, D/C#=1
-        super().__init__(width, height, external_vcc)
+        # Address window commands (6 x "Co=1, D/C#=0" + command) then "Co=0, D/C#=1"
+        self.window_cmds = bytearray(6 * 2 + 1)
+        for i in range(6):
+            self.window_cmds[i * 2] = 0x80  # Co=1, D/C#=0
+        self.window_cmds[6 * 2] = 0x40  # Co=0, D/C#=1
+        self.window_list = [self.window_cmds, None]
+        super().__init__(width, height, external_vcc, batch)
 
     def write_cmd(self, cmd):
         self.temp[0] = 0x80  # Co=1, D/C#=0
         self.temp[1] = cmd
         self._i2c.writeto(self._addr, self.temp)
+        if self.bus_stats is not None:
+            self.bus_stats.add(2)
 
     def write_data(self, buf):
         self.write_list[1] = buf
         self._i2c.writevto(self._addr, self.write_list)
+        if self.bus_stats is not None:
+            self.bus_stats.add(1 + len(buf))
+
+    def write_cmds(self, cmds):
+        if not self.batch:
+            return super().write_cmds(cmds)
+        # Co=0, D/C#=0: all the following bytes are commands
+        buf = bytearray(1 + len(cmds))
+        buf[1:] = bytes(cmds)
+        self._i2c.writeto(self._addr, buf)
+        if self.bus_stats is not None:
+            self.bus_stats.add(len(buf))
+
+    def write_cmds_and_data(self, cmds, buf):
+        if not self.batch or len(cmds) != 6:
+            return super().write_cmds_and_data(cmds, buf)
+        # Commands with Co=1 can be followed by another control byte, so the
+        # address window and the data are sent in a single transaction
+        for i in range(6):
+            self.window_cmds[i * 2 + 1] = cmds[i]
+        self.window_list[1] = buf
+        self._i2c.writevto(self._addr, self.window_list)
+        if self.bus_stats is not None:
+            self.bus_stats.add(len(self.window_cmds) + len(buf))
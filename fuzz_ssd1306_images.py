@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import ssd1306_image_converter
+import ssd1306_image_encoder
+import ssd1306_image_layout
+import ssd1306_image_reader
+
+# Note: each check compares a fast path with its reference (the loops of
+# ssd1306_image_converter.py or the frames written to the file), bit for bit, on random
+# cases. A failing case is shrunk (fewer frames, smaller sizes) then printed as JSON so it
+# can be replayed with --case. Add the new fast paths to CHECKS.
+
+DEFAULT_CASES = 200
+MAX_WIDTH = 256
+MAX_HEIGHT = 64 # panel RAM height, needed by the scroll encoding
+MAX_FRAMES = 40
+
+# Reader variants: (encoding, compression, jobs), "z-jobs" is the chunked stream of --jobs
+READER_VARIANTS = {
+    "raw":    (ssd1306_image_reader.ENCODING_FRAMES, False, 1),
+    "z":      (ssd1306_image_reader.ENCODING_FRAMES, True, 1),
+    "z-jobs": (ssd1306_image_reader.ENCODING_FRAMES, True, 2),
+    "t":      (ssd1306_image_reader.ENCODING_TILES, False, 1),
+    "tz":     (ssd1306_image_reader.ENCODING_TILES, True, 1),
+    "s":      (ssd1306_image_reader.ENCODING_SCROLL, False, 1),
+    "sz":     (ssd1306_image_reader.ENCODING_SCROLL, True, 1),
+    "a":      (ssd1306_image_reader.ENCODING_ADAPTIVE, False, 1),
+    "az":     (ssd1306_image_reader.ENCODING_ADAPTIVE, True, 1),
+    "zb":     (ssd1306_image_reader.ENCODING_BLOCKS, True, 1),
+    "gr":     (ssd1306_image_reader.ENCODING_GRAY, False, 1),
+    "grz":    (ssd1306_image_reader.ENCODING_GRAY, True, 1),
+}
+
+debug = False
+
+
+class NotApplicable(Exception):
+    """The case can not be encoded with this variant (too many tiles...), it is skipped."""
+
+
+def get_random_rows(rng, width, height, frames):
+    """Return random 1-bit per pixel 2d images (width x height): noise of various densities,
+       repeats, few changed pixels & vertical scrolls of the previous image, blank images."""
+    size = (width * height) // 8
+    row_size = width // 8
+    imgs = []
+    for frame in range(frames):
+        kind = rng.choice(("noise", "noise", "repeat", "pixels", "scroll", "blank")) if imgs else "noise"
+        if kind == "noise":
+            density = rng.choice((0.25, 0.5, 0.75))
+            bits = rng.getrandbits(size * 8)
+            if density == 0.25:
+                bits &= rng.getrandbits(size * 8)
+            elif density == 0.75:
+                bits |= rng.getrandbits(size * 8)
+            img = bits.to_bytes(size, "big")
+        elif kind == "repeat":
+            img = imgs[-1]
+        elif kind == "pixels":
+            img = bytearray(imgs[-1])
+            for i in range(rng.randint(1, 16)):
+                img[rng.randrange(size)] ^= 1 << rng.randrange(8)
+            img = bytes(img)
+        elif kind == "scroll":
+            shift = rng.randrange(1, height) * row_size
+            img = imgs[-1][shift:] + imgs[-1][:shift]
+        else:
+            img = bytes(size)
+        imgs.append(img)
+    return imgs
+
+
+def to_ssd1306(width, height, img):
+    buf = bytearray((width * height) // 8)
+    ssd1306_image_converter.to_ssd1306(width, height, img, buf)
+    return buf
+
+
+def get_pil_image(width, height, img):
+    from PIL import Image
+    return Image.frombytes("1", (width, height), bytes(img))
+
+
+def check_to_ssd1306(case):
+    """Layout permutation table (SSD1306_Layout.convert) against to_ssd1306()."""
+    (width, height) = (case["width"], case["height"])
+    imgs = get_random_rows(random.Random(case["seed"]), width, height, case["frames"])
+    layout = ssd1306_image_layout.SSD1306_Layout(width, height)
+    (ref_s, fast_s) = (0, 0)
+    for (frame, img) in enumerate(imgs):
+        time_start = time.perf_counter()
+        ref = to_ssd1306(width, height, img)
+        ref_s += time.perf_counter() - time_start
+        time_start = time.perf_counter()
+        fast = layout.convert(get_pil_image(width, height, img))
+        fast_s += time.perf_counter() - time_start
+        if bytes(fast) != bytes(ref):
+            return ("frame {} differs".format(frame), ref_s, fast_s)
+    return (None, ref_s, fast_s)
+
+
+def check_to_ssd1306_window(case):
+    """Partial update (to_ssd1306_window of the changed pages & columns) against a full to_ssd1306()."""
+    (width, height) = (case["width"], case["height"])
+    rng = random.Random(case["seed"])
+    imgs = get_random_rows(rng, width, height, case["frames"])
+    buf = to_ssd1306(width, height, imgs[0])
+    img = get_pil_image(width, height, imgs[0])
+    (ref_s, fast_s) = (0, 0)
+    for (frame, new_img) in enumerate(imgs[1:], 1):
+        # Window of the changes aligned on 8 pixels, like get_gif_frame_changed_box()
+        x0 = rng.randrange(0, width, 8)
+        x1 = rng.randrange(x0 + 8, width + 8, 8)
+        y0 = rng.randrange(0, height, 8)
+        y1 = rng.randrange(y0 + 8, height + 8, 8)
+        img.paste(get_pil_image(width, height, new_img).crop((x0, y0, x1, y1)), (x0, y0))
+        time_start = time.perf_counter()
+        ref = to_ssd1306(width, height, img.tobytes())
+        ref_s += time.perf_counter() - time_start
+        time_start = time.perf_counter()
+        window_buf = img.crop((x0, y0, x1, y1)).tobytes(encoder_name = "raw")
+        ssd1306_image_converter.to_ssd1306_window(width, x0, y0, x1 - x0, y1 - y0, window_buf, buf)
+        fast_s += time.perf_counter() - time_start
+        if buf != ref:
+            return ("frame {} window {} differs".format(frame, (x0, y0, x1, y1)), ref_s, fast_s)
+    return (None, ref_s, fast_s)
+
+
+def check_from_ssd1306(case):
+    """from_ssd1306() against the source images of the layout conversion (round trip)."""
+    (width, height) = (case["width"], case["height"])
+    imgs = get_random_rows(random.Random(case["seed"]), width, height, case["frames"])
+    layout = ssd1306_image_layout.SSD1306_Layout(width, height)
+    ref_s = 0
+    for (frame, img) in enumerate(imgs):
+        buf = layout.convert(get_pil_image(width, height, img))
+        time_start = time.perf_counter()
+        out = bytearray(len(buf))
+        ssd1306_image_converter.from_ssd1306(width, height, buf, out)
+        ref_s += time.perf_counter() - time_start
+        if out != img:
+            return ("frame {} differs".format(frame), ref_s, None)
+    return (None, ref_s, None) # no fast path yet
+
+
+def write_image(f, bufs, width, height, variant):
+    # Same encoders & writer settings as ssd1306_image_encoder.convert_file(), return
+    # the frames returned by next_frame() for a loop of the image (the planes for the gray)
+    (encoding, compression, jobs) = READER_VARIANTS[variant]
+    writer = ssd1306_image_encoder.SSD1306_ImageWriter(f, compression and encoding != ssd1306_image_reader.ENCODING_BLOCKS,
+                                                       ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE,
+                                                       3 if jobs > 1 else 0, True, jobs)
+    try:
+        if encoding == ssd1306_image_reader.ENCODING_TILES:
+            tiles_encoder = ssd1306_image_encoder.SSD1306_TilesEncoder()
+            for buf in bufs:
+                tiles_encoder.add_frame(buf)
+            writer.write_frame(tiles_encoder.get_data())
+        elif encoding == ssd1306_image_reader.ENCODING_SCROLL:
+            scroll_encoder = ssd1306_image_encoder.SSD1306_ScrollEncoder(width, height)
+            for buf in bufs:
+                writer.write_frame(scroll_encoder.add_frame(buf))
+        elif encoding == ssd1306_image_reader.ENCODING_ADAPTIVE:
+            adaptive_encoder = ssd1306_image_encoder.SSD1306_AdaptiveEncoder(width, height, compression)
+            for buf in bufs:
+                writer.write_frame(adaptive_encoder.add_frame(buf))
+        elif encoding == ssd1306_image_reader.ENCODING_BLOCKS:
+            # Smallest block size holding a noise frame
+            block_size = max(ssd1306_image_reader.MIN_BLOCK_SIZE, 1 << (2 * len(bufs[0])).bit_length())
+            block_encoder = ssd1306_image_encoder.SSD1306_BlockEncoder(block_size)
+            for buf in bufs:
+                for block in block_encoder.add_frame(buf):
+                    writer.write_frame(block)
+            for block in block_encoder.flush():
+                writer.write_frame(block)
+        elif encoding == ssd1306_image_reader.ENCODING_GRAY:
+            # The planes of the gray frame n are the frames n & n + 1 (in the order of the encoder)
+            gray_encoder = ssd1306_image_encoder.SSD1306_GrayEncoder(width, height, 2)
+            gray_bufs = [(buf, bufs[(frame + 1) % len(bufs)]) for (frame, buf) in enumerate(bufs)]
+            for planes in gray_bufs:
+                for data in gray_encoder.add_frame(planes):
+                    writer.write_frame(data)
+            bufs = [gray_bufs[plane // 2][slots.bit_length() - 1]
+                    for (plane, (slots, pages)) in enumerate(gray_encoder.updates)]
+        else:
+            for buf in bufs:
+                writer.write_frame(buf)
+    except ssd1306_image_encoder.SSD1306_ConversionError as e:
+        raise NotApplicable(str(e))
+    writer.finish()
+    return bufs
+
+
+def read_frames(filename, config, offset, size, encoding, read_size, frames):
+    # Return the frames read (copies) & the reading time, the "DEBUG ME" messages of the
+    # reader (unconsumed_tail branch) are counted in reader_debug_hits
+    img_reader = ssd1306_image_reader.SSD1306_ImageReader(filename, config, offset, size, encoding)
+    if read_size is not None and hasattr(img_reader, "f_read_size"):
+        img_reader.f_read_size = read_size
+    bufs = []
+    output = io.StringIO()
+    time_start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        for frame in range(frames):
+            bufs.append(bytes(img_reader.next_frame()))
+    time_s = time.perf_counter() - time_start
+    img_reader.close()
+    reader_debug_hits[0] += output.getvalue().count("DEBUG ME")
+    return (bufs, time_s)
+
+reader_debug_hits = [0]
+
+
+def check_reader(case):
+    """SSD1306_ImageReader.next_frame() of an encoding against the frames written, for more
+       than 2 loops (loop-around), with the image in the middle of a file (bundle) & a random
+       read size (compressed chunks boundaries). The reference time is the .raw reading."""
+    (width, height, frames) = (case["width"], case["height"], case["frames"])
+    rng = random.Random(case["seed"])
+    bufs = [bytes(to_ssd1306(width, height, img)) for img in get_random_rows(rng, width, height, frames)]
+    (encoding, compression, jobs) = READER_VARIANTS[case["variant"]]
+
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "fuzz")
+        data = io.BytesIO()
+        bufs = write_image(data, bufs, width, height, case["variant"])
+        data = data.getvalue()
+        frames = len(bufs)
+        read_frames_count = frames * 2 + rng.randrange(frames + 1)
+        expected = [bufs[frame % frames] for frame in range(read_frames_count)]
+        # The image is surrounded by other data (bundle), at offset 0 it is the whole file
+        (offset, padding) = (case["offset"], case["offset"] and rng.randrange(1, 64))
+        with open(filename, "wb") as f:
+            f.write(bytes(rng.getrandbits(8) for i in range(offset)) + data + bytes(b ^ 0x5A for b in data[:padding]))
+        size = len(data) if offset else None
+        config = (width, height, frames, compression)
+        (out, fast_s) = read_frames(filename, config, offset, size, encoding, case["read_size"], read_frames_count)
+
+        # Reference: the same frames read from a .raw file
+        with open(filename, "wb") as f:
+            f.write(b"".join(bufs))
+        (raw, ref_s) = read_frames(filename, (width, height, frames, False), 0, None,
+                                   ssd1306_image_reader.ENCODING_FRAMES, None, read_frames_count)
+    if raw != expected:
+        return ("the .raw reference reader differs", ref_s, fast_s)
+    for (frame, buf) in enumerate(out):
+        if buf != expected[frame]:
+            return ("frame {} (loop {}) differs".format(frame, frame // frames), ref_s, fast_s)
+    return (None, ref_s, fast_s)
+
+
+def check_reader_stats(case):
+    """SSD1306_ImageReader.enable_stats() frames count after one loop of next_frame() (and
+       of next_update() or next_plane() with the scroll & gray encodings) against the frames
+       of the image."""
+    (width, height, frames) = (case["width"], case["height"], case["frames"])
+    rng = random.Random(case["seed"])
+    bufs = [bytes(to_ssd1306(width, height, img)) for img in get_random_rows(rng, width, height, frames)]
+    (encoding, compression, jobs) = READER_VARIANTS[case["variant"]]
+    next_methods = ["next_frame"]
+    if encoding == ssd1306_image_reader.ENCODING_SCROLL:
+        next_methods.append("next_update")
+    elif encoding == ssd1306_image_reader.ENCODING_GRAY:
+        next_methods.append("next_plane")
+
+    ref_s = 0
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "fuzz")
+        with open(filename, "wb") as f:
+            frames = len(write_image(f, bufs, width, height, case["variant"]))
+        for next_method in next_methods:
+            img_reader = ssd1306_image_reader.SSD1306_ImageReader(filename, (width, height, frames, compression),
+                                                                  encoding=encoding)
+            img_stats = img_reader.enable_stats()
+            time_start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for frame in range(frames):
+                    getattr(img_reader, next_method)()
+            ref_s += time.perf_counter() - time_start
+            img_reader.close()
+            if img_stats.frames != frames:
+                return ("{}: {} frames counted for {}".format(next_method, img_stats.frames, frames), ref_s, None)
+    return (None, ref_s, None) # no fast path, the reading time with the stats
+
+
+def check_sequence(case):
+    """Frames of a numbered PNG sequence directory (ssd1306_image_sources) against
+       to_ssd1306() of the images written. A sequence with a file of another size must raise
+       SSD1306_ConversionError and the conversion must keep the previous output."""
+    (width, height, frames) = (case["width"], case["height"], case["frames"])
+    rng = random.Random(case["seed"])
+    imgs = get_random_rows(rng, width, height, frames)
+    bad_frame = rng.choice((None, rng.randrange(1, frames))) if frames > 1 else None
+    ref = [bytes(to_ssd1306(width, height, img)) for img in imgs]
+
+    with tempfile.TemporaryDirectory() as dirname:
+        sequence = os.path.join(dirname, "seq")
+        os.mkdir(sequence)
+        for (frame, img) in enumerate(imgs):
+            img = get_pil_image(width, height, img)
+            if frame == bad_frame:
+                img = img.crop((0, 0, width + 8, height))
+            img.save(os.path.join(sequence, "frame_{:04}.png".format(frame + 1)))
+        time_start = time.perf_counter()
+        try:
+            out = list(ssd1306_image_encoder.convert_frames(sequence))
+        except ssd1306_image_encoder.SSD1306_ConversionError as e:
+            out = e
+        ref_s = time.perf_counter() - time_start
+        if bad_frame is None:
+            if out != ref:
+                return ("frames differ: {}".format(out) if isinstance(out, Exception) else "frames differ", ref_s, None)
+            return (None, ref_s, None)
+        if not isinstance(out, Exception):
+            return ("no error for the frame {} of another size".format(bad_frame), ref_s, None)
+
+        # The failed conversion keeps the previous output & leaves no temporary file
+        output_filename = ssd1306_image_encoder.get_image_filename(sequence, (width, height, frames, True))
+        with open(output_filename, "wb") as f:
+            f.write(b"previous")
+        try:
+            ssd1306_image_encoder.convert_file(sequence, compression=True, overwrite=True)
+        except ssd1306_image_encoder.SSD1306_ConversionError:
+            pass
+        else:
+            return ("the conversion did not fail", ref_s, None)
+        with open(output_filename, "rb") as f:
+            if f.read() != b"previous":
+                return ("the previous output was replaced", ref_s, None)
+        if sorted(os.listdir(dirname)) != sorted(["seq", os.path.basename(output_filename)]):
+            return ("files left: {}".format(sorted(os.listdir(dirname))), ref_s, None)
+    return (None, ref_s, None) # no fast path, the sequence decoding time
+
+
+def check_checkpoint(case):
+    """Conversion with --checkpoint interrupted at a random frame (a sequence file of another
+       size) then run again: the previous output must be kept until the end, the partial output
+       & the journal must be kept by the interrupted conversion, and the frames before the last
+       checkpoint must not be converted again (the source frames are modified in between). A
+       partial output modified before the checkpoint offset must give a full conversion."""
+    (width, height, frames) = (case["width"], case["height"], case["frames"])
+    if frames < 2:
+        return (None, 0, None)
+    rng = random.Random(case["seed"])
+    imgs = get_random_rows(rng, width, height, frames)
+    new_imgs = get_random_rows(rng, width, height, frames)
+    (bad_frame, checkpoint_frames) = (rng.randrange(1, frames), rng.randrange(1, frames))
+    checkpoint_frame = bad_frame // checkpoint_frames * checkpoint_frames
+    corrupt = rng.random() < 0.25
+
+    with tempfile.TemporaryDirectory() as dirname:
+        sequence = os.path.join(dirname, "seq")
+        os.mkdir(sequence)
+        def save_frames(imgs, bad_frame):
+            for (frame, img) in enumerate(imgs):
+                img = get_pil_image(width, height, img)
+                if frame == bad_frame:
+                    img = img.crop((0, 0, width + 8, height))
+                img.save(os.path.join(sequence, "frame_{:04}.png".format(frame + 1)))
+        save_frames(imgs, bad_frame)
+        output_filename = ssd1306_image_encoder.get_image_filename(sequence, (width, height, frames, True))
+        partial_filename = ssd1306_image_encoder.get_partial_filename(output_filename)
+        journal_filename = ssd1306_image_encoder.get_journal_filename(output_filename)
+        with open(output_filename, "wb") as f:
+            f.write(b"previous")
+
+        time_start = time.perf_counter()
+        try:
+            ssd1306_image_encoder.convert_file(sequence, compression=True, overwrite=True,
+                                               checkpoint_frames=checkpoint_frames)
+        except ssd1306_image_encoder.SSD1306_ConversionError:
+            pass
+        else:
+            return ("the conversion was not interrupted", 0, None)
+        with open(output_filename, "rb") as f:
+            if f.read() != b"previous":
+                return ("the previous output was replaced by the interrupted conversion", 0, None)
+        if not os.path.isfile(partial_filename) or not os.path.isfile(journal_filename):
+            return ("files left by the interrupted conversion: {}".format(sorted(os.listdir(dirname))), 0, None)
+
+        # A killed conversion may leave data after the last checkpoint
+        with open(partial_filename, "ab") as f:
+            f.write(bytes(rng.getrandbits(8) for i in range(rng.randrange(64))))
+        if corrupt:
+            with open(partial_filename, "r+b") as f:
+                f.write(b"\xff" * 16)
+        save_frames(new_imgs, None)
+        ssd1306_image_encoder.convert_file(sequence, compression=True, overwrite=True,
+                                           checkpoint_frames=checkpoint_frames)
+        ref_s = time.perf_counter() - time_start
+
+        if sorted(os.listdir(dirname)) != sorted(["seq", os.path.basename(output_filename)]):
+            return ("files left: {}".format(sorted(os.listdir(dirname))), ref_s, None)
+        (out, read_s) = read_frames(output_filename, (width, height, frames, True), 0, None,
+                                    ssd1306_image_reader.ENCODING_FRAMES, None, frames)
+    # The corrupted partial output differs from the checkpoint hash (its first bytes)
+    resumed = imgs[:checkpoint_frame] if not corrupt else []
+    expected = [bytes(to_ssd1306(width, height, img)) for img in resumed + new_imgs[len(resumed):]]
+    for (frame, buf) in enumerate(out):
+        if buf != expected[frame]:
+            return ("frame {} differs (checkpoint of the frame {})".format(frame, checkpoint_frame), ref_s, None)
+    return (None, ref_s, None) # no fast path, the conversions time
+
+
+# encode() options of the "encode" check variants
+ENCODE_VARIANTS = {
+    "raw":     {},
+    "z":       {"compression": True},
+    "z-jobs":  {"compression": True, "jobs": 2, "block_frames": 3},
+    "tz":      {"compression": True, "encoding": ssd1306_image_reader.ENCODING_TILES},
+    "sz":      {"compression": True, "encoding": ssd1306_image_reader.ENCODING_SCROLL},
+    "s-fps":   {"fps": 7},
+    "az":      {"compression": True, "encoding": ssd1306_image_reader.ENCODING_ADAPTIVE},
+    "zb":      {"compression": True, "encoding": ssd1306_image_reader.ENCODING_BLOCKS, "block_size": 1 << 15},
+    "grz":     {"compression": True, "encoding": ssd1306_image_reader.ENCODING_GRAY, "gray_planes": 2},
+    "gr3":     {"encoding": ssd1306_image_reader.ENCODING_GRAY, "gray_planes": 3},
+    "sprite":  {"compression": True, "sprite": True},
+    "layout":  {"compression": True, "layout_params": {"rotation": 180, "mirror_x": True}},
+    "full":    {"compression": True, "partial_update": False},
+}
+
+
+def check_encode(case):
+    """ssd1306_image_encoder.encode() of a numbered PNG sequence against the output file of
+       convert_file() with the same options (the file content & its filename)."""
+    (width, height, frames) = (case["width"], case["height"], case["frames"])
+    rng = random.Random(case["seed"])
+    imgs = get_random_rows(rng, width, height, frames)
+    options = ENCODE_VARIANTS[rng.choice(sorted(ENCODE_VARIANTS))]
+
+    with tempfile.TemporaryDirectory() as dirname:
+        sequence = os.path.join(dirname, "seq")
+        os.mkdir(sequence)
+        for (frame, img) in enumerate(imgs):
+            get_pil_image(width, height, img).save(os.path.join(sequence, "frame_{:04}.png".format(frame + 1)))
+        time_start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                ssd1306_image_encoder.convert_file(sequence, **options)
+        except ssd1306_image_encoder.SSD1306_ConversionError as e:
+            ref = e
+        else:
+            filenames = sorted(os.listdir(dirname))
+            filenames.remove("seq")
+            if len(filenames) != 1:
+                return ("output files: {}".format(filenames), 0, None)
+            with open(os.path.join(dirname, filenames[0]), "rb") as f:
+                ref = (filenames[0], f.read())
+        ref_s = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        try:
+            (data, config, encoding, position) = ssd1306_image_encoder.encode(sequence, **options)
+        except ssd1306_image_encoder.SSD1306_ConversionError as e:
+            out = e
+        else:
+            out = (os.path.basename(ssd1306_image_encoder.get_image_filename(sequence, config, encoding, position)), data)
+        fast_s = time.perf_counter() - time_start
+    if isinstance(ref, Exception) or isinstance(out, Exception):
+        if str(ref) != str(out):
+            return ("{}: convert_file() {}, encode() {}".format(options, ref, out), ref_s, fast_s)
+    elif out[0] != ref[0]:
+        return ("{}: filename {} instead of {}".format(options, out[0], ref[0]), ref_s, fast_s)
+    elif out[1] != ref[1]:
+        return ("{}: the content differs".format(options), ref_s, fast_s)
+    return (None, ref_s, fast_s)
+
+
+# Check name: (check function, needs the reader parameters)
+CHECKS = {
+    "to_ssd1306":        (check_to_ssd1306, False),
+    "to_ssd1306_window": (check_to_ssd1306_window, False),
+    "from_ssd1306":      (check_from_ssd1306, False),
+    "reader":            (check_reader, True),
+    "reader_stats":      (check_reader_stats, True),
+    "sequence":          (check_sequence, False),
+    "checkpoint":        (check_checkpoint, False),
+    "encode":            (check_encode, False),
+}
+
+
+def get_random_case(rng, check, max_width, max_height, max_frames):
+    case = {"check": check, "seed": rng.getrandbits(32),
+            "width": rng.randrange(8, max_width + 8, 8), "height": rng.randrange(8, max_height + 8, 8),
+            "frames": rng.randint(1, max_frames)}
+    if CHECKS[check][1]:
+        case["variant"] = rng.choice(list(READER_VARIANTS))
+        case["offset"] = rng.choice((0, 0, rng.randrange(1, 1024)))
+        case["read_size"] = rng.choice((None, None, rng.randint(1, 1024)))
+    return case
+
+
+def run_case(case):
+    """Return the error (None if the fast path gives the reference result) & the times."""
+    try:
+        return CHECKS[case["check"]][0](case)
+    except NotApplicable:
+        raise
+    except Exception as e:
+        return ("{}: {}".format(type(e).__name__, e), 0, 0)
+
+
+def get_smaller_cases(case):
+    # Candidates from the smallest to the closest to the case
+    for (key, minimum, step) in (("frames", 1, 1), ("width", 8, 8), ("height", 8, 8), ("offset", 0, 1)):
+        value = case.get(key)
+        if value is None or value <= minimum:
+            continue
+        for smaller in (minimum, (value // 2) // step * step, value - step):
+            if minimum <= smaller < value:
+                yield dict(case, **{key: smaller})
+    if case.get("read_size") is not None:
+        yield dict(case, read_size=None)
+
+
+def shrink(case):
+    """Return the smallest failing case found from a failing case & its error."""
+    error = run_case(case)[0]
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for smaller in get_smaller_cases(case):
+            try:
+                smaller_error = run_case(smaller)[0]
+            except NotApplicable:
+                continue
+            if smaller_error is not None:
+                (case, error, shrunk) = (smaller, smaller_error, True)
+                break
+    return (case, error)
+
+
+def fuzz(verbose, cases, seed, checks, max_width, max_height, max_frames, replay_case):
+    rng = random.Random(seed)
+    if replay_case is not None:
+        todo = [replay_case]
+    else:
+        todo = [get_random_case(rng, checks[i % len(checks)], max_width, max_height, max_frames) for i in range(cases)]
+
+    # Throughput per fast path (check or reader variant): cases, failures, bytes, times
+    paths = {}
+    failures = []
+    for case in todo:
+        try:
+            (error, ref_s, fast_s) = run_case(case)
+        except NotApplicable as e:
+            if verbose:
+                print("skipped {}: {}".format(json.dumps(case), e))
+            continue
+        name = case["check"] + ("/" + case["variant"] if "variant" in case else "")
+        path = paths.setdefault(name, {"cases": 0, "failures": 0, "bytes": 0, "ref_s": 0, "fast_s": 0})
+        path["cases"] += 1
+        path["bytes"] += (case["width"] * case["height"] * case["frames"]) // 8
+        path["ref_s"] += ref_s
+        path["fast_s"] += fast_s or 0 # 0 when there is no fast path
+        if error is not None:
+            path["failures"] += 1
+            (small_case, small_error) = shrink(case)
+            failures.append((case, small_case, small_error))
+            print("FAILED {}: {}".format(name, error))
+            print("  shrunk to: --case '{}'".format(json.dumps(small_case)))
+            print("  {}".format(small_error))
+        elif verbose:
+            print("ok {}".format(json.dumps(case)))
+
+    print("{:28} {:>6} {:>8} {:>12} {:>12} {:>8}".format("path", "cases", "failures", "ref MB/s", "fast MB/s", "speedup"))
+    for (name, path) in sorted(paths.items()):
+        ref_mbs = path["bytes"] / path["ref_s"] / 1e6 if path["ref_s"] else 0
+        if path["fast_s"]:
+            fast_mbs = path["bytes"] / path["fast_s"] / 1e6
+            (fast, speedup) = ("{:12.3f}".format(fast_mbs), "{:7.1f}x".format(fast_mbs / ref_mbs if ref_mbs else 0))
+        else:
+            (fast, speedup) = ("{:>12}".format("-"), "{:>8}".format("-"))
+        print("{:28} {:6} {:8} {:12.3f} {} {}".format(name, path["cases"], path["failures"], ref_mbs, fast, speedup))
+    print("reader unconsumed_tail branch (\"DEBUG ME\") hits: {}".format(reader_debug_hits[0]))
+    return not failures
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS]",
+        description=
+        """
+Differential fuzzing of the conversion fast paths: random images of random sizes & frame
+counts are converted (or written then read) by each fast path and compared bit for bit with
+the reference loops of ssd1306_image_converter.py (or the frames written). The failing cases
+are shrunk & printed as JSON (replay them with --case), then the throughput of each path is
+reported (reference & fast path MB/s of 1-bit per pixel frames).
+
+Checks:
+ - to_ssd1306: layout permutation table (full frames conversion) against to_ssd1306()
+ - to_ssd1306_window: partial updates (changed pages & columns) against a full to_ssd1306()
+ - from_ssd1306: from_ssd1306() against the source images (round trip, no fast path yet)
+ - reader: SSD1306_ImageReader.next_frame() of each encoding (raw, z, z-jobs, t, tz, s, sz,
+   a, az, zb, gr, grz) for more than 2 loops, in the middle of a file (bundle) or not, with random
+   compressed read sizes, against the frames written (reference time: the .raw reading)
+ - reader_stats: frames counted by SSD1306_ImageReader.enable_stats() after one loop of
+   next_frame() (and of next_update() for s, sz, next_plane() for gr, grz) against the
+   frames of the image
+ - sequence: frames of a numbered PNG sequence directory against to_ssd1306(), a file of
+   another size must fail the conversion and keep its previous output
+
+Notes:
+ - The same --seed gives the same cases, exit code 1 if a case fails.""",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("-n", "--cases",    help="random cases (default: %(default)s)", type=int, default=DEFAULT_CASES)
+    parser.add_argument("--seed",           help="random seed (default: %(default)s)", type=int, default=0)
+    parser.add_argument("--checks",         help="comma separated checks (default: all)", default=",".join(CHECKS))
+    parser.add_argument("--max-width",      help="maximum width in pixels (default: %(default)s)", type=int, default=MAX_WIDTH)
+    parser.add_argument("--max-height",     help="maximum height in pixels (default: %(default)s)", type=int, default=MAX_HEIGHT)
+    parser.add_argument("--max-frames",     help="maximum frames (default: %(default)s)", type=int, default=MAX_FRAMES)
+    parser.add_argument("--case",           help="replay this case (JSON printed for a failing case)", required=False)
+    parser.add_argument("-v", "--verbose",  action="store_true", help="explain what is being done")
+    return parser
+
+def main() -> None:
+    parser = init_argparse()
+    args = parser.parse_args()
+    if debug:
+        print(args)
+
+    checks = args.checks.split(",")
+    if not set(checks) <= set(CHECKS):
+        print("Error: --checks {} is not a list of {}".format(args.checks, ", ".join(CHECKS)), file=sys.stderr)
+        exit(1) # exit with error
+    if args.max_width % 8 or args.max_height % 8 or args.max_height > ssd1306_image_reader.SSD1306_RAM_HEIGHT:
+        print("Error: the maximum size must be a multiple of 8 (and the height {} at most)".format(
+            ssd1306_image_reader.SSD1306_RAM_HEIGHT), file=sys.stderr)
+        exit(1) # exit with error
+    replay_case = json.loads(args.case) if args.case is not None else None
+
+    if not fuzz(args.verbose, args.cases, args.seed, checks, args.max_width, args.max_height, args.max_frames,
+                replay_case):
+        exit(1) # exit with error
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import os.path
+import sys
+import tracemalloc
+import zlib
+
+import ssd1306_image_reader
+
+# Heap left for the animation on the board (MicroPython gc.mem_free() before opening it)
+DEFAULT_BUDGET_IN_BYTES = 64 * 1024
+
+# Allocation sites reported at the steady state
+DEFAULT_TOP_SITES = 5
+
+debug = False
+
+
+def get_size_str(size) -> str:
+    return "{} bytes ({:.1f} KiB)".format(size, size / 1024)
+
+
+def get_model(img_reader):
+    """Return the main buffers of the MicroPython playback (name, size in bytes) for the
+       reader config: what tracemalloc measures on CPython depends on the CPython objects &
+       zlib, this model gives the buffers sizes the device needs whatever the interpreter."""
+    frame_size = img_reader.buf_size_in_bytes
+    model = [("frame buffer", frame_size)]
+    if img_reader.compression:
+        # zlib.DecompIO allocates its window (the stream is read by the inflater, no chunk)
+        model.append(("zlib window", 1 << abs(ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE)))
+        if img_reader.encoding == ssd1306_image_reader.ENCODING_BLOCKS:
+            model.append(("block buffer", len(img_reader.block_buf)))
+        else:
+            # Inflated data not returned yet & the slices of next_frame() (frame & remainder)
+            model.append(("inflate buffer", frame_size))
+            model.append(("slicing garbage", 2 * frame_size))
+    if img_reader.encoding == ssd1306_image_reader.ENCODING_TILES:
+        model.append(("tiles table & indices", os.path.getsize(img_reader.filename)))
+    elif img_reader.encoding == ssd1306_image_reader.ENCODING_SCROLL:
+        model.append(("panel RAM model", len(img_reader.ram)))
+    elif img_reader.encoding == ssd1306_image_reader.ENCODING_ADAPTIVE:
+        model.append(("previous frame", frame_size))
+    elif img_reader.encoding == ssd1306_image_reader.ENCODING_GRAY:
+        model.append(("displayed plane", frame_size))
+    return model
+
+
+def get_inflated_size(img_reader) -> int:
+    """Return the bytes inflated by a loop of the image: the decompressed size of the image
+       (of its blocks with the aligned blocks), 0 if it is not compressed."""
+    if not img_reader.compression:
+        return 0
+    if img_reader.encoding == ssd1306_image_reader.ENCODING_BLOCKS:
+        return img_reader.frames * img_reader.buf_size_in_bytes
+    with open(img_reader.filename, "rb") as f:
+        f.seek(img_reader.offset)
+        data = f.read(img_reader.size if img_reader.size is not None else -1)
+    return len(zlib.decompressobj(ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE).decompress(data))
+
+
+def simulate(input_filename, loops, budget, top, gc_threshold, use_model):
+    """Play the image under tracemalloc, print the memory report & return True if the
+       peak (the buffers model total with use_model) fits in the budget."""
+    if not os.path.isfile(input_filename):
+        print("Error: file {} does not exit!".format(input_filename), file=sys.stderr)
+        exit(1) # exit with error
+
+    # The measures are stored in arrays allocated before tracing, so they are not measured.
+    # The reader is not instrumented (no enable_stats()): the bytes read are derived from the
+    # file position and the bytes inflated from the decompressed size of the image
+    img_reader = ssd1306_image_reader.SSD1306_ImageReader(input_filename)
+    img_reader.close()
+    frames = img_reader.frames * loops
+    image_start = img_reader.offset
+    image_end = image_start + (img_reader.size if img_reader.size is not None else os.path.getsize(input_filename))
+    inflated = get_inflated_size(img_reader) * loops
+    frame_peaks = array.array("q", bytes(8 * frames))
+    frame_retained = array.array("q", bytes(8 * frames))
+    frame_transients = array.array("q", bytes(8 * frames))
+    frame_read = array.array("q", bytes(8 * frames)) # bytes read: new objects on the heap at each frame
+    img_reader = None
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+
+    # Open: file, zlib stream (and the tiles table...)
+    tracemalloc.reset_peak()
+    img_reader = ssd1306_image_reader.SSD1306_ImageReader(input_filename)
+    (current, peak) = tracemalloc.get_traced_memory()
+    open_peak = peak - base
+    open_retained = current - base
+
+    # Play like a player: the previous frame is released when the next one is returned
+    img_buf = None
+    position = img_reader.f.tell()
+    for frame in range(frames):
+        (before, _) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        img_buf = img_reader.next_frame()
+        (current, peak) = tracemalloc.get_traced_memory()
+        frame_peaks[frame] = peak - base
+        frame_retained[frame] = current - base
+        frame_transients[frame] = peak - max(before, current)
+        (prev_position, position) = (position, img_reader.f.tell())
+        if position < prev_position:
+            # Looping the animation: end of the image then its beginning again
+            frame_read[frame] = image_end - prev_position + position - image_start
+        else:
+            frame_read[frame] = position - prev_position
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    img_reader.close()
+
+    # Steady state: the second half of the playback (the first frames fill the buffers)
+    steady = sorted(frame_retained[frames // 2:])
+    steady_retained = steady[len(steady) // 2]
+    peak = max(open_peak, max(frame_peaks))
+    churn = max(sum(frame_transients), sum(frame_read) + inflated) / frames
+
+    print("{}: {}".format(input_filename, str(img_reader)))
+    print("MicroPython buffers model:")
+    model = get_model(img_reader)
+    for (name, size) in model:
+        print("  {:24} {:>8} bytes".format(name, size))
+    model_total = sum(size for (name, size) in model)
+    print("  {:24} {:>8} bytes".format("total", model_total))
+    print("tracemalloc (CPython) for {} frames:".format(frames))
+    print("  open peak                {}".format(get_size_str(open_peak)))
+    print("  open retained            {}".format(get_size_str(open_retained)))
+    print("  frame peak (max)         {}".format(get_size_str(max(frame_peaks))))
+    print("  steady state retained    {}".format(get_size_str(steady_retained)))
+    print("  transient per frame      {} max, {:.0f} mean".format(max(frame_transients), sum(frame_transients) / frames))
+    print("  read & inflated / frame  {:.0f} bytes".format((sum(frame_read) + inflated) / frames))
+    print("  churn per frame          {:.0f} bytes".format(churn))
+    if churn:
+        print("  frames between GCs       {:.0f} (gc threshold {} bytes)".format(gc_threshold / churn, gc_threshold))
+    print("top allocation sites (steady state):")
+    stats = snapshot.filter_traces([tracemalloc.Filter(True, ssd1306_image_reader.__file__)]).statistics("lineno")
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        print("  {}:{:<5} {:>8} bytes in {} blocks".format(os.path.basename(frame.filename), frame.lineno,
+                                                           stat.size, stat.count))
+
+    if use_model:
+        peak = model_total
+    fits = peak <= budget
+    print("{} {} {} the budget of {}".format("model total" if use_model else "peak", get_size_str(peak),
+                                             "fits in" if fits else "EXCEEDS", get_size_str(budget)))
+    return fits
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS] filename [filename ...]",
+        description=
+        """
+Simulate the memory of the MicroPython playback of ssd1306 images: play the images with
+SSD1306_ImageReader (--loops times) under tracemalloc and report the peak & the steady state
+allocations, the allocation churn per frame (garbage the GC has to collect) and the main
+buffers of the playback (frame, zlib window...). Exit with error if a peak exceeds --budget.
+
+Notes:
+ - Use the memory left on your board for --budget (gc.mem_free() before opening the image).
+ - tracemalloc measures the CPython objects & zlib state, the MicroPython buffers model gives
+   the sizes of the buffers the device needs (the zlib window of DEFAULT_ZLIB_WINDOW_SIZE,
+   COMPRESSED_CHUNK_SIZE reads...).
+ - The tracemalloc peak includes the CPython decompression output buffers, bigger than the
+   MicroPython ones: use --model to check the buffers model total against the budget.
+ - The churn is the largest of the transient allocations measured & of the bytes read &
+   inflated per frame (each read & each inflation allocates a new object).""",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("-b", "--budget",   help="memory budget in bytes (default: %(default)s)", type=int, default=DEFAULT_BUDGET_IN_BYTES)
+    parser.add_argument("-l", "--loops",    help="animation loops (default: %(default)s)", type=int, default=2)
+    parser.add_argument("--gc-threshold",   help="bytes allocated between GCs, gc.threshold() (default: the budget)", type=int, required=False)
+    parser.add_argument("-m", "--model",    action="store_true", help="check the buffers model total against the budget instead of the tracemalloc peak")
+    parser.add_argument("--top",            help="allocation sites reported (default: %(default)s)", type=int, default=DEFAULT_TOP_SITES)
+    return parser
+
+def main() -> None:
+    parser = init_argparse()
+    args = parser.parse_args()
+    if debug:
+        print(args)
+
+    gc_threshold = args.gc_threshold if args.gc_threshold is not None else args.budget
+    fits = True
+    for filename in args.filenames:
+        fits = simulate(filename, args.loops, args.budget, args.top, gc_threshold, args.model) and fits
+    if not fits:
+        exit(1) # exit with error
+
+if __name__ == "__main__":
+    main()
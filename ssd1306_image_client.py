@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os.path
+import socket
+import sys
+import time
+
+import convert_animated_gif_to_ssd1306_images
+import ssd1306_image_encoder
+import ssd1306_image_server
+import ssd1306_image_sources
+
+# When the server is busy, the client retries after this delay (doubled at each retry)
+RETRY_DELAY_S = 0.05
+RETRY_DELAY_MAX_S = 2.0
+
+debug = False
+
+
+def connect(socket_path, port):
+    if port is not None:
+        return socket.create_connection(("127.0.0.1", port))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    return sock
+
+
+def request(sock, header, payload=b""):
+    """Send a request, retry while the server is busy, return the response (header, payload)."""
+    delay = RETRY_DELAY_S
+    while True:
+        ssd1306_image_server.send_message(sock, header, payload)
+        (response, response_payload) = ssd1306_image_server.recv_message(sock)
+        if response["status"] != "busy":
+            return (response, response_payload)
+        time.sleep(delay)
+        delay = min(delay * 2, RETRY_DELAY_MAX_S)
+
+
+def convert(sock, verbose, options, overwrite, input_filename):
+    # Check if input file exits
+    if not os.path.isfile(input_filename):
+        print("Error: file {} does not exit!".format(input_filename), file=sys.stderr)
+        return False
+
+    with open(input_filename, "rb") as f:
+        img_in_buf = f.read()
+
+    (response, img_out_buf) = request(sock, {"cmd": "convert", "options": options}, img_in_buf)
+    if response["status"] != "ok":
+        print("Error: {}: {}".format(input_filename, response.get("error")), file=sys.stderr)
+        return False
+
+    # Prepare the output filename (from "filename.gif" to "filename.widthxheight.nimg.z" or ".raw")
+    output_filename = ssd1306_image_encoder.get_image_filename(ssd1306_image_sources.get_basename(input_filename),
+                                                               tuple(response["config"]), response["encoding"],
+                                                               response["position"])
+
+    # Check if output file already exists...
+    if os.path.isfile(output_filename):
+        if not overwrite:
+            print("Error: file {} already exits, please delete it or use the proper option to overwrite it!".format(output_filename),
+                  file=sys.stderr)
+            return False
+        else:
+            if verbose:
+                print("Warning: file {} already exits and will be overwritten.".format(output_filename))
+
+    with open(output_filename, "wb") as f:
+        f.write(img_out_buf)
+
+    if verbose:
+        print("{} successfully generated :-) {}".format(output_filename, response["metrics"]))
+    return True
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS] filename.gif [filename.gif ...]",
+        description=
+        """
+Convert animated GIFs (or single images) to image files for ssd1306-like OLED panel with the
+conversion server (see ssd1306_image_server.py), the output files are the same as the ones of
+convert_animated_gif_to_ssd1306_images.py.
+
+Notes:
+ - The ssd1306 image filename uses the format filename.WidthxHeight.Nimg.raw (.z if compressed).
+   For example "my_animation.128x64.42img.z".
+ - The encoding options (--compress, --tiles, --gray, --sprite, the layout options...) are the
+   ones of convert_animated_gif_to_ssd1306_images.py, they are sent to the server.""",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("filenames", nargs="*")
+    parser.add_argument("-f", "--force",    action="store_true", help="force overwrite")
+    parser.add_argument("-v", "--verbose",  action="store_true", help="explain what is being done")
+    parser.add_argument("-s", "--socket",   help="server Unix socket path (default: %(default)s)", default=ssd1306_image_server.DEFAULT_SOCKET_PATH)
+    parser.add_argument("-p", "--port",     help="server localhost TCP port instead of the Unix socket", type=int, required=False)
+    parser.add_argument("--stats",          action="store_true", help="print the server metrics")
+    convert_animated_gif_to_ssd1306_images.add_encode_arguments(parser)
+    return parser
+
+def main() -> None:
+    parser = init_argparse()
+    args = parser.parse_args()
+    if debug:
+        print(args)
+
+    sock = connect(args.socket, args.port)
+    ok = True
+    for filename in args.filenames:
+        ok = convert(sock, args.verbose, convert_animated_gif_to_ssd1306_images.get_encode_options(args), args.force,
+                     filename) and ok
+    if args.stats:
+        (response, payload) = request(sock, {"cmd": "stats"})
+        print(json.dumps(response["metrics"], indent=1))
+    sock.close()
+    if not ok:
+        exit(1) # exit with error
+
+if __name__ == "__main__":
+    main()
@@ -85,3 +85,39 @@ def from_ssd1306(width:int, height:int, buf_in, buf_out):
                 buf_out[buf_out_pos + (7 * stride_w)] |= ((a >> 7) & 1) << (7 - z)
             buf_in_pos += 8
             buf_out_pos += 1
+
+
+def to_ssd1306_window(width:int, x:int, y:int, w:int, h:int, buf_in, buf_out):
+    """Convert a 1-bit per pixel 2d image buffer of w x h pixels to
+       the window (x, y, w, h) of a 1-bit per pixel ssd1306-like image format buffer.
+       Note: Only the window bytes of the output buffer are modified (overwritten),
+             x, y, w and h must be multiples of 8.
+
+    Args:
+        width (int): output buffer width in pixels
+        x (int): window left position in pixels
+        y (int): window top position in pixels
+        w (int): window width in pixels
+        h (int): window height in pixels
+        buf_in (_type_): input buffer (w x h pixels)
+        buf_out (_type_): output buffer (ssd1306-like format)
+    """
+
+    stride_w = w // 8                   # 1-bit per pixel, 1 byte = 8 pixels
+    for page in range(h // 8):
+        buf_in_pos  = page * stride_w * 8         # move 8 lines at a time
+        buf_out_pos = (y // 8 + page) * width + x # move to next page
+        buf_out[buf_out_pos : buf_out_pos + w] = bytes(w)
+        for i in range(stride_w):
+            for z in range(8):
+                a = buf_in[buf_in_pos + (z * stride_w)]
+                buf_out[buf_out_pos + 0] |= ((a >> 7) & 1) << z
+                buf_out[buf_out_pos + 1] |= ((a >> 6) & 1) << z
+                buf_out[buf_out_pos + 2] |= ((a >> 5) & 1) << z
+                buf_out[buf_out_pos + 3] |= ((a >> 4) & 1) << z
+                buf_out[buf_out_pos + 4] |= ((a >> 3) & 1) << z
+                buf_out[buf_out_pos + 5] |= ((a >> 2) & 1) << z
+                buf_out[buf_out_pos + 6] |= ((a >> 1) & 1) << z
+                buf_out[buf_out_pos + 7] |= ((a >> 0) & 1) << z
+            buf_in_pos += 1
+            buf_out_pos += 8
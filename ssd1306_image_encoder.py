@@ -0,0 +1,1521 @@
+"""
+Image encoder for ssd1306-like Oled panel
+https://github.com/coolcornucopia/convert-animated-gif-for-ssd1306-panel
+
+MIT License
+
+Copyright (c) 2022 coolcornucopia
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import collections
+import hashlib
+import io
+import json
+import os
+import struct
+import time
+import zlib
+
+import ssd1306_image_converter
+import ssd1306_image_layout
+import ssd1306_image_reader
+import ssd1306_image_sources
+
+# Note: PIL (and the other heavy modules) are imported only when needed, so importing this
+# module (and the scripts using it) stays fast, for instance for "--help".
+
+# By default, we use do not use the dithering when converting the GIF to 1-bit per pixel
+# It may be useful when the animated GIF uses a lot of colors (videos...)
+DEFAULT_DITHER_METHOD = 0 # Image.NONE, or 3 for Image.FLOYDSTEINBERG
+
+# With the parallel compression (jobs > 1), the frames are compressed by blocks of frames
+DEFAULT_BLOCK_FRAMES = 128
+
+# Adaptive encoding: the type of each frame is the one with the smallest cost, its encoded size
+# plus decode_weight times its decoding cost. The decoding costs are relative costs per frame
+# byte measured with CPython: inflating costs 1 and the XOR with the previous frame costs half
+# of it (the reader uses big integers so the XOR is done in C with MicroPython too). With the
+# default weight, inflating a 1KiB frame must save ~50 bytes to be worth it.
+DEFAULT_DECODE_WEIGHT = 0.05
+INFLATE_DECODE_COST = 1.0
+DECODE_COSTS = {
+    ssd1306_image_reader.FRAME_KEY: 0,
+    ssd1306_image_reader.FRAME_REPEAT: 0,
+    ssd1306_image_reader.FRAME_DELTA: 0.5,
+}
+
+
+# With the incremental conversion, the frames are compressed by chunks of frames so only the
+# chunks containing modified frames are compressed again
+DEFAULT_CHUNK_FRAMES = 32
+
+# The manifest "filename.widthxheight.nimg.z.manifest" stores the frames hashes & chunks offsets
+# and the size & hash of the output file it describes
+MANIFEST_VERSION = 2
+
+# The journal "filename.widthxheight.nimg.z.journal" stores the checkpoints of a conversion
+# (see checkpoint_frames), one JSON line per checkpoint after the conversion parameters line,
+# with the hash of the output up to the checkpoint offset
+JOURNAL_VERSION = 2
+
+# Outputs written in the same conversion pass (see convert_file())
+OUTPUTS = ("raw", "z", "gif")
+
+
+class SSD1306_ConversionError(Exception):
+    """Raised when an image can not be converted."""
+
+
+def open_image(source):
+    """Open an image with PIL from a filename, bytes, a binary file object or a PIL image.
+       The image may be animated (GIF, APNG, WebP...), a directory of numbered PNG/BMP files
+       or a raw gray frame dump (see ssd1306_image_sources), its frames are decoded lazily."""
+    from PIL import Image
+    if isinstance(source, (Image.Image, ssd1306_image_sources.SSD1306_FrameSource)):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif isinstance(source, (str, os.PathLike)) and not os.path.exists(source):
+        raise SSD1306_ConversionError("file {} does not exit!".format(source))
+    try:
+        if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+            return ssd1306_image_sources.SSD1306_ImageSequence(source)
+        if isinstance(source, (str, os.PathLike)) and ssd1306_image_sources.is_raw_gray(source):
+            return ssd1306_image_sources.SSD1306_RawGraySequence(source)
+        return Image.open(source)
+    except (OSError, ValueError) as e:
+        raise SSD1306_ConversionError("can not open image: {}".format(e)) from e
+
+
+def get_frames_count(img) -> int:
+    if hasattr(img, 'n_frames'):
+        return img.n_frames  # Animated GIF case
+    return 1                 # Single frame image (PNG, GIF...)
+
+
+def iter_source_frames(img):
+    """Seek the frames of an image in order, like PIL ImageSequence.Iterator, and yield the
+       image at each frame. The frame errors (a sequence file of another size...) are raised
+       as SSD1306_ConversionError."""
+    frame = 0
+    while True:
+        try:
+            img.seek(frame)
+        except EOFError:
+            return # no more frames
+        except (OSError, ValueError) as e:
+            raise SSD1306_ConversionError("can not read the frame {}: {}".format(frame, e)) from e
+        yield img
+        frame += 1
+
+
+def get_gif_frame_changed_box(img, prev_dispose_extent):
+    """Get the box (x0, y0, x1, y1) changed by the current GIF frame (its extent plus
+       the previous frame disposal extent), aligned on 8 pixels (ssd1306 pages & bytes).
+       Return the full image box if unknown and None if nothing changed.
+       Note: must be called after seek() and before the frame is loaded."""
+    full_box = (0, 0, img.width, img.height)
+    if not hasattr(img, "tile"):
+        return full_box
+    boxes = [tile[1] for tile in img.tile]
+    if prev_dispose_extent is not None:
+        boxes.append(prev_dispose_extent)
+    if not boxes:
+        return None
+    x0 = max(0, min(box[0] for box in boxes)) & ~7
+    y0 = max(0, min(box[1] for box in boxes)) & ~7
+    x1 = min(img.width,  (max(box[2] for box in boxes) + 7) & ~7)
+    y1 = min(img.height, (max(box[3] for box in boxes) + 7) & ~7)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def get_frame_hash(img) -> str:
+    """Get a hash of the current decoded frame content (mode, palette & pixels)."""
+    h = hashlib.sha1("{} {}x{}".format(img.mode, img.width, img.height).encode())
+    if img.mode == "P":
+        h.update(bytes(img.getpalette()))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def iter_frames(img, dither_method=DEFAULT_DITHER_METHOD, partial_update=True, skip=None, layout=None):
+    """Convert the frames of a PIL image to the ssd1306 format, frame by frame.
+       Yield the ssd1306 buffer of each frame. The same bytearray is updated and yielded again
+       for the next frame so copy it to keep it.
+
+    Args:
+        img (PIL.Image): input image (still or animated)
+        dither_method (int): PIL dithering method used for the conversion in 1-bit per pixel
+        partial_update (bool): with GIF frames, convert only the pages changed by the frame
+        skip (callable): optional skip(frame, img) called after the frame seek, if it returns
+                         True, the frame is not converted and None is yielded instead
+        layout (SSD1306_Layout): panel layout (see ssd1306_image_layout), the ssd1306 format
+                                 by default
+    """
+    from PIL import Image
+    if img.width % 8 or img.height % 8:
+        raise SSD1306_ConversionError("image size {}x{} is not a multiple of 8".format(img.width, img.height))
+    if layout is None:
+        layout = ssd1306_image_layout.SSD1306_Layout(img.width, img.height)
+    elif (img.width, img.height) != (layout.source_width, layout.source_height):
+        raise SSD1306_ConversionError("image size {}x{} is not the layout source size {}x{}".format(
+            img.width, img.height, layout.source_width, layout.source_height))
+
+    # GIF frames often update only a part of the image: the ssd1306 output buffer is kept
+    # from one frame to the next and only the changed pages & columns are converted again.
+    # Note: not possible with dithering as it spreads the conversion error on the whole frame
+    # nor with the other layouts
+    partial_update = partial_update and img.format == "GIF" and dither_method == Image.NONE and layout.is_default()
+    full_box = (0, 0, img.width, img.height)
+    prev_dispose_extent = None
+    prev_skipped = False
+
+    # The frames are decoded in order, one at a time (the previous one is released)
+    for (frame, _) in enumerate(iter_source_frames(img)):
+        box = full_box
+        if partial_update and frame > 0:
+            box = get_gif_frame_changed_box(img, prev_dispose_extent)
+        if partial_update:
+            prev_dispose_extent = img.dispose_extent if getattr(img, "dispose", None) is not None else None
+
+        if skip is not None:
+            if skip(frame, img):
+                prev_skipped = True
+                yield None
+                continue
+            if prev_skipped:
+                box = full_box # the output buffer does not contain the previous frame
+            prev_skipped = False
+
+        if box == full_box:
+            # Convert in 1-bit (black & white) then to the ssd1306 format (or the panel layout)
+            # with the precompiled permutation table (TODO add a documentation link somewhere)
+            img_out_buf = bytearray(layout.convert(img.convert("1", dither = dither_method)))
+
+        elif box is not None:
+            # Convert only the changed pages & columns, the rest of the buffer is unchanged
+            (x0, y0, x1, y1) = box
+            img_tmp_buf = img.crop(box).convert("1", dither = dither_method).tobytes(encoder_name = "raw")
+            ssd1306_image_converter.to_ssd1306_window(img.width, x0, y0, x1 - x0, y1 - y0, img_tmp_buf, img_out_buf)
+
+        yield img_out_buf
+
+
+def get_gray_planes(img, planes:int, layout) -> list:
+    """Quantize a PIL image in 1 << planes gray levels and return its weighted bitplanes (the
+       ssd1306 buffer of the bit n of the levels for the plane n, weight 1 << n)."""
+    from PIL import Image
+    levels = (1 << planes) - 1
+    img = img.convert("L")
+    bufs = []
+    for plane in range(planes):
+        # The planes are exact bits of the levels (no dithering)
+        lut = [255 if (((value * levels + 127) // 255) >> plane) & 1 else 0 for value in range(256)]
+        bufs.append(layout.convert(img.point(lut).convert("1", dither = Image.NONE)))
+    return bufs
+
+
+def iter_gray_frames(img, planes:int, layout=None):
+    """Convert the frames of a PIL image to weighted bitplanes (see get_gray_planes()), frame
+       by frame. Yield the list of the ssd1306 buffers of the planes of each frame."""
+    if img.width % 8 or img.height % 8:
+        raise SSD1306_ConversionError("image size {}x{} is not a multiple of 8".format(img.width, img.height))
+    if layout is None:
+        layout = ssd1306_image_layout.SSD1306_Layout(img.width, img.height)
+    # The frames are decoded in order, one at a time (the previous one is released)
+    for (frame, _) in enumerate(iter_source_frames(img)):
+        yield get_gray_planes(img, planes, layout)
+
+
+def convert_frames(source, dither_method=DEFAULT_DITHER_METHOD, partial_update=True, layout=None):
+    """Yield the ssd1306 buffer (bytes) of each frame of an image (see open_image())."""
+    img = open_image(source)
+    for buf in iter_frames(img, dither_method, partial_update, layout=layout):
+        yield bytes(buf)
+
+
+def encode(source, compression=False, zlib_window_size=ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE,
+           dither_method=DEFAULT_DITHER_METHOD, partial_update=True, jobs=1, block_frames=DEFAULT_BLOCK_FRAMES,
+           encoding=ssd1306_image_reader.ENCODING_FRAMES, fps=None, bus_hz=None,
+           decode_weight=DEFAULT_DECODE_WEIGHT, layout_params=None,
+           block_size=ssd1306_image_reader.DEFAULT_BLOCK_SIZE, sprite=False, gray_planes=None):
+    """Convert an image (see open_image() & SSD1306_ImageConversion) and return the content
+       of the ssd1306 image file with the arguments of get_image_filename() after the basename:
+       (content, config, encoding, position)."""
+    conversion = SSD1306_ImageConversion(open_image(source), compression, zlib_window_size, dither_method,
+                                         partial_update, encoding, fps, bus_hz, decode_weight, layout_params,
+                                         block_size, sprite, gray_planes)
+    f = io.BytesIO()
+    writer = conversion.get_writer(f, jobs, block_frames)
+    for (frame, buf) in enumerate(conversion.iter_frames()):
+        conversion.write_frame(writer, frame, buf)
+    conversion.finish(writer)
+    writer.finish()
+    return (f.getvalue(), conversion.get_config(), conversion.encoding, conversion.position)
+
+
+def get_image_filename(basename, config, encoding=ssd1306_image_reader.ENCODING_FRAMES, position=None) -> str:
+    """Get the ssd1306 image filename ("basename.widthxheight.nimg.z" or ".raw", ".t" & ".tz"
+       with the tiles encoding, ".s" & ".sz" with the scroll encoding, ".a" & ".az" with the
+       adaptive encoding). With the position (x, y) of a sprite on the panel, the size is
+       followed by it ("basename.widthxheight+x+y.nimg.z")."""
+    (width, height, frames, compression) = config
+    size = "{}x{}".format(width, height)
+    if position is not None:
+        size += "+{}+{}".format(*position)
+    return "{}.{}.{}img.{}".format(basename, size, frames,
+                                   ssd1306_image_reader.IMAGE_EXTENSIONS[(encoding, compression)])
+
+
+def get_sprite_box(bufs, width:int, height:int):
+    """Get the box (x0, y0, x1, y1) of the lit pixels of all the ssd1306 frames, aligned on
+       8 pixels (the y coordinates on the pages), None if all the frames are black."""
+    lit = 0
+    for buf in bufs:
+        lit |= int.from_bytes(buf, "big")
+    if not lit:
+        return None
+    lit = lit.to_bytes((width * height) // 8, "big")
+    pages = [page for page in range(height // 8) if any(lit[page * width : (page + 1) * width])]
+    columns = [x for x in range(width) if any(lit[page * width + x] for page in pages)]
+    return (columns[0] & ~7, pages[0] * 8, min(width, (columns[-1] + 8) & ~7), (pages[-1] + 1) * 8)
+
+
+def get_window(buf, width:int, box) -> bytes:
+    """Get the ssd1306 buffer of the box (x0, y0, x1, y1, aligned on the pages) of a ssd1306
+       buffer, the data sent to the panel columns & pages address window of the box."""
+    (x0, y0, x1, y1) = box
+    buf = memoryview(buf)
+    return b"".join(buf[page * width + x0 : page * width + x1] for page in range(y0 // 8, y1 // 8))
+
+
+def get_panel_basename(basename, column:int, row:int) -> str:
+    """Get the basename of the stream of a panel in a wall of panels ("basename_panel<column>_<row>")."""
+    return "{}_panel{}_{}".format(basename, column, row)
+
+
+def get_shard_basename(basename, shard:int) -> str:
+    """Get the basename of a shard of a long animation ("basename_shard<shard>")."""
+    return "{}_shard{}".format(basename, shard)
+
+
+def split_panels(buf, width:int, height:int, columns:int, rows:int) -> list:
+    """Split a ssd1306 buffer of a wall of columns x rows panels in one ssd1306 buffer (bytes)
+       per panel, row after row. Each panel is width // columns x height // rows pixels, its
+       pages are slices of the pages of the wall so the wall frame is only converted once."""
+    panel_width = width // columns
+    panel_pages = height // rows // 8
+    buf = memoryview(buf)
+    panel_bufs = []
+    for row in range(rows):
+        for column in range(columns):
+            x = column * panel_width
+            panel_bufs.append(b"".join(buf[page * width + x : page * width + x + panel_width]
+                                       for page in range(row * panel_pages, (row + 1) * panel_pages)))
+    return panel_bufs
+
+
+def get_pil_image_info_str(img) -> str:
+    str = "{}x{} mode {}".format(img.width, img.height, img.mode)
+    if img.format != None:
+        str += ", {}".format(img.format)
+    if hasattr(img, 'n_frames'):
+        str += ", {} frames".format(img.n_frames) if img.n_frames > 1 else "single frame"
+    if hasattr(img, 'filename'):
+        str += ", {}".format(img.filename)
+    return str
+
+
+def get_partial_filename(output_filename) -> str:
+    return "{}.tmp".format(output_filename)
+
+
+def open_output_file(filename, output_files):
+    """Open the temporary file of an output file ("filename.tmp"): the output file is only
+       replaced when the conversion is complete (see commit_output_files())."""
+    f = open(get_partial_filename(filename), "wb")
+    output_files.append((f, filename))
+    return f
+
+
+def commit_output_files(output_files):
+    """Rename the temporary files of a complete conversion to their output filenames."""
+    for (f, filename) in output_files:
+        f.close()
+        os.replace(f.name, filename)
+    output_files.clear()
+
+
+def remove_output_files(output_files):
+    """Remove the temporary files of a failed conversion, the previous output files are kept."""
+    for (f, filename) in output_files:
+        f.close()
+        os.remove(f.name)
+    output_files.clear()
+
+
+def update_file_hash(h, filename, start=0, end=None):
+    """Update the hash h with the content of a file from start to end (to the end of the file
+       if end is None)."""
+    with open(filename, "rb") as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            data = f.read(1 << 20 if remaining is None else min(remaining, 1 << 20))
+            if not data:
+                break
+            h.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return h
+
+
+def get_file_hash(filename, size=None) -> str:
+    """Get the hash of the content of a file (of its first size bytes if given)."""
+    return update_file_hash(hashlib.sha1(), filename, 0, size).hexdigest()
+
+
+def get_manifest_filename(output_filename) -> str:
+    return "{}.manifest".format(output_filename)
+
+
+def load_manifest(verbose, output_filename, params):
+    """Load the manifest of a previous conversion, None if missing or if the conversion
+       parameters are not the same."""
+    manifest_filename = get_manifest_filename(output_filename)
+    if not os.path.isfile(manifest_filename) or not os.path.isfile(output_filename):
+        return None
+    with open(manifest_filename, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("params") != params:
+        if verbose:
+            print("Warning: manifest {} does not match the conversion parameters, full conversion.".format(manifest_filename))
+        return None
+    # The chunks are copied from the output: it must be the one described by the manifest
+    output = manifest.get("output", {})
+    if output.get("size") != os.path.getsize(output_filename) or output.get("hash") != get_file_hash(output_filename):
+        if verbose:
+            print("Warning: {} is not the output of the manifest {}, full conversion.".format(output_filename, manifest_filename))
+        return None
+    return manifest
+
+
+def get_journal_filename(output_filename) -> str:
+    return "{}.journal".format(output_filename)
+
+
+def load_journal(verbose, output_filename, params):
+    """Load the last checkpoint of an interrupted conversion, None if missing or if the
+       conversion parameters are not the same. The checkpoints are offsets in the partial
+       output "filename.tmp" kept by the interrupted conversion."""
+    journal_filename = get_journal_filename(output_filename)
+    partial_filename = get_partial_filename(output_filename)
+    if not os.path.isfile(journal_filename) or not os.path.isfile(partial_filename):
+        return None
+    with open(journal_filename, "r") as f:
+        lines = f.read().splitlines()
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        header = {}
+    if header.get("version") != JOURNAL_VERSION or header.get("params") != params:
+        if verbose:
+            print("Warning: journal {} does not match the conversion parameters, full conversion.".format(journal_filename))
+        return None
+    checkpoint = {"frame": 0, "offset": 0, "hash": get_file_hash(partial_filename, 0)} # interrupted before the first checkpoint
+    for line in lines[1:]:
+        try:
+            checkpoint = json.loads(line)
+        except ValueError:
+            break # the last line is incomplete if the conversion was killed while writing it
+    # The output is truncated at the checkpoint offset: it must be the one the journal was written for
+    if (os.path.getsize(partial_filename) < checkpoint.get("offset", 0) or
+            checkpoint.get("hash") != get_file_hash(partial_filename, checkpoint.get("offset", 0))):
+        if verbose:
+            print("Warning: {} is not the output of the journal {}, full conversion.".format(partial_filename, journal_filename))
+        os.remove(journal_filename)
+        return None
+    return checkpoint
+
+
+def convert_file(input_filename, verbose=False, compression=False, overwrite=False,
+                 zlib_window_size=ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE,
+                 dither_method=DEFAULT_DITHER_METHOD, partial_update=True,
+                 incremental=False, chunk_frames=DEFAULT_CHUNK_FRAMES,
+                 jobs=1, block_frames=DEFAULT_BLOCK_FRAMES, stats_filename=None,
+                 encoding=ssd1306_image_reader.ENCODING_FRAMES, fps=None, bus_hz=None,
+                 decode_weight=DEFAULT_DECODE_WEIGHT, layout_params=None, panels=None,
+                 outputs=(), checkpoint_frames=0, block_size=ssd1306_image_reader.DEFAULT_BLOCK_SIZE, shard_size=0,
+                 sprite=False, gray_planes=None):
+    """Convert an image file (see open_image() & SSD1306_ImageConversion) to the ssd1306 image
+       file next to it (see get_image_filename()) and the other outputs (see OUTPUTS), one per
+       panel with panels (columns, rows). The outputs are written to temporary files renamed
+       when the conversion is complete, the errors are raised as SSD1306_ConversionError."""
+    output_files = [] # (temporary file, output filename) of the outputs being written
+    try:
+        if panels is not None:
+            if (incremental or fps is not None or stats_filename is not None or layout_params or outputs or checkpoint_frames or
+                sprite or encoding in (ssd1306_image_reader.ENCODING_GRAY, ssd1306_image_reader.ENCODING_BLOCKS)):
+                raise SSD1306_ConversionError(
+                    "--panels can not be used with --incremental, --fps, --stats, --outputs, --checkpoint, --sprite, --gray, --aligned or the layout options")
+            convert_panels_file(input_filename, output_files, verbose=verbose, compression=compression,
+                                overwrite=overwrite, zlib_window_size=zlib_window_size, dither_method=dither_method,
+                                partial_update=partial_update, jobs=jobs, block_frames=block_frames,
+                                encoding=encoding, decode_weight=decode_weight, panels=panels)
+            return
+        convert_image_file(input_filename, output_files, verbose=verbose, compression=compression,
+                           overwrite=overwrite, zlib_window_size=zlib_window_size, dither_method=dither_method,
+                           partial_update=partial_update, incremental=incremental, chunk_frames=chunk_frames,
+                           jobs=jobs, block_frames=block_frames, stats_filename=stats_filename, encoding=encoding,
+                           fps=fps, bus_hz=bus_hz, decode_weight=decode_weight, layout_params=layout_params,
+                           outputs=outputs, checkpoint_frames=checkpoint_frames, block_size=block_size,
+                           shard_size=shard_size, sprite=sprite, gray_planes=gray_planes)
+    finally:
+        remove_output_files(output_files)
+
+
+def convert_image_file(input_filename, output_files, verbose, compression, overwrite, zlib_window_size, dither_method,
+                       partial_update, incremental, chunk_frames, jobs, block_frames, stats_filename, encoding,
+                       fps, bus_hz, decode_weight, layout_params, outputs, checkpoint_frames, block_size, shard_size,
+                       sprite, gray_planes):
+    # The options of the output files are checked before the conversion of the frames
+    if shard_size and encoding != ssd1306_image_reader.ENCODING_BLOCKS:
+        raise SSD1306_ConversionError("only the aligned blocks can be sharded (--shard-size)")
+    if incremental and chunk_frames < 1:
+        raise SSD1306_ConversionError("{} frames per chunk, 1 at least".format(chunk_frames))
+    if incremental and (encoding != ssd1306_image_reader.ENCODING_FRAMES or fps is not None):
+        raise SSD1306_ConversionError("only the frames encoding can be incremental")
+    if incremental and outputs:
+        raise SSD1306_ConversionError("--outputs can not be used with --incremental")
+    if layout_params and "gif" in outputs:
+        raise SSD1306_ConversionError("the gif output needs the default panel layout")
+    if checkpoint_frames and (encoding != ssd1306_image_reader.ENCODING_FRAMES or fps is not None or incremental or
+                              jobs > 1 or outputs or stats_filename is not None):
+        raise SSD1306_ConversionError(
+            "--checkpoint needs the frames encoding, without --fps, --incremental, --jobs, --outputs or --stats")
+    if sprite and (incremental or checkpoint_frames or outputs or shard_size):
+        raise SSD1306_ConversionError("--sprite can not be used with --incremental, --checkpoint, --outputs or --shard-size")
+    if encoding == ssd1306_image_reader.ENCODING_GRAY and (outputs or stats_filename is not None):
+        raise SSD1306_ConversionError("--gray can not be used with --outputs or --stats")
+
+    import ssd1306_image_scheduler # it imports this module
+
+    # Load animation file with PIL
+    img_in = open_image(input_filename)
+    if verbose:
+        print("input image : {}".format(get_pil_image_info_str(img_in)))
+
+    conversion = SSD1306_ImageConversion(img_in, compression, zlib_window_size, dither_method, partial_update,
+                                         encoding, fps, bus_hz, decode_weight, layout_params, block_size,
+                                         sprite, gray_planes)
+    (width, height) = (conversion.width, conversion.height)
+    n_frames = conversion.n_frames
+    encoding = conversion.encoding
+
+    # Prepare the output filename (from "filename.gif" to "filename.widthxheight.nimg.z" or ".raw")
+    output_filename = get_image_filename(ssd1306_image_sources.get_basename(input_filename), conversion.get_config(),
+                                         encoding, conversion.position)
+    if verbose:
+        print("output image: {}".format(output_filename))
+
+    # Incremental conversion: the frames identical to the previous conversion are not converted
+    # again and the chunks of identical frames are copied from the previous output file
+    manifest = None
+    if incremental:
+        params = {"width": img_in.width, "height": img_in.height, "frames": n_frames,
+                  "compression": compression, "zlib_window_size": zlib_window_size,
+                  "dither_method": int(dither_method), "chunk_frames": chunk_frames}
+        if conversion.layout is not None:
+            params["layout"] = layout_params
+        manifest = load_manifest(verbose, output_filename, params)
+
+    # Checkpoints: the output is made valid every checkpoint_frames frames and the checkpoint
+    # (frame, output offset) is added to the journal, an interrupted conversion resumes from
+    # the last checkpoint (the source frames before it are skipped, not converted). The output
+    # is written to "filename.tmp" which, unlike the other outputs, is kept if the conversion
+    # is interrupted; the previous output file is only replaced when the conversion is complete
+    checkpoint = None
+    if checkpoint_frames:
+        journal_params = {"width": img_in.width, "height": img_in.height, "frames": n_frames,
+                          "compression": compression, "zlib_window_size": zlib_window_size,
+                          "dither_method": int(dither_method), "layout": layout_params}
+        checkpoint = load_journal(verbose, output_filename, journal_params)
+        if checkpoint is not None and verbose:
+            print("resuming from the checkpoint of the frame {}".format(checkpoint["frame"]))
+
+    # Single pass outputs: the frames are also written to these outputs (the frames encoding
+    # & the preview gif of convert_ssd1306_images_to_animated_gif.py) so each frame is only
+    # decoded, dithered & packed once
+    outputs_filenames = {}
+    for output in outputs:
+        if output == "gif":
+            filename = "{}-generated.gif".format(ssd1306_image_sources.get_basename(input_filename))
+        else:
+            filename = get_image_filename(ssd1306_image_sources.get_basename(input_filename),
+                                          (width, height, n_frames, output == "z"))
+        if filename != output_filename:
+            outputs_filenames[output] = filename
+
+    # Check if output files already exist...
+    for filename in ([output_filename] if manifest is None else []) + list(outputs_filenames.values()):
+        if os.path.isfile(filename):
+            if not overwrite:
+                raise SSD1306_ConversionError(
+                    "file {} already exits, please delete it or use the proper option to overwrite it!".format(filename))
+            else:
+                if verbose:
+                    print("Warning: file {} already exits and will be overwritten.".format(filename))
+
+    prev_output = b""
+    if manifest is not None:
+        with open(output_filename, "rb") as f:
+            prev_output = f.read()
+
+    start_frame = 0
+    if checkpoint is not None:
+        # Continue the output after the last checkpoint
+        start_frame = checkpoint["frame"]
+        img_out_file = open(get_partial_filename(output_filename), "r+b")
+        img_out_file.truncate(checkpoint["offset"])
+        img_out_file.seek(checkpoint["offset"])
+        img_out_writer = SSD1306_ImageWriter(img_out_file, compression, zlib_window_size, offset=checkpoint["offset"])
+        journal_file = open(get_journal_filename(output_filename), "a")
+        journal_hash = update_file_hash(hashlib.sha1(), img_out_file.name, 0, checkpoint["offset"])
+        journal_offset = checkpoint["offset"]
+    elif checkpoint_frames:
+        # Not in output_files: the partial output is not removed if the conversion fails
+        img_out_file = open(get_partial_filename(output_filename), "wb")
+        img_out_writer = conversion.get_writer(img_out_file)
+        journal_file = open(get_journal_filename(output_filename), "w")
+        journal_file.write(json.dumps({"version": JOURNAL_VERSION, "params": journal_params}) + "\n")
+        journal_file.flush()
+        journal_hash = hashlib.sha1()
+        journal_offset = 0
+    elif incremental:
+        # The chunks must be independent (no preset dictionary) to be reused
+        img_out_file = open_output_file(output_filename, output_files)
+        img_out_writer = SSD1306_ImageWriter(img_out_file, compression, zlib_window_size, chunk_frames, False, jobs)
+    else:
+        img_out_file = open_output_file(output_filename, output_files)
+        img_out_writer = conversion.get_writer(img_out_file, jobs, block_frames)
+    buf_size_in_bytes = (width * height) // 8
+
+    durations_ms = []  # frames durations, for the preview gif
+    outputs_files = []
+    outputs_writers = []
+    for (output, filename) in outputs_filenames.items():
+        outputs_files.append(open_output_file(filename, output_files))
+        if output == "gif":
+            outputs_writers.append(SSD1306_PreviewWriter(outputs_files[-1], width, height, durations_ms))
+        else:
+            outputs_writers.append(SSD1306_ImageWriter(outputs_files[-1], output == "z", zlib_window_size))
+
+    img_out_stats = None
+    if stats_filename is not None:
+        import ssd1306_image_stats
+        img_out_stats = ssd1306_image_stats.SSD1306_FrameStats(width, height,
+                                                               zlib_window_size if compression else None)
+
+    frames_hash = []
+    chunk_bufs = []         # frames of the current chunk, None if identical to the previous conversion
+    chunk_times = []        # conversion times of the frames of the current chunk (statistics)
+    reused_frames = 0
+    reused_chunks = 0
+    chunk = 0
+
+    def reuse_frame(frame, img):
+        # Incremental conversion: do not convert again the frames identical to the previous conversion
+        frames_hash.append(get_frame_hash(img))
+        return manifest is not None and frames_hash[frame] == manifest["frames_hash"][frame]
+
+    def get_frame_duration(frame, img):
+        durations_ms.append(img.info.get("duration") or ssd1306_image_scheduler.DEFAULT_FRAME_DURATION_MS)
+        return frame < start_frame # resumed conversion: already converted
+
+    time_start = time.perf_counter()
+    img_out_frames = conversion.iter_frames(reuse_frame if incremental else get_frame_duration)
+    for (frame, img_out_buf) in enumerate(img_out_frames):
+        if frame < start_frame:
+            continue
+        if verbose:
+            print("{:5}/{} in progress...".format(frame + 1, n_frames))
+
+        time_ms = (time.perf_counter() - time_start) * 1000
+
+        if not incremental:
+            conversion.write_frame(img_out_writer, frame, img_out_buf)
+            for writer in outputs_writers:
+                writer.write_frame(img_out_buf)
+            if img_out_stats is not None:
+                img_out_stats.add_frame(img_out_buf, time_ms)
+            if checkpoint_frames and (frame + 1) % checkpoint_frames == 0 and frame + 1 < n_frames:
+                offset = img_out_writer.checkpoint()
+                # Only the bytes written since the previous checkpoint are read to update the hash
+                update_file_hash(journal_hash, img_out_file.name, journal_offset, offset)
+                journal_offset = offset
+                journal_file.write(json.dumps({"frame": frame + 1, "offset": offset,
+                                               "hash": journal_hash.hexdigest()}) + "\n")
+                journal_file.flush()
+            time_start = time.perf_counter()
+            continue
+
+        if img_out_buf is None:
+            reused_frames += 1
+        chunk_bufs.append(None if img_out_buf is None else bytes(img_out_buf))
+        chunk_times.append(time_ms)
+        if len(chunk_bufs) < chunk_frames and frame < n_frames - 1:
+            time_start = time.perf_counter()
+            continue
+
+        # End of a chunk: copy it from the previous output or write its frames
+        (offset, size) = manifest["chunks"][chunk] if manifest is not None else (0, 0)
+        reuse_chunk = all(buf is None for buf in chunk_bufs)
+        if reuse_chunk:
+            img_out_writer.write_chunk(prev_output[offset : offset + size])
+            reused_chunks += 1
+        if not reuse_chunk or img_out_stats is not None:
+            prev_chunk_buf = prev_output[offset : offset + size]
+            if compression and any(buf is None for buf in chunk_bufs):
+                prev_chunk_buf = zlib.decompressobj(zlib_window_size).decompress(prev_chunk_buf)
+            for (i, buf) in enumerate(chunk_bufs):
+                if buf is None:
+                    buf = prev_chunk_buf[i * buf_size_in_bytes : (i + 1) * buf_size_in_bytes]
+                if not reuse_chunk:
+                    img_out_writer.write_frame(buf)
+                if img_out_stats is not None:
+                    img_out_stats.add_frame(buf, chunk_times[i])
+        chunk_bufs = []
+        chunk_times = []
+        chunk += 1
+        time_start = time.perf_counter()
+
+    conversion.finish(img_out_writer)
+    if verbose and conversion.get_report():
+        print(conversion.get_report())
+    if conversion.get_schedule_report() is not None:
+        print(conversion.get_schedule_report())
+
+    # Close the files
+    img_out_writer.finish()
+    img_out_file.close()
+    for (f, writer) in zip(outputs_files, outputs_writers):
+        writer.finish()
+        f.close()
+
+    if shard_size:
+        # Split the blocks in shards of shard_size bytes at most, they replace the blocks image
+        shards_filenames = write_shards(verbose, overwrite, img_out_file.name, ssd1306_image_sources.get_basename(input_filename),
+                                        (width, height), conversion.block_encoder.blocks_frames, block_size, shard_size, output_files)
+        output_files.remove((img_out_file, output_filename))
+        os.remove(img_out_file.name)
+        output_filename = shards_filenames
+
+    if checkpoint_frames:
+        # The partial output is complete, it replaces the previous output with the other outputs
+        output_files.append((img_out_file, output_filename))
+
+    # The conversion is complete, replace the previous output files
+    commit_output_files(output_files)
+
+    if checkpoint_frames:
+        # The conversion is complete, the journal is not needed anymore
+        journal_file.close()
+        os.remove(get_journal_filename(output_filename))
+
+    if img_out_stats is not None:
+        img_out_stats.save(stats_filename)
+        if verbose:
+            print("{} statistics saved".format(stats_filename))
+
+    if incremental:
+        manifest = {"version": MANIFEST_VERSION, "params": params,
+                    "output": {"size": os.path.getsize(output_filename), "hash": get_file_hash(output_filename)},
+                    "frames_hash": frames_hash, "chunks": img_out_writer.chunks}
+        with open(get_manifest_filename(output_filename), "w") as f:
+            json.dump(manifest, f, indent=1)
+        if verbose:
+            print("{}/{} frames & {}/{} chunks reused from the previous conversion".format(
+                reused_frames, n_frames, reused_chunks, len(img_out_writer.chunks)))
+
+    if verbose:
+        for filename in [output_filename] + list(outputs_filenames.values()):
+            print("{} successfully generated :-)".format(filename))
+
+
+def write_shards(verbose, overwrite, blocks_filename, basename, size, blocks_frames, block_size, shard_size, output_files):
+    """Split an aligned blocks image in shards of whole blocks, return the shard filenames."""
+    shard_blocks = max(1, shard_size // block_size)
+    shards_filenames = []
+    with open(blocks_filename, "rb") as f:
+        for (shard, block) in enumerate(range(0, len(blocks_frames), shard_blocks)):
+            frames = sum(blocks_frames[block : block + shard_blocks])
+            filename = get_image_filename(get_shard_basename(basename, shard), size + (frames, True),
+                                          ssd1306_image_reader.ENCODING_BLOCKS)
+            if os.path.isfile(filename) and not overwrite:
+                raise SSD1306_ConversionError(
+                    "file {} already exits, please delete it or use the proper option to overwrite it!".format(filename))
+            shard_f = open_output_file(filename, output_files)
+            shard_f.write(f.read(len(blocks_frames[block : block + shard_blocks]) * block_size))
+            shards_filenames.append(filename)
+    return ", ".join(shards_filenames)
+
+
+def convert_panels_file(input_filename, output_files, verbose, compression, overwrite, zlib_window_size, dither_method,
+                        partial_update, jobs, block_frames, encoding, decode_weight, panels):
+    # Wall of columns x rows panels: each source frame is converted once then split in one
+    # stream per panel, all the streams have the same frames (see SSD1306_TiledImageReader)
+    (columns, rows) = panels
+    img_in = open_image(input_filename)
+    if verbose:
+        print("input image : {}".format(get_pil_image_info_str(img_in)))
+    if img_in.width % columns or img_in.height % rows:
+        raise SSD1306_ConversionError(
+            "image size {}x{} can not be split in {}x{} panels".format(img_in.width, img_in.height, columns, rows))
+    (width, height) = (img_in.width // columns, img_in.height // rows)
+    if width % 8 or height % 8:
+        raise SSD1306_ConversionError("panel size {}x{} is not a multiple of 8".format(width, height))
+    n_frames = get_frames_count(img_in)
+
+    output_filenames = []
+    for row in range(rows):
+        for column in range(columns):
+            basename = get_panel_basename(ssd1306_image_sources.get_basename(input_filename), column, row)
+            output_filenames.append(get_image_filename(basename, (width, height, n_frames, compression), encoding))
+    for output_filename in output_filenames:
+        if os.path.isfile(output_filename):
+            if not overwrite:
+                raise SSD1306_ConversionError(
+                    "file {} already exits, please delete it or use the proper option to overwrite it!".format(output_filename))
+            elif verbose:
+                print("Warning: file {} already exits and will be overwritten.".format(output_filename))
+
+    chunk_frames = block_frames if compression and jobs > 1 else 0
+    img_out_files = []
+    img_out_writers = []
+    encoders = []
+    for output_filename in output_filenames:
+        img_out_files.append(open_output_file(output_filename, output_files))
+        img_out_writers.append(SSD1306_ImageWriter(img_out_files[-1], compression, zlib_window_size,
+                                                   chunk_frames, chunk_frames > 0, jobs))
+        if encoding == ssd1306_image_reader.ENCODING_TILES:
+            encoders.append(SSD1306_TilesEncoder())
+        elif encoding == ssd1306_image_reader.ENCODING_SCROLL:
+            encoders.append(SSD1306_ScrollEncoder(width, height))
+        elif encoding == ssd1306_image_reader.ENCODING_ADAPTIVE:
+            encoders.append(SSD1306_AdaptiveEncoder(width, height, compression, zlib_window_size, decode_weight))
+        else:
+            encoders.append(None)
+
+    for (frame, img_out_buf) in enumerate(iter_frames(img_in, dither_method, partial_update)):
+        if verbose:
+            print("{:5}/{} in progress...".format(frame + 1, n_frames))
+        panel_bufs = split_panels(img_out_buf, img_in.width, img_in.height, columns, rows)
+        for (img_out_writer, encoder, panel_buf) in zip(img_out_writers, encoders, panel_bufs):
+            if encoding == ssd1306_image_reader.ENCODING_TILES:
+                encoder.add_frame(panel_buf)
+            elif encoder is not None:
+                img_out_writer.write_frame(encoder.add_frame(panel_buf))
+            else:
+                img_out_writer.write_frame(panel_buf)
+
+    # Close the files
+    for (img_out_file, img_out_writer, encoder) in zip(img_out_files, img_out_writers, encoders):
+        if encoding == ssd1306_image_reader.ENCODING_TILES:
+            img_out_writer.write_frame(encoder.get_data())
+        img_out_writer.finish()
+        img_out_file.close()
+    commit_output_files(output_files)
+
+    if verbose:
+        for output_filename in output_filenames:
+            print("{} successfully generated :-)".format(output_filename))
+
+
+class SSD1306_TilesEncoder:
+    """Encode ssd1306 frames with a 8x8 tiles dictionary (see ssd1306_image_reader.TILES_HEADER_FORMAT):
+       the 8-byte cells of the frames (8 columns of a page) are deduplicated in a tiles table
+       shared by all the frames and each frame is stored as tile indices. Text, icons & UI
+       animations use few different tiles, so the files are smaller and the decoding on the
+       device is a copy of each cell from the table.
+    """
+
+    def __init__(self):
+        self.tiles = {}     # tile content -> tile index, in the order of the tiles table
+        self.indices = []   # tile index of each cell of each frame
+
+    def add_frame(self, buf):
+        buf = bytes(buf)
+        tile_size = ssd1306_image_reader.TILE_SIZE_IN_BYTES
+        for pos in range(0, len(buf), tile_size):
+            tile = buf[pos : pos + tile_size]
+            index = self.tiles.get(tile)
+            if index is None:
+                index = len(self.tiles)
+                if index == ssd1306_image_reader.TILES_MAX:
+                    raise SSD1306_ConversionError("too many different tiles (more than {})".format(
+                        ssd1306_image_reader.TILES_MAX))
+                self.tiles[tile] = index
+            self.indices.append(index)
+
+    def get_data(self) -> bytes:
+        """Return the tiles encoded data (header, tiles table & tile indices of the frames)."""
+        header = struct.pack(ssd1306_image_reader.TILES_HEADER_FORMAT, len(self.tiles))
+        if len(self.tiles) <= 256:
+            indices = bytes(self.indices)
+        else:
+            indices = struct.pack("<{}H".format(len(self.indices)), *self.indices)
+        return header + b"".join(self.tiles) + indices
+
+
+def compress_chunk(buf, zlib_window_size, zdict):
+    """Compress a chunk of frames, the result ends on a byte boundary (sync flush) and
+       is not final so chunks can be concatenated into a single zlib stream."""
+    if zdict:
+        z_obj = zlib.compressobj(9, zlib.DEFLATED, zlib_window_size, zdict=zdict)
+    else:
+        z_obj = zlib.compressobj(9, zlib.DEFLATED, zlib_window_size)
+    return z_obj.compress(buf) + z_obj.flush(zlib.Z_SYNC_FLUSH)
+
+
+class SSD1306_ImageWriter:
+    """Write ssd1306 frames to an image file, compressed or not.
+       With chunk_frames, the frames are grouped in chunks compressed independently: each chunk
+       ends with a zlib sync flush and the stream ends with an empty final block, so a chunk
+       can be copied as is from a previous output file.
+       With preset_dict, each chunk is compressed with the end of the previous chunks as
+       preset dictionary (like pigz) so the compression ratio is close to a single stream.
+       With jobs > 1, the chunks are compressed in parallel threads (zlib releases the GIL).
+       With offset, the writer continues an output file written up to a checkpoint (see
+       checkpoint()), the file position must be this offset.
+    """
+
+    def __init__(self, f, compression, zlib_window_size, chunk_frames=0, preset_dict=False, jobs=1, offset=0):
+        self.f = f
+        self.compression = compression
+        self.zlib_window_size = zlib_window_size
+        self.chunk_frames = chunk_frames
+        self.preset_dict = preset_dict
+        self.jobs = jobs
+        self.chunks = []        # (offset, size) of each chunk in the output file
+        self.offset = offset
+        self.chunk_buf = bytearray()
+        self.chunk_frames_count = 0
+        self.history = b""      # end of the previous chunks (preset dictionary)
+        self.pending = collections.deque() # chunks not written yet (futures or bytes), in order
+        self.executor = None
+        if self.compression and self.chunk_frames and self.jobs > 1:
+            import concurrent.futures
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.jobs)
+        if self.compression and not self.chunk_frames:
+            self.z_obj = zlib.compressobj(9, zlib.DEFLATED, self.zlib_window_size)
+
+    def __write(self, buf):
+        self.f.write(buf)
+        self.offset += len(buf)
+
+    def __write_pending(self, wait):
+        # Write the chunks in order, without waiting for them except if requested or if
+        # there are too many chunks in progress
+        while self.pending:
+            chunk = self.pending[0]
+            if not isinstance(chunk, bytes): # future
+                if not wait and not chunk.done() and len(self.pending) <= 2 * self.jobs:
+                    break
+                chunk = chunk.result()
+            self.pending.popleft()
+            self.chunks.append((self.offset, len(chunk)))
+            self.__write(chunk)
+
+    def __end_chunk(self):
+        buf = bytes(self.chunk_buf)
+        if not self.compression:
+            self.pending.append(buf)
+        else:
+            zdict = self.history if self.preset_dict else None
+            if self.executor is not None:
+                self.pending.append(self.executor.submit(compress_chunk, buf, self.zlib_window_size, zdict))
+            else:
+                self.pending.append(compress_chunk(buf, self.zlib_window_size, zdict))
+            if self.preset_dict:
+                self.history = (self.history + buf)[-(1 << abs(self.zlib_window_size)):]
+        self.chunk_buf = bytearray()
+        self.chunk_frames_count = 0
+        self.__write_pending(False)
+
+    def write_frame(self, buf):
+        if not self.chunk_frames:
+            if self.compression:
+                self.__write(self.z_obj.compress(buf))
+            else:
+                self.__write(buf)
+            return
+        self.chunk_buf += buf
+        self.chunk_frames_count += 1
+        if self.chunk_frames_count == self.chunk_frames:
+            self.__end_chunk()
+
+    def write_chunk(self, buf):
+        """Write a full chunk generated previously (chunk mode without preset_dict only)."""
+        self.pending.append(buf)
+        self.__write_pending(False)
+
+    def checkpoint(self) -> int:
+        """Write all the frames to the file (single stream only) and return the output offset.
+           The compressor is full flushed so the next frames do not depend on the previous
+           ones: a new writer created with this offset can continue the stream."""
+        if self.compression:
+            self.__write(self.z_obj.flush(zlib.Z_FULL_FLUSH))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.offset
+
+    def finish(self):
+        """Write the end of the image (the file is not closed)."""
+        if self.chunk_frames:
+            if self.chunk_frames_count:
+                self.__end_chunk()
+            self.__write_pending(True)
+            if self.executor is not None:
+                self.executor.shutdown()
+        if self.compression:
+            if self.chunk_frames:
+                # empty final block
+                self.__write(zlib.compressobj(9, zlib.DEFLATED, self.zlib_window_size).flush())
+            else:
+                self.__write(self.z_obj.flush())
+
+
+class SSD1306_PreviewWriter:
+    """Write ssd1306 frames to a preview animated GIF (what the panel shows), with the same
+       interface as SSD1306_ImageWriter. The frames are kept in memory until finish().
+
+    Args:
+        f (file): output file (or filename)
+        width (int): frames width in pixels
+        height (int): frames height in pixels
+        duration_ms (int or list): duration of all the frames or of each frame in milliseconds
+    """
+
+    def __init__(self, f, width:int, height:int, duration_ms):
+        self.f = f
+        self.width = width
+        self.height = height
+        self.duration_ms = duration_ms
+        self.frames = []
+
+    def write_frame(self, buf):
+        from PIL import Image
+        # Convert to 2d image, then create a 1-bit PIL image and convert it in palette mode
+        # (gif needs palette mode)
+        tmp = bytearray((self.width * self.height) // 8)
+        ssd1306_image_converter.from_ssd1306(self.width, self.height, buf, tmp)
+        img = Image.frombuffer("1", (self.width, self.height), bytes(tmp), "raw", "1", 0, 1)
+        self.frames.append(img.convert("P"))
+
+    def finish(self):
+        """Write the animated GIF with infinite loop (the file is not closed)."""
+        self.frames[0].save(self.f, format="GIF", save_all=True, append_images=self.frames[1:], optimize=True,
+                            duration=self.duration_ms, loop=0)
+
+
+class SSD1306_ScrollEncoder:
+    """Encode ssd1306 frames as updates of the panel RAM & of the display start line (see
+       ssd1306_image_reader.ENCODING_SCROLL): the encoder keeps a model of the panel RAM and,
+       for each frame, tries all the display start lines and keeps the one needing the fewest
+       changed pages. A frame vertically scrolled from the previous one only needs the pages of
+       the newly exposed rows, any other frame is a changed pages update.
+       Note: the ssd1306 horizontal scroll commands scroll continuously at the panel oscillator
+       rate, they can not be synchronized with the frames so they are not used.
+
+    Args:
+        width (int): width in pixels
+        height (int): height in pixels
+    """
+
+    def __init__(self, width:int, height:int):
+        self.width = width
+        self.height = height
+        self.ram_rows = None    # RAM content (one bytes object per row), unknown at the beginning
+        self.start_line = 0
+        self.frames = 0
+        self.scrolled_frames = 0 # frames using a new start line
+        self.pages = 0           # pages sent
+
+    def __get_ram_rows(self, rows, start_line):
+        # RAM content displaying the rows from the start line (the other RAM rows are unchanged)
+        ram_rows = list(self.ram_rows)
+        end = start_line + self.height
+        if end <= ssd1306_image_reader.SSD1306_RAM_HEIGHT:
+            ram_rows[start_line : end] = rows
+        else:
+            split = ssd1306_image_reader.SSD1306_RAM_HEIGHT - start_line
+            ram_rows[start_line:] = rows[:split]
+            ram_rows[:end - ssd1306_image_reader.SSD1306_RAM_HEIGHT] = rows[split:]
+        return ram_rows
+
+    def __get_changed_pages(self, ram_rows):
+        pages = 0
+        for page in range(ssd1306_image_reader.SSD1306_RAM_PAGES):
+            if ram_rows[page * 8 : (page + 1) * 8] != self.ram_rows[page * 8 : (page + 1) * 8]:
+                pages |= 1 << page
+        return pages
+
+    def get_update(self, buf):
+        """Return the update (start_line, pages, ram_rows) of the frame, without applying it."""
+        row_size = self.width // 8
+        tmp = bytearray(len(buf))
+        ssd1306_image_converter.from_ssd1306(self.width, self.height, buf, tmp)
+        rows = [bytes(tmp[row * row_size : (row + 1) * row_size]) for row in range(self.height)]
+
+        if self.ram_rows is None:
+            # First frame: all the RAM pages with the start line 0, so the animation can loop
+            self.ram_rows = [bytes(row_size)] * ssd1306_image_reader.SSD1306_RAM_HEIGHT
+            start_line = 0
+            ram_rows = self.__get_ram_rows(rows, start_line)
+            pages = (1 << ssd1306_image_reader.SSD1306_RAM_PAGES) - 1
+        else:
+            # Keep the current start line if no other one needs fewer changed pages
+            start_line = self.start_line
+            ram_rows = self.__get_ram_rows(rows, start_line)
+            pages = self.__get_changed_pages(ram_rows)
+            for line in range(ssd1306_image_reader.SSD1306_RAM_HEIGHT):
+                if not pages:
+                    break
+                if line == self.start_line:
+                    continue
+                line_ram_rows = self.__get_ram_rows(rows, line)
+                line_pages = self.__get_changed_pages(line_ram_rows)
+                if bin(line_pages).count("1") < bin(pages).count("1"):
+                    (start_line, ram_rows, pages) = (line, line_ram_rows, line_pages)
+        return (start_line, pages, ram_rows)
+
+    def apply_update(self, update) -> bytes:
+        """Apply an update returned by get_update() and return its encoded data."""
+        (start_line, pages, ram_rows) = update
+        if start_line != self.start_line:
+            self.scrolled_frames += 1
+        self.ram_rows = ram_rows
+        self.start_line = start_line
+        self.frames += 1
+
+        ram_buf = bytearray(ssd1306_image_reader.SSD1306_RAM_PAGES * self.width)
+        ssd1306_image_converter.to_ssd1306(self.width, ssd1306_image_reader.SSD1306_RAM_HEIGHT,
+                                           b"".join(ram_rows), ram_buf)
+        data = bytearray((start_line, pages))
+        for page in range(ssd1306_image_reader.SSD1306_RAM_PAGES):
+            if (pages >> page) & 1:
+                data += ram_buf[page * self.width : (page + 1) * self.width]
+                self.pages += 1
+        return bytes(data)
+
+    def add_frame(self, buf) -> bytes:
+        """Return the update of the frame (start line, changed pages & their content)."""
+        return self.apply_update(self.get_update(buf))
+
+    def add_repeat(self) -> bytes:
+        """Return an empty update, the previous frame stays displayed."""
+        self.frames += 1
+        return bytes((self.start_line, 0))
+
+
+class SSD1306_AdaptiveEncoder:
+    """Encode each ssd1306 frame with the best frame type (see ssd1306_image_reader.ENCODING_ADAPTIVE):
+       still frames as repeats, small motions as XOR deltas with the previous frame and scene
+       cuts as key frames. The frame type with the smallest cost (encoded size & weighted
+       decoding cost) is kept. With compression, the size of each candidate is the size added
+       to the zlib stream (measured on a copy of the compressor, the noisy frames are stored
+       by zlib without compression).
+
+    Args:
+        width (int): width in pixels
+        height (int): height in pixels
+        compression (bool): the encoded frames are compressed (single zlib stream)
+        zlib_window_size (int): zlib window size of the compressed stream
+        decode_weight (float): weight of the decoding cost (see DEFAULT_DECODE_WEIGHT), 0 to
+                               only minimize the size
+    """
+
+    def __init__(self, width:int, height:int, compression=False,
+                 zlib_window_size=ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE,
+                 decode_weight=DEFAULT_DECODE_WEIGHT):
+        self.decode_weight = decode_weight
+        self.z_obj = None
+        if compression:
+            self.z_obj = zlib.compressobj(9, zlib.DEFLATED, zlib_window_size)
+        self.prev_buf = None
+        self.frames_types = {frame_type: 0 for frame_type in DECODE_COSTS} # frames of each type
+
+    def __get_cost(self, data, frame_size):
+        decode_cost = DECODE_COSTS[data[0]]
+        size = len(data)
+        if self.z_obj is not None:
+            z_obj = self.z_obj.copy()
+            size = len(z_obj.compress(data)) + len(z_obj.flush(zlib.Z_SYNC_FLUSH))
+            if data[0] != ssd1306_image_reader.FRAME_REPEAT:
+                decode_cost += INFLATE_DECODE_COST
+        return size + self.decode_weight * decode_cost * frame_size
+
+    def add_frame(self, buf) -> bytes:
+        """Return the encoded frame (type & data)."""
+        buf = bytes(buf)
+        candidates = [bytes((ssd1306_image_reader.FRAME_KEY,)) + buf]
+        # The first frame is always a key frame, so the animation can loop
+        if self.prev_buf is not None:
+            if buf == self.prev_buf:
+                candidates.append(bytes((ssd1306_image_reader.FRAME_REPEAT,)))
+            else:
+                delta = (int.from_bytes(buf, "big") ^ int.from_bytes(self.prev_buf, "big")).to_bytes(len(buf), "big")
+                candidates.append(bytes((ssd1306_image_reader.FRAME_DELTA,)) + delta)
+
+        data = min(candidates, key=lambda data: self.__get_cost(data, len(buf)))
+        if self.z_obj is not None:
+            self.z_obj.compress(data) # same stream as the image writer
+        self.frames_types[data[0]] += 1
+        self.prev_buf = buf
+        return data
+
+
+class SSD1306_GrayEncoder:
+    """Encode the weighted bitplanes of gray level frames (see iter_gray_frames()) as changed
+       pages updates (see ssd1306_image_reader.ENCODING_GRAY): each plane is displayed during
+       its weight in display slots. The planes of a frame are sent from the lowest weight to
+       the highest or from the highest to the lowest, in the order sending the fewest changed
+       pages after the previous plane.
+
+    Args:
+        width (int): width in pixels
+        height (int): height in pixels (the panel RAM height at most)
+        planes (int): bitplanes per frame (2 to GRAY_MAX_PLANES)
+    """
+
+    def __init__(self, width:int, height:int, planes:int):
+        if not 2 <= planes <= ssd1306_image_reader.GRAY_MAX_PLANES:
+            raise SSD1306_ConversionError("{} gray planes, 2 to {} planes are supported".format(
+                planes, ssd1306_image_reader.GRAY_MAX_PLANES))
+        if height > ssd1306_image_reader.SSD1306_RAM_HEIGHT:
+            raise SSD1306_ConversionError("the gray encoding needs a height of {} pixels at most".format(
+                ssd1306_image_reader.SSD1306_RAM_HEIGHT))
+        self.width = width
+        self.pages_count = height // 8
+        self.planes = planes
+        self.prev_buf = None    # plane displayed, unknown at the beginning
+        self.frames = 0
+        self.pages = 0          # pages sent
+        self.updates = []       # (slots, pages) of each plane update
+
+    def __get_changed_pages(self, prev_buf, buf):
+        if prev_buf is None:
+            # First plane: all the pages, so the animation can loop
+            return (1 << self.pages_count) - 1
+        width = self.width
+        pages = 0
+        for page in range(self.pages_count):
+            if buf[page * width : (page + 1) * width] != prev_buf[page * width : (page + 1) * width]:
+                pages |= 1 << page
+        return pages
+
+    def __get_pages_count(self, bufs):
+        count = 0
+        prev_buf = self.prev_buf
+        for buf in bufs:
+            count += bin(self.__get_changed_pages(prev_buf, buf)).count("1")
+            prev_buf = buf
+        return count
+
+    def add_frame(self, bufs) -> list:
+        """Return the updates of the planes of a frame (slots, changed pages & their content)."""
+        order = list(range(self.planes))
+        if self.__get_pages_count([bufs[plane] for plane in reversed(order)]) < self.__get_pages_count(bufs):
+            order.reverse()
+        updates = []
+        for plane in order:
+            buf = bytes(bufs[plane])
+            pages = self.__get_changed_pages(self.prev_buf, buf)
+            data = bytearray((1 << plane, pages))
+            for page in range(self.pages_count):
+                if (pages >> page) & 1:
+                    data += buf[page * self.width : (page + 1) * self.width]
+                    self.pages += 1
+            self.updates.append((1 << plane, pages))
+            self.prev_buf = buf
+            updates.append(bytes(data))
+        self.frames += 1
+        return updates
+
+
+class SSD1306_BlockEncoder:
+    """Pack ssd1306 frames in blocks aligned on the flash sectors (see
+       ssd1306_image_reader.ENCODING_BLOCKS): each block is an independent zlib stream with as
+       many frames as possible (the size of the stream with the next frame is measured on a
+       copy of the compressor), padded to the block size.
+
+    Args:
+        block_size (int): block size in bytes, a power of 2 (MIN_BLOCK_SIZE at least)
+        zlib_window_size (int): zlib window size of the blocks
+    """
+
+    def __init__(self, block_size=ssd1306_image_reader.DEFAULT_BLOCK_SIZE,
+                 zlib_window_size=ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE):
+        if block_size < ssd1306_image_reader.MIN_BLOCK_SIZE or block_size & (block_size - 1):
+            raise SSD1306_ConversionError("block size {} is not a power of 2 of {} bytes at least".format(
+                block_size, ssd1306_image_reader.MIN_BLOCK_SIZE))
+        self.block_size = block_size
+        self.zlib_window_size = zlib_window_size
+        self.header_size = struct.calcsize(ssd1306_image_reader.BLOCK_HEADER_FORMAT)
+        self.blocks_frames = [] # frames of each block
+        self.__new_block()
+
+    def __new_block(self):
+        self.z_obj = zlib.compressobj(9, zlib.DEFLATED, self.zlib_window_size)
+        self.block_data = bytearray()
+        self.block_frames = 0
+
+    def __end_block(self) -> bytes:
+        block = bytearray(struct.pack(ssd1306_image_reader.BLOCK_HEADER_FORMAT,
+                                      self.block_size.bit_length() - 1, self.block_frames))
+        block += self.block_data
+        block += self.z_obj.flush()
+        block += bytes(self.block_size - len(block)) # padding
+        self.blocks_frames.append(self.block_frames)
+        self.__new_block()
+        return bytes(block)
+
+    def add_frame(self, buf) -> list:
+        """Add a frame, return the blocks completed (the current block if the frame does not fit in it)."""
+        z_obj = self.z_obj.copy()
+        data = self.z_obj.compress(buf)
+        size = self.header_size + len(self.block_data) + len(data) + len(self.z_obj.copy().flush())
+        if size <= self.block_size and self.block_frames < 0xFFFF:
+            self.block_data += data
+            self.block_frames += 1
+            return []
+        if not self.block_frames:
+            raise SSD1306_ConversionError("a frame does not fit in a block of {} bytes".format(self.block_size))
+        self.z_obj = z_obj # without the frame
+        block = self.__end_block()
+        return [block] + self.add_frame(buf)
+
+    def flush(self) -> list:
+        """Return the last block (if not empty)."""
+        return [self.__end_block()] if self.block_frames else []
+
+
+class SSD1306_ImageConversion:
+    """Conversion of the frames of an image (see open_image()) to the frames of an ssd1306
+       image file: panel layout, sprite window, frame rate scheduling & gray planes, then the
+       encoder of the encoding. The frames of iter_frames() are written with write_frame(),
+       then finish() writes the end of the image.
+
+    Args:
+        img: image opened with open_image()
+        compression (bool): compressed image file (the aligned blocks are always compressed)
+        zlib_window_size (int): zlib window size
+        dither_method (int): PIL dithering method of the 1-bit conversion
+        partial_update (bool): only convert the box changed by each GIF frame
+        encoding (int): ssd1306_image_reader.ENCODING_* (the scroll encoding is used with fps)
+        fps (float): resample the frames at this frame rate & fit the bus bandwidth, None to keep them
+        bus_hz (int): bus clock in Hz of fps & of the gray encoding (ssd1306_image_scheduler.DEFAULT_BUS_HZ if None)
+        decode_weight (float): weight of the decoding cost of the adaptive encoding
+        layout_params (dict): panel layout (see ssd1306_image_layout.get_layout()), None for the default layout
+        block_size (int): block size in bytes of the aligned blocks encoding
+        sprite (bool): crop the frames to the box of their lit pixels (see position)
+        gray_planes (int): bitplanes per frame of the gray encoding
+    """
+
+    def __init__(self, img, compression=False, zlib_window_size=ssd1306_image_reader.DEFAULT_ZLIB_WINDOW_SIZE,
+                 dither_method=DEFAULT_DITHER_METHOD, partial_update=True,
+                 encoding=ssd1306_image_reader.ENCODING_FRAMES, fps=None, bus_hz=None,
+                 decode_weight=DEFAULT_DECODE_WEIGHT, layout_params=None,
+                 block_size=ssd1306_image_reader.DEFAULT_BLOCK_SIZE, sprite=False, gray_planes=None):
+        import ssd1306_image_scheduler # it imports this module
+        if bus_hz is None:
+            bus_hz = ssd1306_image_scheduler.DEFAULT_BUS_HZ
+        if encoding == ssd1306_image_reader.ENCODING_BLOCKS and not compression:
+            raise SSD1306_ConversionError("the aligned blocks are always compressed")
+        self.img = img
+        self.compression = compression
+        self.zlib_window_size = zlib_window_size
+        self.dither_method = dither_method
+        self.partial_update = partial_update
+        self.fps = fps
+        self.bus_hz = bus_hz
+        self.gray_planes = gray_planes
+        self.n_frames = get_frames_count(img)
+        self.n_frames_out = self.n_frames
+
+        # Panel layout (see ssd1306_image_layout): the frames are stored in the panel RAM order,
+        # the output size is the RAM size (for example 132x64 for SH1106 panels)
+        self.layout = None
+        (self.width, self.height) = (img.width, img.height)
+        if layout_params:
+            try:
+                self.layout = ssd1306_image_layout.get_layout(img.width, img.height, **layout_params)
+            except ValueError as e:
+                raise SSD1306_ConversionError(str(e))
+            if not self.layout.is_default() and (fps is not None or encoding == ssd1306_image_reader.ENCODING_SCROLL):
+                raise SSD1306_ConversionError("the scroll encoding needs the default panel layout")
+            (self.width, self.height) = (self.layout.ram_width, self.layout.height)
+
+        # Sprite: the frames are cropped to the box of their lit pixels (aligned on 8 pixels, the
+        # panel pages), only this window of the panel is sent and its position is in the filename
+        # ("filename.32x32+48+16.nimg.z"), all the frames are converted first to find the box
+        self.position = None
+        self.sprite_bufs = None
+        if sprite:
+            if (self.layout is not None or fps is not None or
+                encoding in (ssd1306_image_reader.ENCODING_SCROLL, ssd1306_image_reader.ENCODING_GRAY)):
+                raise SSD1306_ConversionError("--sprite can not be used with --scroll, --gray, --fps or the layout options")
+            bufs = [bytes(buf) for buf in iter_frames(img, dither_method, partial_update)]
+            box = get_sprite_box(bufs, self.width, self.height)
+            if box is None:
+                raise SSD1306_ConversionError("all the frames are black, there is no sprite")
+            self.sprite_bufs = [get_window(buf, self.width, box) for buf in bufs]
+            (x0, y0, x1, y1) = box
+            if box != (0, 0, self.width, self.height):
+                (self.width, self.height, self.position) = (x1 - x0, y1 - y0, (x0, y0))
+
+        # Bandwidth scheduling: the frames are resampled at fps (using the GIF frames durations)
+        # and encoded as changed pages updates fitting the bus bandwidth
+        self.durations = None
+        if fps is not None:
+            if encoding not in (ssd1306_image_reader.ENCODING_FRAMES, ssd1306_image_reader.ENCODING_SCROLL):
+                raise SSD1306_ConversionError("only the scroll encoding can be scheduled (--fps)")
+            encoding = ssd1306_image_reader.ENCODING_SCROLL
+            self.durations = ssd1306_image_scheduler.get_frames_durations(img)
+            self.n_frames_out = ssd1306_image_scheduler.get_ticks_count(self.durations, fps)
+
+        # Grayscale: each frame is quantized in gray_planes weighted bitplanes displayed one after
+        # the other during their weight (see ssd1306_image_scheduler.SSD1306_GrayScheduler), the
+        # frames of the output are the planes
+        self.gray_scheduler = None
+        if encoding == ssd1306_image_reader.ENCODING_GRAY:
+            if self.layout is not None or fps is not None:
+                raise SSD1306_ConversionError("--gray can not be used with --fps or the layout options")
+            if gray_planes is None:
+                raise SSD1306_ConversionError("the gray encoding needs the number of planes")
+            self.gray_scheduler = ssd1306_image_scheduler.SSD1306_GrayScheduler(self.width, self.height, gray_planes,
+                                                                                bus_hz)
+            self.n_frames_out = self.n_frames * gray_planes
+
+        self.encoding = encoding
+        self.tiles_encoder = None
+        self.scroll_encoder = None
+        self.bus_scheduler = None
+        self.adaptive_encoder = None
+        self.block_encoder = None
+        if fps is not None:
+            self.bus_scheduler = ssd1306_image_scheduler.SSD1306_BusScheduler(self.width, self.height, bus_hz, fps)
+            self.scroll_encoder = self.bus_scheduler.scroll_encoder
+        elif encoding == ssd1306_image_reader.ENCODING_SCROLL:
+            self.scroll_encoder = SSD1306_ScrollEncoder(self.width, self.height)
+        elif encoding == ssd1306_image_reader.ENCODING_ADAPTIVE:
+            self.adaptive_encoder = SSD1306_AdaptiveEncoder(self.width, self.height, compression,
+                                                            zlib_window_size, decode_weight)
+        elif encoding == ssd1306_image_reader.ENCODING_BLOCKS:
+            # The blocks are compressed by the encoder, the writer only writes them
+            self.block_encoder = SSD1306_BlockEncoder(block_size, zlib_window_size)
+        elif encoding == ssd1306_image_reader.ENCODING_TILES:
+            # The tiles table is written before the frames: all the frames are encoded first
+            self.tiles_encoder = SSD1306_TilesEncoder()
+
+    def get_config(self):
+        """Get the config (width, height, frames, compression) of the image file."""
+        return (self.width, self.height, self.n_frames_out, self.compression)
+
+    def get_writer(self, f, jobs=1, block_frames=DEFAULT_BLOCK_FRAMES):
+        """Get the writer of the image file to f: with jobs > 1, the frames are compressed by
+           chunks of block_frames frames in parallel (see SSD1306_ImageWriter), except the tiles
+           table & the aligned blocks."""
+        chunk_frames = 0
+        if self.compression and jobs > 1 and self.tiles_encoder is None and self.block_encoder is None:
+            chunk_frames = block_frames
+        return SSD1306_ImageWriter(f, self.compression and self.block_encoder is None, self.zlib_window_size,
+                                   chunk_frames, chunk_frames > 0, jobs)
+
+    def iter_frames(self, skip=None):
+        """Yield the ssd1306 buffer of each frame (its planes with the gray encoding), skip is
+           the callback of iter_frames() (not called for the sprite & gray frames)."""
+        if self.sprite_bufs is not None:
+            return iter(self.sprite_bufs)
+        if self.gray_scheduler is not None:
+            return iter_gray_frames(self.img, self.gray_planes)
+        return iter_frames(self.img, self.dither_method, self.partial_update, skip, self.layout)
+
+    def write_frame(self, writer, frame, buf):
+        """Encode the frame of iter_frames() and write its data."""
+        if self.tiles_encoder is not None:
+            self.tiles_encoder.add_frame(buf)
+        elif self.bus_scheduler is not None:
+            for data in self.bus_scheduler.add_frame(buf, self.durations[frame]):
+                writer.write_frame(data)
+        elif self.scroll_encoder is not None:
+            writer.write_frame(self.scroll_encoder.add_frame(buf))
+        elif self.adaptive_encoder is not None:
+            writer.write_frame(self.adaptive_encoder.add_frame(buf))
+        elif self.block_encoder is not None:
+            for block in self.block_encoder.add_frame(buf):
+                writer.write_frame(block)
+        elif self.gray_scheduler is not None:
+            for data in self.gray_scheduler.add_frame(buf):
+                writer.write_frame(data)
+        else:
+            writer.write_frame(buf)
+
+    def finish(self, writer):
+        """Write the end of the image (the last block, the tiles table), the writer is not finished."""
+        if self.block_encoder is not None:
+            for block in self.block_encoder.flush():
+                writer.write_frame(block)
+        if self.tiles_encoder is not None:
+            writer.write_frame(self.tiles_encoder.get_data())
+
+    def get_report(self) -> str:
+        """Get the encoders statistics."""
+        lines = []
+        if self.block_encoder is not None:
+            lines.append("{} blocks of {} bytes".format(len(self.block_encoder.blocks_frames),
+                                                        self.block_encoder.block_size))
+        if self.tiles_encoder is not None:
+            lines.append("{} different tiles for {} cells".format(len(self.tiles_encoder.tiles),
+                                                                  len(self.tiles_encoder.indices)))
+        if self.scroll_encoder is not None:
+            lines.append("{} frames scrolled with the display start line, {} pages sent instead of {}".format(
+                self.scroll_encoder.scrolled_frames, self.scroll_encoder.pages,
+                self.scroll_encoder.frames * (self.height // 8)))
+        if self.adaptive_encoder is not None:
+            lines.append("{} key, {} repeat & {} delta frames".format(
+                self.adaptive_encoder.frames_types[ssd1306_image_reader.FRAME_KEY],
+                self.adaptive_encoder.frames_types[ssd1306_image_reader.FRAME_REPEAT],
+                self.adaptive_encoder.frames_types[ssd1306_image_reader.FRAME_DELTA]))
+        return "\n".join(lines)
+
+    def get_schedule_report(self) -> str:
+        """Get the bus schedule of fps or of the gray encoding (how to play the image), None if none."""
+        if self.gray_scheduler is not None:
+            return "{}\n{} frames of {} planes, play them with a display slot of {} us (bus {} Hz)".format(
+                self.gray_scheduler.get_report(), self.n_frames, self.gray_planes,
+                self.gray_scheduler.get_slot_us(), self.bus_hz)
+        if self.bus_scheduler is not None:
+            return "{}\n{} frames to play at {} fps (bus {} Hz)".format(
+                self.bus_scheduler.get_report(), self.n_frames_out, self.fps, self.bus_hz)
+        return None
@@ -0,0 +1,134 @@
+"""
+Panel layouts of images for ssd1306-like Oled panel
+https://github.com/coolcornucopia/convert-animated-gif-for-ssd1306-panel
+
+MIT License
+
+Copyright (c) 2022 coolcornucopia
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import operator
+
+# Memory addressing modes (SET_MEM_ADDR command values): with the horizontal (and the page)
+# addressing mode, the bytes are sent page after page (the ssd1306 format of to_ssd1306()),
+# with the vertical addressing mode, they are sent column after column.
+ADDRESSING_HORIZONTAL = 0x00
+ADDRESSING_VERTICAL = 0x01
+
+# SH1106 panels: 132 columns RAM, the 128 columns of the panel start at the column 2
+SH1106_RAM_WIDTH = 132
+SH1106_COLUMN_OFFSET = 2
+
+ROTATIONS = (0, 90, 180, 270)
+
+
+class SSD1306_Layout:
+    """Describe how the panel RAM is filled (addressing mode, RAM width & column offset,
+       rotation & mirroring of the panel) and compile it once in a permutation table: the source
+       pixel of each bit of the RAM bytes. Each frame is then converted with a single gather, the
+       device sends the frames as they are.
+       The default layout gives the ssd1306 format of to_ssd1306().
+
+    Args:
+        width (int): panel width in pixels
+        height (int): panel height in pixels
+        addressing (int): ADDRESSING_HORIZONTAL (or page addressing) or ADDRESSING_VERTICAL
+        ram_width (int): RAM width in bytes (columns), the panel width by default
+        column_offset (int): RAM column of the first panel column
+        rotation (int): clockwise rotation in degrees of the source image on the panel (the
+                        source image is height x width with 90 & 270)
+        mirror_x (bool): horizontal mirroring of the panel
+        mirror_y (bool): vertical mirroring of the panel
+    """
+
+    def __init__(self, width:int, height:int, addressing=ADDRESSING_HORIZONTAL, ram_width=None,
+                 column_offset=0, rotation=0, mirror_x=False, mirror_y=False):
+        if rotation not in ROTATIONS:
+            raise ValueError("rotation {} is not one of {}".format(rotation, ROTATIONS))
+        if height % 8:
+            raise ValueError("height {} is not a multiple of 8".format(height))
+        self.width = width
+        self.height = height
+        self.addressing = addressing
+        self.ram_width = ram_width if ram_width is not None else width
+        self.column_offset = column_offset
+        self.rotation = rotation
+        self.mirror_x = mirror_x
+        self.mirror_y = mirror_y
+        self.pages = height // 8
+        self.buf_size_in_bytes = self.ram_width * self.pages
+        # Size of the source image
+        self.source_width, self.source_height = (height, width) if rotation in (90, 270) else (width, height)
+        self.gather = operator.itemgetter(*self.__compile())
+
+    def is_default(self) -> bool:
+        """Return True if the layout gives the ssd1306 format of to_ssd1306()."""
+        return (self.addressing == ADDRESSING_HORIZONTAL and self.ram_width == self.width and
+                not self.column_offset and not self.rotation and not self.mirror_x and not self.mirror_y)
+
+    def __get_source_pixel(self, x, y):
+        # Index of the source pixel displayed at (x, y) on the panel
+        if self.mirror_x:
+            x = self.width - 1 - x
+        if self.mirror_y:
+            y = self.height - 1 - y
+        if self.rotation == 90:
+            (x, y) = (y, self.source_height - 1 - x)
+        elif self.rotation == 180:
+            (x, y) = (self.source_width - 1 - x, self.source_height - 1 - y)
+        elif self.rotation == 270:
+            (x, y) = (self.source_width - 1 - y, x)
+        return y * self.source_width + x
+
+    def __compile(self):
+        # Source pixel of each bit of the RAM bytes, most significant bit first (packing order),
+        # the RAM columns outside of the panel get the blank pixel after the source pixels
+        blank = self.source_width * self.source_height
+        table = []
+        for pos in range(self.buf_size_in_bytes):
+            if self.addressing == ADDRESSING_VERTICAL:
+                (column, page) = divmod(pos, self.pages)
+            else:
+                (page, column) = divmod(pos, self.ram_width)
+            x = column - self.column_offset
+            for bit in range(7, -1, -1):
+                if 0 <= x < self.width:
+                    table.append(self.__get_source_pixel(x, page * 8 + bit))
+                else:
+                    table.append(blank)
+        return table
+
+    def convert(self, img) -> bytes:
+        """Convert a 1-bit per pixel PIL image (mode "1", the source image) to the RAM bytes."""
+        from PIL import Image
+        if img.size != (self.source_width, self.source_height):
+            raise ValueError("image size {}x{} is not the layout source size {}x{}".format(
+                img.width, img.height, self.source_width, self.source_height))
+        pixels = img.tobytes("raw", "L") + b"\x00" # 1 byte per pixel & the blank pixel
+        bits = bytes(self.gather(pixels))
+        return Image.frombytes("1", (len(bits), 1), bits, "raw", "1;8").tobytes()
+
+
+def get_layout(source_width:int, source_height:int, **layout_params):
+    """Get the layout (see SSD1306_Layout for the parameters) of a source image size."""
+    if layout_params.get("rotation", 0) in (90, 270):
+        return SSD1306_Layout(source_height, source_width, **layout_params)
+    return SSD1306_Layout(source_width, source_height, **layout_params)
@@ -28,7 +28,9 @@ SOFTWARE.
 __version__ = "0.0.0-auto.0"
 __repo__ = "https://github.com/coolcornucopia/convert-animated-gif-for-ssd1306-panel"
 
+import struct
 import sys
+import time
 import zlib
 
 
@@ -46,9 +48,151 @@ else:
 COMPRESSED_CHUNK_SIZE = 512
 
 
+# By default the image cache keeps up to this amount of decoded frames in memory. You may
+# adapt it according to the memory left on your system...
+DEFAULT_CACHE_BUDGET_IN_BYTES = 16 * 1024
+
+
+# Bundle file format (see SSD1306_ImageBundle), all values are little endian:
+# - header: magic "SSDB", version (u8), reserved (u8), number of images (u16)
+# - directory, one entry per image: name length (u8), name (utf-8), width (u16), height (u16),
+#   frames (u32), format (u8: bit 0 compression, next bits encoding), offset of the image data
+#   in the bundle (u32), size (u32)
+# - images data, exactly the content of the image files
+BUNDLE_MAGIC = b"SSDB"
+BUNDLE_VERSION = 1
+BUNDLE_HEADER_FORMAT = "<4sBBH"
+BUNDLE_ENTRY_FORMAT = "<HHIBII"
+
+
+# Image encodings, given by the filename extension (see IMAGE_EXTENSIONS):
+# - ENCODING_FRAMES: the ssd1306 frames one after the other
+# - ENCODING_TILES: 8x8 tiles dictionary, see below
+# - ENCODING_SCROLL: display start line & changed pages updates, see below
+# - ENCODING_ADAPTIVE: key, repeat or delta frames (the best one for each frame), see below
+# - ENCODING_BLOCKS: the frames in compressed blocks aligned on the flash sectors, see below
+# - ENCODING_GRAY: grayscale bitplanes changed pages updates, see below
+ENCODING_FRAMES = 0
+ENCODING_TILES = 1
+ENCODING_SCROLL = 2
+ENCODING_ADAPTIVE = 3
+ENCODING_BLOCKS = 4
+ENCODING_GRAY = 5
+
+# Filename extension of each (encoding, compression)
+IMAGE_EXTENSIONS = {
+    (ENCODING_FRAMES, False): "raw",
+    (ENCODING_FRAMES, True):  "z",
+    (ENCODING_TILES, False):  "t",
+    (ENCODING_TILES, True):   "tz",
+    (ENCODING_SCROLL, False): "s",
+    (ENCODING_SCROLL, True):  "sz",
+    (ENCODING_ADAPTIVE, False): "a",
+    (ENCODING_ADAPTIVE, True):  "az",
+    (ENCODING_BLOCKS, True):    "zb",
+    (ENCODING_GRAY, False):     "gr",
+    (ENCODING_GRAY, True):      "grz",
+}
+
+
+# Tiles format (ENCODING_TILES), all values are little endian and the whole content is
+# compressed for .tz files:
+# - header: number of tiles (u16)
+# - tiles table, 8 bytes per tile: a cell of the ssd1306 buffer (8 columns of a page)
+# - frames: one tile index per cell (page by page, 8 columns by 8 columns), u8 if there are
+#   256 tiles or less, else u16
+TILES_HEADER_FORMAT = "<H"
+TILE_SIZE_IN_BYTES = 8
+TILES_MAX = 0xFFFF
+
+
+# Scroll format (ENCODING_SCROLL), the whole content is compressed for .sz files. Each frame is
+# an update of the ssd1306 RAM (SSD1306_RAM_PAGES pages whatever the panel height) & of the
+# display start line (the display row r shows the RAM row (r + start line) % SSD1306_RAM_HEIGHT):
+# - display start line (u8), changed RAM pages (u8, bit n for page n)
+# - the content of the changed pages (width bytes per page), page after page
+# The first frame writes all the RAM pages with the start line 0, so the animation can loop.
+SSD1306_RAM_HEIGHT = 64
+SSD1306_RAM_PAGES = SSD1306_RAM_HEIGHT // 8
+
+
+# Adaptive format (ENCODING_ADAPTIVE), the whole content is compressed for .az files. Each
+# frame starts with its type (u8):
+# - FRAME_KEY: the frame
+# - FRAME_REPEAT: nothing, same frame as the previous one
+# - FRAME_DELTA: the frame XOR the previous frame
+# The first frame is always a key frame, so the animation can loop.
+FRAME_KEY = 0
+FRAME_REPEAT = 1
+FRAME_DELTA = 2
+
+
+# Blocks format (ENCODING_BLOCKS, always compressed): the file is made of blocks of the block
+# size (a power of 2, MIN_BLOCK_SIZE at least) aligned on the flash sectors / filesystem blocks,
+# so the reader only does aligned reads of whole blocks. Each block is:
+# - header: block size log2 (u8), frames in the block (u16), little endian
+# - the frames of the block, compressed as an independent raw deflate stream
+# - zero padding up to the block size
+BLOCK_HEADER_FORMAT = "<BH"
+MIN_BLOCK_SIZE = 512
+DEFAULT_BLOCK_SIZE = 4096
+
+
+# Gray format (ENCODING_GRAY), the whole content is compressed for .grz files. Each gray level
+# frame is made of weighted bitplanes (2 planes: 4 levels, 3 planes: 8 levels) displayed one
+# after the other, each one during its weight in display slots, faster than the eye can follow.
+# Each frame of the file is a bitplane update (the frames count is the planes count):
+# - display slots of the plane (u8, its weight: 1, 2, 4), changed pages (u8, bit n for page n)
+# - the content of the changed pages (width bytes per page), page after page
+# The planes of a gray frame are stored from the lowest weight to the highest one or from the
+# highest to the lowest (the order sending the fewest changed pages), so consecutive planes of
+# the same weight often only need a few pages. The first plane writes all the pages, so the
+# animation can loop.
+GRAY_MAX_PLANES = 3
+
+
+# Runtime metrics timer (see SSD1306_ReaderStats), in microseconds
+if hasattr(time, "ticks_us"):
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+else:
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+
+class SSD1306_ReaderStats:
+    """Runtime metrics of a SSD1306_ImageReader (see SSD1306_ImageReader.enable_stats()), the
+       times are in microseconds. The decompression time is the frame time not spent in the
+       file reads (decoding included).
+       Note: with MicroPython, the compressed files are read by zlib.DecompIO so their reads
+       are counted as decompression (bytes_read & chunk_reads are not counted)."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes_read = 0
+        self.bytes_inflated = 0
+        self.chunk_reads = 0
+        self.loop_restarts = 0
+        self.read_us = 0
+        self.decompress_us = 0
+        self.frame_read_us = 0          # last frame
+        self.frame_decompress_us = 0    # last frame
+
+    def __str__(self):
+        return "{} frames, {} bytes read ({} reads), {} bytes inflated, {} loop restarts, read {} us, decompress {} us".format(
+            self.frames, self.bytes_read, self.chunk_reads, self.bytes_inflated, self.loop_restarts,
+            self.read_us, self.decompress_us)
+
+
 class SSD1306_ImageReader:
 
-    def __init__(self, filename):
+    def __init__(self, filename, config=None, offset=0, size=None, encoding=None):
+        """Open an image file, or an image stored at [offset, offset + size[ of a file
+           (bundle) with its config (width, height, frames, compression) and its encoding
+           given explicitly."""
 
         # We need to handle the MicroPython case unfortunately
         self.micropython = True
@@ -63,22 +207,42 @@ class SSD1306_ImageReader:
                 exit(1) # exit with error
 
         self.filename = filename
+        self.offset = offset
+        self.size = size
+        self.stats = None # runtime metrics disabled (see enable_stats())
 
         # Get information from the filename
-        (self.width, self.height, self.frames, self.compression) = self.get_config_from_filename(self.filename)
+        # Position of the image on the panel: (0, 0) except for the sprites ("name.32x32+48+16.Nimg.z")
+        (self.x, self.y) = (0, 0)
+        if config is None:
+            config = self.get_config_from_filename(self.filename)
+            (self.x, self.y) = self.get_position_from_filename(self.filename)
+        (self.width, self.height, self.frames, self.compression) = config
+        if encoding is None:
+            encoding = self.get_encoding_from_filename(self.filename)
+        self.encoding = encoding
         #print("debug:", str(self))
 
         self.buf_size_in_bytes = (self.width * self.height) // 8 # 1-bit per pixel
 
         # If the file is compressed, we read small chunks else we read the entire image
 
-        if self.compression:
+        if self.encoding == ENCODING_BLOCKS:
+            # Aligned reads of whole blocks, the block size is given by the first block header
+            self.f = open(self.filename, "rb") # TODO manage errors
+            self.__rewind()
+            self.block_buf = bytearray(MIN_BLOCK_SIZE)
+            self.__read_block()
+
+        elif self.compression:
             if self.micropython:
                 import io
                 self.f = io.open(self.filename, "rb") # TODO manage errors
+                self.__rewind()
                 self.z_obj = zlib.DecompIO(self.f, DEFAULT_ZLIB_WINDOW_SIZE)
             else:
                 self.f = open(self.filename, "rb") # TODO manage errors
+                self.__rewind()
                 self.z_obj = zlib.decompressobj(DEFAULT_ZLIB_WINDOW_SIZE)
 
             self.buf = bytearray(0) # empty buffer
@@ -87,66 +251,554 @@ class SSD1306_ImageReader:
         else:
             # No compression, we can read the entire image directly
             self.f = open(self.filename, "rb") # TODO manage errors
+            self.__rewind()
             self.f_read_size = self.buf_size_in_bytes
 
+        if self.encoding == ENCODING_TILES:
+            self.__load_tiles()
+        elif self.encoding == ENCODING_SCROLL:
+            self.ram = bytearray(SSD1306_RAM_PAGES * self.width)
+            self.frame_buf = bytearray(self.buf_size_in_bytes)
+        elif self.encoding == ENCODING_ADAPTIVE:
+            self.frame_buf = bytes(self.buf_size_in_bytes)
+        elif self.encoding == ENCODING_GRAY:
+            self.frame_buf = bytearray(self.buf_size_in_bytes)
+
     def get_config_from_filename(self, filename):
         """Get information from the input filename ("filename.widthxheight.nimg.z" or ".raw")."""
         tmp = filename.split(".")
-        width = int(tmp[-3].split("x")[0])
-        height = int(tmp[-3].split("x")[1])
+        size = tmp[-3].split("+")[0]
+        width = int(size.split("x")[0])
+        height = int(size.split("x")[1])
         frames = int(tmp[-2].split("img")[0])
         compression = False
-        if tmp[-1] == "z":
+        if tmp[-1] in ("z", "tz", "sz", "az", "zb", "grz"):
             compression = True
         # TODO add various checks on parameters
         return (width, height, frames, compression)
 
+    def get_position_from_filename(self, filename):
+        """Get the sprite position (x, y) from the input filename ("filename.widthxheight+x+y.nimg.z"), (0, 0) if none."""
+        tmp = filename.split(".")[-3].split("+")
+        if len(tmp) != 3:
+            return (0, 0)
+        return (int(tmp[1]), int(tmp[2]))
+
+    def get_encoding_from_filename(self, filename):
+        """Get the encoding from the input filename extension (see IMAGE_EXTENSIONS)."""
+        extension = filename.split(".")[-1]
+        if extension in ("t", "tz"):
+            return ENCODING_TILES
+        if extension in ("s", "sz"):
+            return ENCODING_SCROLL
+        if extension in ("a", "az"):
+            return ENCODING_ADAPTIVE
+        if extension == "zb":
+            return ENCODING_BLOCKS
+        if extension in ("gr", "grz"):
+            return ENCODING_GRAY
+        return ENCODING_FRAMES
+
     def __str__(self):
-       return f"{self.width}x{self.height}, {self.frames} frame{'s' if self.frames > 1 else ''}, compression {self.compression}, {self.filename}"
+       tiles = f", {self.tiles_count} tiles" if self.encoding == ENCODING_TILES else ""
+       position = f" at +{self.x}+{self.y}" if self.x or self.y else ""
+       return f"{self.width}x{self.height}{position}, {self.frames} frame{'s' if self.frames > 1 else ''}, compression {self.compression}{tiles}, {self.filename}"
+
+    def close(self):
+        self.f.close()
+
+    def enable_stats(self, on_frame=None):
+        """Enable the runtime metrics and return them (see SSD1306_ReaderStats), on_frame(stats)
+           is called after each frame if given. When they are not enabled, the reader only pays
+           a None check per file read."""
+        self.stats = SSD1306_ReaderStats()
+        self.on_frame = on_frame
+        # The next frame methods are replaced by their instrumented version
+        next_frame = self.next_frame
+        self.next_frame = lambda: self.__next_with_stats(next_frame)
+        if self.encoding == ENCODING_SCROLL:
+            next_update = self.next_update
+            self.next_update = lambda: self.__next_with_stats(next_update)
+        elif self.encoding == ENCODING_GRAY:
+            next_plane = self.next_plane
+            self.next_plane = lambda: self.__next_with_stats(next_plane)
+        return self.stats
+
+    def __next_with_stats(self, next_method):
+        stats = self.stats
+        read_us = stats.read_us
+        start = ticks_us()
+        result = next_method()
+        frame_us = ticks_diff(ticks_us(), start)
+        stats.frames += 1
+        stats.frame_read_us = stats.read_us - read_us
+        stats.frame_decompress_us = frame_us - stats.frame_read_us
+        stats.decompress_us += stats.frame_decompress_us
+        if self.on_frame is not None:
+            self.on_frame(stats)
+        return result
+
+    def __add_read(self, size, start):
+        self.stats.read_us += ticks_diff(ticks_us(), start)
+        self.stats.bytes_read += size
+        self.stats.chunk_reads += 1
+
+    def __rewind(self):
+        if self.stats is not None:
+            self.stats.loop_restarts += 1
+        self.f.seek(self.offset)
+        self.f_remaining = self.size
+
+    def __read_file(self, size):
+        start = ticks_us() if self.stats is not None else 0
+        if self.f_remaining is None:
+            buf = self.f.read(size)
+        else:
+            # do not read after the end of the image (bundle case)
+            buf = self.f.read(min(size, self.f_remaining))
+            self.f_remaining -= len(buf)
+        if self.stats is not None:
+            self.__add_read(len(buf), start)
+        return buf
+
+    def __readinto_file(self, buf):
+        start = ticks_us() if self.stats is not None else 0
+        if self.f_remaining is not None:
+            # do not read after the end of the image (bundle case)
+            buf = memoryview(buf)[:self.f_remaining]
+        size = self.f.readinto(buf) or 0
+        if self.f_remaining is not None:
+            self.f_remaining -= size
+        if self.stats is not None:
+            self.__add_read(size, start)
+        return size
 
     def __read_file_chunks_and_loop(self, size):
-        buf = self.f.read(size)
-        # loop the file if necessary
-        if not buf:
-            self.f.seek(0)
-            buf = self.f.read(size)
+        buf = self.__read_file(size)
+        # loop the file if necessary (nothing read while data were requested)
+        if not buf and size:
+            self.__rewind()
+            buf = self.__read_file(size)
 
         return buf
 
-    def next_frame(self):
+    def __read_data(self, size):
+        # Read size bytes of the (decompressed) image data, looping at the end of the image
         if self.compression:
             if self.micropython:
                 # MicroPython specific implementation
-                while len(self.buf) < self.buf_size_in_bytes:
-                    self.buf += self.z_obj.read(self.buf_size_in_bytes)
+                while len(self.buf) < size:
+                    data = self.z_obj.read(size)
+                    if self.stats is not None:
+                        self.stats.bytes_inflated += len(data)
+                    self.buf += data
                     # Looping the animation
                     if not self.buf:
                         # Close then re-create the stream... as seek is not enough...
                         self.f.close()
                         import io # TODO why... but it looks necessary...
                         self.f = io.open(self.filename, "rb") # TODO manage errors
+                        self.__rewind()
                         self.z_obj = zlib.DecompIO(self.f, DEFAULT_ZLIB_WINDOW_SIZE)
-                        self.buf += self.z_obj.read(self.buf_size_in_bytes)
+                        data = self.z_obj.read(size)
+                        if self.stats is not None:
+                            self.stats.bytes_inflated += len(data)
+                        self.buf += data
                     #print("1", "len(self.buf)", len(self.buf))
 
             else:
                 # Standard Python implementation
-                while len(self.buf) < self.buf_size_in_bytes:
+                while len(self.buf) < size:
+                    # Looping the animation: the end of the zlib stream has been reached,
+                    # the next data will be the beginning of the file again
+                    if self.z_obj.eof:
+                        self.__rewind()
+                        self.z_obj = zlib.decompressobj(DEFAULT_ZLIB_WINDOW_SIZE)
                     data = self.z_obj.unconsumed_tail
                     if not data:
                         data = self.__read_file_chunks_and_loop(self.f_read_size)
                     else:
                         print("DEBUG ME: never happened? may depends on zlib version...")
                         pass
-                    self.buf += self.z_obj.decompress(data)
+                    data = self.z_obj.decompress(data)
+                    if self.stats is not None:
+                        self.stats.bytes_inflated += len(data)
+                    self.buf += data
                     #print("1", "len(b)", len(b), "len(self.buf)", len(self.buf))
 
-            current_frame_buf = self.buf[:self.buf_size_in_bytes]
-            self.buf = self.buf[self.buf_size_in_bytes : len(self.buf)]
-            #print("2", "len(current_frame_buf)", len(current_frame_buf), "len(self.buf)", len(self.buf))
+            data = self.buf[:size]
+            self.buf = self.buf[size : len(self.buf)]
+            #print("2", "len(data)", len(data), "len(self.buf)", len(self.buf))
+
+        else:
+            # No compression: easy case, simply read the data
+            data = self.__read_file_chunks_and_loop(size)
+
+        return data
+
+    def __read_block(self):
+        # Read the next block (looping the animation) with a single aligned read in the same buffer
+        size = self.__readinto_file(self.block_buf)
+        if not size:
+            self.__rewind()
+            size = self.__readinto_file(self.block_buf)
+        (block_size_log2, self.block_frames) = struct.unpack_from(BLOCK_HEADER_FORMAT, self.block_buf)
+        if len(self.block_buf) != 1 << block_size_log2:
+            # First block: the block size is known now, read the rest of the block
+            block_buf = bytearray(1 << block_size_log2)
+            block_buf[:size] = self.block_buf[:size]
+            size += self.__readinto_file(memoryview(block_buf)[size:])
+            self.block_buf = block_buf
+        data = memoryview(self.block_buf)[struct.calcsize(BLOCK_HEADER_FORMAT) : size]
+        if self.micropython:
+            import io
+            self.z_obj = zlib.DecompIO(io.BytesIO(data), DEFAULT_ZLIB_WINDOW_SIZE)
+        else:
+            self.z_obj = zlib.decompressobj(DEFAULT_ZLIB_WINDOW_SIZE)
+            self.z_data = data
+
+    def __next_block_frame(self):
+        if not self.block_frames:
+            self.__read_block()
+        self.block_frames -= 1
+        if self.micropython:
+            buf = self.z_obj.read(self.buf_size_in_bytes)
+        else:
+            buf = self.z_obj.decompress(self.z_data, self.buf_size_in_bytes)
+            self.z_data = self.z_obj.unconsumed_tail
+        if self.stats is not None:
+            self.stats.bytes_inflated += len(buf)
+        return buf
 
+    def __load_tiles(self):
+        # Read the tiles table once, the frames are then only tile indices
+        header_size = struct.calcsize(TILES_HEADER_FORMAT)
+        (self.tiles_count,) = struct.unpack(TILES_HEADER_FORMAT, self.__read_data(header_size))
+        self.tiles = memoryview(self.__read_data(self.tiles_count * TILE_SIZE_IN_BYTES))
+        self.tiles_header_size = header_size + self.tiles_count * TILE_SIZE_IN_BYTES
+        self.tile_index_size = 1 if self.tiles_count <= 256 else 2
+        self.cells = self.buf_size_in_bytes // TILE_SIZE_IN_BYTES
+        self.frame = 0
+        self.frame_buf = bytearray(self.buf_size_in_bytes)
+
+    def __next_tiles_frame(self):
+        # Looping the animation: skip the header & the tiles table already loaded
+        if self.frame == self.frames:
+            self.__read_data(self.tiles_header_size)
+            self.frame = 0
+        self.frame += 1
+
+        # Expand the tile indices straight into the frame buffer
+        indices = self.__read_data(self.cells * self.tile_index_size)
+        buf = self.frame_buf
+        tiles = self.tiles
+        pos = 0
+        if self.tile_index_size == 1:
+            for index in indices:
+                tile = index * TILE_SIZE_IN_BYTES
+                buf[pos : pos + TILE_SIZE_IN_BYTES] = tiles[tile : tile + TILE_SIZE_IN_BYTES]
+                pos += TILE_SIZE_IN_BYTES
         else:
-            # No compression: easy case, simply read image by image
-            current_frame_buf = self.__read_file_chunks_and_loop(self.f_read_size)
+            for i in range(0, len(indices), 2):
+                tile = (indices[i] | (indices[i + 1] << 8)) * TILE_SIZE_IN_BYTES
+                buf[pos : pos + TILE_SIZE_IN_BYTES] = tiles[tile : tile + TILE_SIZE_IN_BYTES]
+                pos += TILE_SIZE_IN_BYTES
+        return buf
+
+    def next_update(self):
+        """Scroll encoding: return the next update (start_line, pages, data) to send to the
+           panel (see SSD1306.show_update()): the display start line, the changed RAM pages
+           (bit n for page n) & their content, page after page (looping the animation)."""
+        return self.__read_update()
+
+    def __read_update(self):
+        # Not replaced by enable_stats() so a frame is only counted once by next_frame()
+        (start_line, pages) = self.__read_data(2)
+        return (start_line, pages, self.__read_data(bin(pages).count("1") * self.width))
+
+    def __next_scroll_frame(self):
+        # Update the RAM model then get the displayed frame (RAM rows from the start line)
+        (start_line, pages, data) = self.__read_update()
+        width = self.width
+        ram = self.ram
+        pos = 0
+        for page in range(SSD1306_RAM_PAGES):
+            if (pages >> page) & 1:
+                ram[page * width : (page + 1) * width] = data[pos : pos + width]
+                pos += width
+
+        buf = self.frame_buf
+        if start_line == 0:
+            buf[:] = ram[:self.buf_size_in_bytes]
+            return buf
+        mask = (1 << self.height) - 1
+        for x in range(width):
+            column = 0 # the RAM column, one bit per row
+            for page in range(SSD1306_RAM_PAGES):
+                column |= ram[page * width + x] << (page * 8)
+            column = ((column >> start_line) | (column << (SSD1306_RAM_HEIGHT - start_line))) & mask
+            for page in range(self.height // 8):
+                buf[page * width + x] = (column >> (page * 8)) & 0xFF
+        return buf
+
+    def __next_adaptive_frame(self):
+        # Decode the frame according to its type
+        frame_type = self.__read_data(1)[0]
+        if frame_type == FRAME_REPEAT:
+            return self.frame_buf
+        buf = self.__read_data(self.buf_size_in_bytes)
+        if frame_type == FRAME_DELTA:
+            # XOR of the whole frame with big integers (much faster than a loop in MicroPython)
+            buf = (int.from_bytes(self.frame_buf, "big") ^ int.from_bytes(buf, "big")).to_bytes(self.buf_size_in_bytes, "big")
+        self.frame_buf = buf
+        return self.frame_buf
+
+    def next_plane(self):
+        """Gray encoding: return the next bitplane update (slots, pages, data) to send to the
+           panel (see SSD1306.show_update() with the start line 0): the display slots of the
+           plane, the changed pages (bit n for page n) & their content, page after page
+           (looping the animation)."""
+        return self.__read_plane()
+
+    def __read_plane(self):
+        # Not replaced by enable_stats() so a plane is only counted once by next_frame()
+        (slots, pages) = self.__read_data(2)
+        return (slots, pages, self.__read_data(bin(pages).count("1") * self.width))
+
+    def __next_gray_frame(self):
+        # The displayed bitplane (the weights are ignored)
+        (slots, pages, data) = self.__read_plane()
+        width = self.width
+        buf = self.frame_buf
+        pos = 0
+        for page in range(self.height // 8):
+            if (pages >> page) & 1:
+                buf[page * width : (page + 1) * width] = data[pos : pos + width]
+                pos += width
+        return buf
+
+    def next_frame(self):
+        """Return the next frame (looping the animation), the next bitplane with the gray
+           encoding. With the tiles, scroll & gray encodings, the same buffer is updated and
+           returned again for the next frame so copy it to keep it."""
+        if self.encoding == ENCODING_TILES:
+            return self.__next_tiles_frame()
+        if self.encoding == ENCODING_SCROLL:
+            return self.__next_scroll_frame()
+        if self.encoding == ENCODING_ADAPTIVE:
+            return self.__next_adaptive_frame()
+        if self.encoding == ENCODING_BLOCKS:
+            return self.__next_block_frame()
+        if self.encoding == ENCODING_GRAY:
+            return self.__next_gray_frame()
+        return self.__read_data(self.buf_size_in_bytes)
+
+
+class SSD1306_CachedImageReader:
+    """Same interface as SSD1306_ImageReader but the frames are read from memory."""
+
+    def __init__(self, reader, frames_buf):
+        self.filename = reader.filename
+        self.width = reader.width
+        self.height = reader.height
+        self.frames = reader.frames
+        self.compression = reader.compression
+        self.buf_size_in_bytes = reader.buf_size_in_bytes
+        self.frames_buf = memoryview(frames_buf)
+        self.frame = 0
+
+    def __str__(self):
+       return f"{self.width}x{self.height}, {self.frames} frame{'s' if self.frames > 1 else ''}, compression {self.compression}, {self.filename} (cached)"
+
+    def close(self):
+        pass
+
+    def next_frame(self):
+        pos = self.frame * self.buf_size_in_bytes
+        self.frame += 1
+        if self.frame >= self.frames:
+            self.frame = 0 # looping the animation
+        return self.frames_buf[pos : pos + self.buf_size_in_bytes]
+
+
+class SSD1306_TiledImageReader:
+    """Read the per-panel streams of a wall of panels (see --panels) in lockstep: each call
+       of next_frame() returns the frames of all the panels for the same frame index.
+
+    Args:
+        filenames (list): panel image filenames ("name_panel<column>_<row>..."), in any order:
+                          they are sorted row after row from their panel column & row
+        columns (int): panels per row
+    """
+
+    def __init__(self, filenames, columns):
+        filenames = sorted(filenames, key=self.get_panel_from_filename)
+        self.readers = [SSD1306_ImageReader(filename) for filename in filenames]
+        self.columns = columns
+        self.rows = len(self.readers) // columns
+        reader = self.readers[0]
+        for r in self.readers:
+            if (r.width, r.height, r.frames) != (reader.width, reader.height, reader.frames):
+                raise ValueError("{} does not match {}".format(r.filename, reader.filename))
+        self.panel_width = reader.width
+        self.panel_height = reader.height
+        self.width = reader.width * columns
+        self.height = reader.height * self.rows
+        self.frames = reader.frames
+
+    def get_panel_from_filename(self, filename):
+        """Get the panel (row, column) from a panel image filename ("name_panel<column>_<row>.WxH.Nimg.z")."""
+        (column, row) = filename.split("_panel")[-1].split(".")[0].split("_")
+        return (int(row), int(column))
+
+    def __str__(self):
+       return f"{self.width}x{self.height} ({self.columns}x{self.rows} panels), {self.frames} frame{'s' if self.frames > 1 else ''}"
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+    def next_frame(self):
+        """Return the next frame of each panel (looping the animation), row after row."""
+        return [reader.next_frame() for reader in self.readers]
+
+
+class SSD1306_ShardedImageReader:
+    """Read the shards of a long animation (see --shard-size) one after the other, as a single
+       animation. Only the current shard is open.
+
+    Args:
+        filenames (list): shard image filenames, in order ("name_shard<n>...")
+    """
+
+    def __init__(self, filenames):
+        self.filenames = filenames
+        self.frames = 0
+        for filename in filenames:
+            reader = SSD1306_ImageReader(filename)
+            self.frames += reader.frames
+            reader.close()
+        self.shard = 0
+        self.reader = SSD1306_ImageReader(filenames[0])
+        self.shard_frame = 0
+        self.width = self.reader.width
+        self.height = self.reader.height
+        self.buf_size_in_bytes = self.reader.buf_size_in_bytes
+
+    def __str__(self):
+       return f"{self.width}x{self.height}, {self.frames} frame{'s' if self.frames > 1 else ''}, {len(self.filenames)} shards"
+
+    def close(self):
+        self.reader.close()
+
+    def next_frame(self):
+        """Return the next frame (looping the animation), opening the next shard if needed."""
+        if self.shard_frame == self.reader.frames:
+            self.reader.close()
+            self.shard = (self.shard + 1) % len(self.filenames)
+            self.reader = SSD1306_ImageReader(self.filenames[self.shard])
+            self.shard_frame = 0
+        self.shard_frame += 1
+        return self.reader.next_frame()
+
+
+class SSD1306_ImageCache:
+    """Keep the decoded frames of short animations in memory so looping or opening
+       again an animation costs neither file reads nor decompression.
+       The least recently used animations are evicted when the budget is exceeded and
+       the animations larger than the budget are streamed from the file as usual.
+
+    Args:
+        budget_in_bytes (int): maximum size of the decoded frames kept in memory
+    """
+
+    def __init__(self, budget_in_bytes=DEFAULT_CACHE_BUDGET_IN_BYTES):
+        self.budget_in_bytes = budget_in_bytes
+        self.used_in_bytes = 0
+        self.entries = {} # source key (see get_key()) -> decoded frames
+        self.lru = []     # source keys, the least recently used first
+
+    def get_key(self, filename, bundle=None):
+        """Return the key of an animation source: the file, or the bundle file & the image
+           offset in it, so the same name in a file & in bundles are different entries."""
+        if bundle is not None:
+            return (bundle.filename, bundle.entries[filename][1])
+        return (filename, 0)
+
+    def open(self, filename, bundle=None):
+        """Return a reader on the cached animation if possible, else a streaming reader.
+           If a SSD1306_ImageBundle is given, filename is the name of the image in the bundle."""
+        key = self.get_key(filename, bundle)
+        if key in self.entries:
+            self.lru.remove(key)
+            self.lru.append(key)
+            frames_buf, reader = self.entries[key]
+            return SSD1306_CachedImageReader(reader, frames_buf)
+
+        if bundle is not None:
+            reader = bundle.open(filename)
+        else:
+            reader = SSD1306_ImageReader(filename)
+        size = reader.frames * reader.buf_size_in_bytes
+        if size > self.budget_in_bytes:
+            return reader # too big, streaming
+
+        while self.used_in_bytes + size > self.budget_in_bytes:
+            self.__evict_key(self.lru[0])
+
+        frames_buf = bytearray(size)
+        for frame in range(reader.frames):
+            pos = frame * reader.buf_size_in_bytes
+            frames_buf[pos : pos + reader.buf_size_in_bytes] = reader.next_frame()
+        reader.close()
+
+        self.entries[key] = (frames_buf, reader)
+        self.lru.append(key)
+        self.used_in_bytes += size
+        return SSD1306_CachedImageReader(reader, frames_buf)
+
+    def evict(self, filename, bundle=None):
+        """Remove an animation (the image "filename" of the bundle if given) from the cache."""
+        self.__evict_key(self.get_key(filename, bundle))
+
+    def __evict_key(self, key):
+        frames_buf, reader = self.entries.pop(key)
+        self.lru.remove(key)
+        self.used_in_bytes -= len(frames_buf)
+
+
+class SSD1306_ImageBundle:
+    """Many images stored in a single bundle file (see BUNDLE_MAGIC for the format).
+       Only the directory is read by the constructor, the images are opened by name
+       with a single lookup then a seek to their data.
+
+    Args:
+        filename (str): bundle filename
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {} # name -> (config, offset, size, encoding)
+
+        f = open(self.filename, "rb") # TODO manage errors
+        (magic, version, _, count) = struct.unpack(BUNDLE_HEADER_FORMAT, f.read(struct.calcsize(BUNDLE_HEADER_FORMAT)))
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            f.close()
+            raise ValueError("{} is not a ssd1306 image bundle (version {})".format(filename, BUNDLE_VERSION))
+        entry_size = struct.calcsize(BUNDLE_ENTRY_FORMAT)
+        for i in range(count):
+            name = f.read(f.read(1)[0]).decode()
+            (width, height, frames, image_format, offset, size) = struct.unpack(BUNDLE_ENTRY_FORMAT, f.read(entry_size))
+            self.entries[name] = ((width, height, frames, (image_format & 1) != 0), offset, size, image_format >> 1)
+        f.close()
+
+    def __str__(self):
+       return f"{len(self.entries)} image{'s' if len(self.entries) > 1 else ''}, {self.filename}"
+
+    def names(self):
+        return list(self.entries)
 
-        return current_frame_buf
+    def open(self, name):
+        """Return a SSD1306_ImageReader on the image "name" of the bundle."""
+        (config, offset, size, encoding) = self.entries[name]
+        return SSD1306_ImageReader(self.filename, config, offset, size, encoding)
@@ -0,0 +1,229 @@
+"""
+Bus bandwidth scheduler of images for ssd1306-like Oled panel
+https://github.com/coolcornucopia/convert-animated-gif-for-ssd1306-panel
+
+MIT License
+
+Copyright (c) 2022 coolcornucopia
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import ssd1306_image_encoder
+
+# I2C bus cost model, matching SSD1306_I2C (batched) of stm32_ssd1306.py: each byte takes 9 bits
+# (8 bits & ack) and each transaction starts with the address byte and takes 2 more bits (start
+# & stop conditions). A full 128x64 frame takes 1038 bytes (address, 6 address window commands
+# with their control bytes, data control byte & 1024 data bytes): ~42 fps at 400 kHz.
+DEFAULT_BUS_HZ = 400000
+I2C_BITS_PER_BYTE = 9
+I2C_TRANSACTION_BITS = 2
+WINDOW_CMDS_SIZE_IN_BYTES = 6 * 2 + 1 # see SSD1306_I2C.window_cmds
+START_LINE_CMD_SIZE_IN_BYTES = 2      # control byte & command
+
+# GIF frames without duration (or with a null one) are displayed 100ms by the web browsers
+DEFAULT_FRAME_DURATION_MS = 100
+
+# The bus utilization is reported for segments of this duration
+DEFAULT_SEGMENT_MS = 1000
+
+# Gray levels flicker when their cycle (all the display slots of a gray frame) is shown less
+# often than this: 2 planes take 3 slots, 3 planes 7 slots
+GRAY_MIN_REFRESH_HZ = 50
+
+
+def get_transaction_bits(size_in_bytes:int) -> int:
+    """Get the bus bits of a transaction (address byte included)."""
+    return (1 + size_in_bytes) * I2C_BITS_PER_BYTE + I2C_TRANSACTION_BITS
+
+
+def get_update_bits(width:int, start_line_changed:bool, pages:int) -> int:
+    """Get the bus bits of a scroll update (see SSD1306.show_update()): the start line command
+       if changed then one address window & its data per run of consecutive pages."""
+    bits = 0
+    if start_line_changed:
+        bits += get_transaction_bits(START_LINE_CMD_SIZE_IN_BYTES)
+    page = 0
+    while pages >> page:
+        if not (pages >> page) & 1:
+            page += 1
+            continue
+        p0 = page
+        while (pages >> page) & 1:
+            page += 1
+        bits += get_transaction_bits(WINDOW_CMDS_SIZE_IN_BYTES + (page - p0) * width)
+    return bits
+
+
+def get_frames_durations(img):
+    """Get the duration in ms of each frame of a PIL image (DEFAULT_FRAME_DURATION_MS if unknown)."""
+    durations = []
+    for frame in range(ssd1306_image_encoder.get_frames_count(img)):
+        img.seek(frame)
+        durations.append(img.info.get("duration") or DEFAULT_FRAME_DURATION_MS)
+    img.seek(0)
+    return durations
+
+
+def get_ticks_count(durations, fps:float) -> int:
+    """Get the number of frames played at fps for the given frames durations (ms)."""
+    duration_ms = sum(durations)
+    ticks = 0
+    while ticks * 1000 < duration_ms * fps: # same test as SSD1306_BusScheduler.add_frame()
+        ticks += 1
+    return ticks
+
+
+class SSD1306_BusScheduler:
+    """Resample an animation at a fixed frame rate (the player displays a frame at each tick)
+       and fit its updates in the bus bandwidth, so the animation plays in real-time:
+       - each tick displays the source frame visible at its time (the frames shorter than a
+         tick are dropped, the longer ones are repeated at no cost)
+       - the frames are encoded as changed pages updates (see SSD1306_ScrollEncoder)
+       - if the bus is still sending the update of a previous tick, the tick is dropped and
+         its changes are merged into the next sent update
+
+    Args:
+        width (int): width in pixels
+        height (int): height in pixels
+        bus_hz (int): bus clock in Hz
+        fps (float): player frame rate
+        segment_ms (int): duration of the segments of the bus utilization report
+    """
+
+    def __init__(self, width:int, height:int, bus_hz=DEFAULT_BUS_HZ, fps=30, segment_ms=DEFAULT_SEGMENT_MS):
+        self.width = width
+        self.bus_hz = bus_hz
+        self.fps = fps
+        self.segment_ms = segment_ms
+        self.scroll_encoder = ssd1306_image_encoder.SSD1306_ScrollEncoder(width, height)
+        self.tick_bits = bus_hz / fps   # bus bits available during a tick
+        self.busy_bits = 0              # bits of the current transfer still to send
+        self.time_ms = 0                # end of the previous source frame
+        self.tick = 0
+        self.segments = []
+
+    def __get_segment(self):
+        start_ms = int((self.tick * 1000 / self.fps) // self.segment_ms) * self.segment_ms
+        if not self.segments or self.segments[-1]["start_ms"] != start_ms:
+            self.segments.append({"start_ms": start_ms, "ticks": 0, "sent": 0, "repeated": 0,
+                                  "dropped": 0, "bus_bits": 0})
+        return self.segments[-1]
+
+    def __next_tick(self, buf):
+        segment = self.__get_segment()
+        segment["ticks"] += 1
+        self.tick += 1
+        if self.busy_bits > 0:
+            # The bus is busy, the changes will be sent with the next update
+            segment["dropped"] += 1
+            data = self.scroll_encoder.add_repeat()
+        else:
+            update = self.scroll_encoder.get_update(buf)
+            (start_line, pages, ram_rows) = update
+            bits = get_update_bits(self.width, start_line != self.scroll_encoder.start_line, pages)
+            segment["sent" if bits else "repeated"] += 1
+            segment["bus_bits"] += bits
+            self.busy_bits = bits
+            data = self.scroll_encoder.apply_update(update)
+        self.busy_bits = max(0, self.busy_bits - self.tick_bits)
+        return data
+
+    def add_frame(self, buf, duration_ms):
+        """Return the updates (encoded data) of the ticks displaying this source frame."""
+        end_ms = self.time_ms + duration_ms
+        updates = []
+        while self.tick * 1000 < end_ms * self.fps:
+            updates.append(self.__next_tick(buf))
+        self.time_ms = end_ms
+        return updates
+
+    def get_report(self) -> str:
+        """Get the expected bus utilization of each segment."""
+        lines = ["segment (s)  ticks  sent  repeated  dropped  bus utilization"]
+        for segment in self.segments:
+            duration_s = segment["ticks"] / self.fps
+            lines.append("{:>11.1f}  {:>5}  {:>4}  {:>8}  {:>7}  {:>14.1f}%".format(
+                segment["start_ms"] / 1000, segment["ticks"], segment["sent"], segment["repeated"],
+                segment["dropped"], segment["bus_bits"] * 100 / (self.bus_hz * duration_s)))
+        return "\n".join(lines)
+
+
+class SSD1306_GrayScheduler:
+    """Encode gray level frames as weighted bitplanes updates (see SSD1306_GrayEncoder) and
+       schedule them on the bus: the player sends a plane then waits for its display slots, so
+       each update must be sent within the slots of its plane. The display slot is the shortest
+       one fitting all the updates in the bus bandwidth (the weight 1 planes are the limit),
+       the gray levels flicker when their cycle is slower than GRAY_MIN_REFRESH_HZ.
+
+    Args:
+        width (int): width in pixels
+        height (int): height in pixels
+        planes (int): bitplanes per frame
+        bus_hz (int): bus clock in Hz
+    """
+
+    def __init__(self, width:int, height:int, planes:int, bus_hz=DEFAULT_BUS_HZ):
+        self.width = width
+        self.bus_hz = bus_hz
+        self.frame_slots = (1 << planes) - 1   # display slots of a gray frame
+        self.gray_encoder = ssd1306_image_encoder.SSD1306_GrayEncoder(width, height, planes)
+        self.bus_bits = 0               # bits of all the updates
+        self.slot_bits = 0              # bits of the shortest slot fitting all the updates
+
+    def add_frame(self, bufs) -> list:
+        """Return the updates (encoded data) of the planes of a frame."""
+        updates = self.gray_encoder.add_frame(bufs)
+        for (slots, pages) in self.gray_encoder.updates[-len(updates):]:
+            bits = get_update_bits(self.width, False, pages)
+            self.bus_bits += bits
+            self.slot_bits = max(self.slot_bits, bits / slots)
+        return updates
+
+    def get_slot_us(self) -> int:
+        """Get the shortest display slot in microseconds (see get_gray_slot_us() in main.py)."""
+        return -(-int(self.slot_bits * 1000000) // self.bus_hz)
+
+    def get_refresh_hz(self) -> float:
+        """Get the refresh rate of the gray levels (gray frames per second)."""
+        return 1000000 / (self.frame_slots * self.get_slot_us())
+
+    def get_min_bus_hz(self) -> int:
+        """Get the bus clock in Hz playing the gray levels at GRAY_MIN_REFRESH_HZ."""
+        max_slot_us = 1000000 // (self.frame_slots * GRAY_MIN_REFRESH_HZ)
+        return -(-int(self.slot_bits * 1000000) // max_slot_us)
+
+    def get_report(self) -> str:
+        """Get the plane rates of the virtual bus: sustained when the planes are sent one
+           after the other & with the display slot."""
+        encoder = self.gray_encoder
+        planes = len(encoder.updates)
+        slots = sum(slots for (slots, pages) in encoder.updates)
+        slot_us = self.get_slot_us()
+        lines = ["{} planes, {} pages sent instead of {}".format(planes, encoder.pages, planes * encoder.pages_count),
+                 "bus sustained plane rate  {:.1f} planes/s ({} bits at {} Hz)".format(
+                     planes * self.bus_hz / self.bus_bits, self.bus_bits, self.bus_hz),
+                 "display slot              {} us".format(slot_us),
+                 "played plane rate         {:.1f} planes/s, {:.1f} gray frames/s ({} slots per frame)".format(
+                     planes * 1000000 / (slots * slot_us), self.get_refresh_hz(), self.frame_slots)]
+        if self.get_refresh_hz() < GRAY_MIN_REFRESH_HZ:
+            lines.append("warning: the gray levels flicker below {} Hz, use a {} Hz bus or smaller images".format(
+                GRAY_MIN_REFRESH_HZ, self.get_min_bus_hz()))
+        return "\n".join(lines)
+
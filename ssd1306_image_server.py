@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import concurrent.futures.process
+import json
+import os
+import socketserver
+import statistics
+import struct
+import threading
+import time
+
+# By default the server listens on this Unix socket (or on localhost with --port)
+DEFAULT_SOCKET_PATH = "/tmp/ssd1306_image_server.sock"
+
+# Jobs waiting for a worker, the next jobs are rejected with the "busy" status (backpressure)
+DEFAULT_QUEUE_SIZE = 16
+
+# Largest request payload (image to convert) accepted, bigger requests are rejected
+DEFAULT_MAX_PAYLOAD_SIZE = 16 * 1024 * 1024
+
+# Latencies of the last jobs kept for the "stats" command
+LATENCY_HISTORY_SIZE = 1000
+
+# Options of the "convert" requests, the keyword arguments of ssd1306_image_encoder.encode()
+# (the compression threads are not, the server parallelism is its workers)
+ENCODE_OPTIONS = ("compression", "zlib_window_size", "dither_method", "partial_update", "encoding", "fps", "bus_hz",
+                  "decode_weight", "layout_params", "block_size", "sprite", "gray_planes")
+
+# Messages (requests & responses) are a JSON header then an optional payload of header["size"] bytes:
+# - header length (4 bytes, big endian), header (utf-8 JSON), payload
+# - requests: {"cmd": "convert", "size": N, "options": {"compression": bool, ...}} + GIF (or any image) bytes,
+#               the options are ENCODE_OPTIONS
+#             {"cmd": "stats"}
+# - responses: {"status": "ok", "size": N, "config": [width, height, frames, compression], "encoding": N,
+#               "position": [x, y] or null, "metrics": {"queue_ms": .., "convert_ms": .., "total_ms": ..}}
+#               + image file content (see ssd1306_image_encoder.get_image_filename() for its filename)
+#              {"status": "busy"} when the queue is full, {"status": "error", "error": "message"}
+HEADER_LENGTH_FORMAT = ">I"
+MAX_HEADER_LENGTH = 64 * 1024
+
+debug = False
+
+
+def send_message(sock, header, payload=b""):
+    header = dict(header, size=len(payload))
+    header_buf = json.dumps(header).encode()
+    sock.sendall(struct.pack(HEADER_LENGTH_FORMAT, len(header_buf)) + header_buf)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_exactly(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        data = sock.recv(min(size - len(buf), 1 << 20))
+        if not data:
+            raise ConnectionError("connection closed")
+        buf += data
+    return bytes(buf)
+
+
+def skip_exactly(sock, size):
+    while size:
+        data = sock.recv(min(size, 1 << 20))
+        if not data:
+            raise ConnectionError("connection closed")
+        size -= len(data)
+
+
+def recv_message(sock, max_size=None):
+    """Return the next message (header, payload), the payload is None (skipped, not stored)
+       if it is bigger than max_size bytes."""
+    (header_length,) = struct.unpack(HEADER_LENGTH_FORMAT, recv_exactly(sock, struct.calcsize(HEADER_LENGTH_FORMAT)))
+    if header_length > MAX_HEADER_LENGTH:
+        raise ValueError("header of {} bytes exceeds the maximum of {} bytes".format(header_length, MAX_HEADER_LENGTH))
+    header = json.loads(recv_exactly(sock, header_length))
+    size = header.get("size", 0)
+    if not isinstance(size, int) or size < 0:
+        raise ValueError("invalid payload size {}".format(size))
+    if max_size is not None and size > max_size:
+        skip_exactly(sock, size)
+        return (header, None)
+    payload = recv_exactly(sock, size)
+    return (header, payload)
+
+
+def warm_up_worker():
+    # Import PIL & its plugins once per worker process (not in the server process
+    # nor in the client which only need the messages functions)
+    import ssd1306_image_encoder
+    from PIL import Image
+    Image.init()
+
+
+def convert_job(data, options):
+    """Run in a worker process, return the image file content, its filename arguments (config,
+       encoding & position, or the error message) & the job timestamps."""
+    import ssd1306_image_encoder
+    time_start = time.time()
+    try:
+        (buf, config, encoding, position) = ssd1306_image_encoder.encode(data, **options)
+    except ssd1306_image_encoder.SSD1306_ConversionError as e:
+        return (None, str(e), time_start, time.time())
+    except Exception as e:
+        # Any other error of the job (truncated image file...) is returned to the client
+        # instead of being raised in the server thread
+        return (None, "{}: {}".format(type(e).__name__, e), time_start, time.time())
+    return (buf, {"config": config, "encoding": encoding, "position": position}, time_start, time.time())
+
+
+class SSD1306_ImageServerMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies_ms = []
+
+    def add_job(self, total_ms, error):
+        with self.lock:
+            self.jobs += 1
+            if error:
+                self.errors += 1
+            self.latencies_ms.append(total_ms)
+            del self.latencies_ms[:-LATENCY_HISTORY_SIZE]
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def add_rejected(self):
+        with self.lock:
+            self.rejected += 1
+
+    def get(self, queued):
+        with self.lock:
+            metrics = {"jobs": self.jobs, "errors": self.errors, "rejected": self.rejected, "queued": queued}
+            if self.latencies_ms:
+                latencies_ms = sorted(self.latencies_ms)
+                metrics.update({
+                    "latency_ms_mean": round(statistics.mean(latencies_ms), 3),
+                    "latency_ms_p50": round(latencies_ms[len(latencies_ms) // 2], 3),
+                    "latency_ms_p95": round(latencies_ms[(len(latencies_ms) * 95) // 100], 3),
+                    "latency_ms_max": round(latencies_ms[-1], 3),
+                })
+            return metrics
+
+
+class SSD1306_ImageRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                (header, payload) = recv_message(self.request, server.max_size)
+            except (ConnectionError, ValueError):
+                return
+            time_received = time.time()
+
+            if payload is None:
+                # Too large request, rejected without storing its payload
+                server.metrics.add_error()
+                error = "payload of {} bytes exceeds the maximum of {} bytes".format(header["size"], server.max_size)
+                if server.verbose:
+                    print("request error: {}".format(error))
+                send_message(self.request, {"status": "error", "error": error})
+                continue
+
+            if header.get("cmd") == "stats":
+                send_message(self.request, {"status": "ok", "metrics": server.metrics.get(server.get_queued())})
+                continue
+            if header.get("cmd") != "convert":
+                send_message(self.request, {"status": "error", "error": "unknown command {}".format(header.get("cmd"))})
+                continue
+            options = header.get("options", {})
+            if not isinstance(options, dict) or not set(options) <= set(ENCODE_OPTIONS):
+                server.metrics.add_error()
+                send_message(self.request, {"status": "error", "error": "options {} are not a dict of {}".format(
+                    json.dumps(options), ", ".join(ENCODE_OPTIONS))})
+                continue
+
+            # Backpressure: reject the job if all the workers are busy and the queue is full
+            if not server.acquire_slot():
+                server.metrics.add_rejected()
+                send_message(self.request, {"status": "busy"})
+                continue
+            executor = server.executor
+            try:
+                future = executor.submit(convert_job, payload, options)
+                (buf, result, time_start, time_end) = future.result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # A worker process died (killed, out of memory...), all the jobs of its pool fail:
+                # the pool is replaced so the next jobs are converted
+                server.restart_workers(executor)
+                (buf, result, time_start, time_end) = (None, "worker process failed: {}".format(e),
+                                                       time_received, time.time())
+            finally:
+                server.release_slot()
+
+            time_sent = time.time()
+            metrics = {"queue_ms": round((time_start - time_received) * 1000, 3),
+                       "convert_ms": round((time_end - time_start) * 1000, 3),
+                       "total_ms": round((time_sent - time_received) * 1000, 3)}
+            server.metrics.add_job(metrics["total_ms"], buf is None)
+            if server.verbose:
+                print("job {}: {}".format("error" if buf is None else "ok", metrics))
+            if buf is None:
+                send_message(self.request, {"status": "error", "error": result, "metrics": metrics})
+            else:
+                send_message(self.request, dict(result, status="ok", metrics=metrics), buf)
+
+
+class SSD1306_ImageServerMixIn:
+    daemon_threads = True
+
+    def setup_workers(self, verbose, workers, queue_size, max_size):
+        self.verbose = verbose
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_size = max_size
+        self.slots_lock = threading.Lock()
+        self.queued = 0         # jobs running or waiting for a worker
+        self.metrics = SSD1306_ImageServerMetrics()
+        self.workers_lock = threading.Lock()
+        self.executor = self.start_workers()
+
+    def start_workers(self):
+        executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=warm_up_worker)
+        # Start the workers now so the first jobs do not pay the start & imports
+        for future in [executor.submit(warm_up_worker) for i in range(self.workers)]:
+            future.result()
+        return executor
+
+    def restart_workers(self, executor):
+        """Replace a broken pool of workers, once for all the jobs failed with it."""
+        with self.workers_lock:
+            if self.executor is not executor:
+                return # already replaced
+            self.executor = self.start_workers()
+        if self.verbose:
+            print("worker process failed, workers restarted")
+        executor.shutdown(wait=False)
+
+    def acquire_slot(self):
+        with self.slots_lock:
+            if self.queued >= self.workers + self.queue_size:
+                return False
+            self.queued += 1
+            return True
+
+    def release_slot(self):
+        with self.slots_lock:
+            self.queued -= 1
+
+    def get_queued(self):
+        return self.queued
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+
+class SSD1306_ImageUnixServer(SSD1306_ImageServerMixIn, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class SSD1306_ImageTCPServer(SSD1306_ImageServerMixIn, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def serve(verbose, socket_path, port, workers, queue_size, max_size):
+    if port is not None:
+        server = SSD1306_ImageTCPServer(("127.0.0.1", port), SSD1306_ImageRequestHandler)
+        address = "127.0.0.1:{}".format(port)
+    else:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = SSD1306_ImageUnixServer(socket_path, SSD1306_ImageRequestHandler)
+        address = socket_path
+
+    server.setup_workers(verbose, workers, queue_size, max_size)
+    if verbose:
+        print("listening on {} with {} workers (queue size {})".format(address, workers, queue_size))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if port is None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS]",
+        description=
+        """
+Conversion server for ssd1306-like OLED panel images: keeps warm worker processes (Python & PIL
+already loaded) and converts the images sent over a Unix socket (or localhost TCP port).
+
+Notes:
+ - Use ssd1306_image_client.py to send the images to convert.
+ - When all the workers are busy and the queue is full, the jobs are rejected with the "busy"
+   status and the client retries later.
+ - The images bigger than --max-size are rejected with the "error" status.""",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("-s", "--socket",   help="Unix socket path (default: %(default)s)", default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("-p", "--port",     help="listen on this localhost TCP port instead of the Unix socket", type=int, required=False)
+    parser.add_argument("-w", "--workers",  help="worker processes (default: %(default)s)", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-q", "--queue-size", help="jobs waiting for a worker (default: %(default)s)", type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument("-m", "--max-size", help="largest image accepted in bytes (default: %(default)s)", type=int, default=DEFAULT_MAX_PAYLOAD_SIZE)
+    parser.add_argument("-v", "--verbose",  action="store_true", help="explain what is being done")
+    return parser
+
+def main() -> None:
+    parser = init_argparse()
+    args = parser.parse_args()
+    if debug:
+        print(args)
+
+    serve(args.verbose, args.socket, args.port, args.workers, args.queue_size, args.max_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Frame sources of images for ssd1306-like Oled panel
+https://github.com/coolcornucopia/convert-animated-gif-for-ssd1306-panel
+
+MIT License
+
+Copyright (c) 2022 coolcornucopia
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import re
+
+# Raw gray frame dumps: "name.WIDTHxHEIGHT.gray", 8-bit per pixel frames one after the other,
+# for example from "ffmpeg -i video.mp4 -vf scale=128:64 -f rawvideo -pix_fmt gray video.128x64.gray"
+RAW_GRAY_EXTENSION = "gray"
+
+# Image files of the numbered sequence directories (the other files are ignored)
+SEQUENCE_EXTENSIONS = (".png", ".bmp")
+
+# The frame number of a sequence file is the last number of its name ("frame_0042.png")
+SEQUENCE_NUMBER_RE = re.compile(r"(\d+)\D*$")
+
+
+def is_raw_gray(filename) -> bool:
+    return str(filename).rsplit(".", 1)[-1] == RAW_GRAY_EXTENSION
+
+
+def get_basename(filename) -> str:
+    """Get the basename of the output images of a source ("path/name.gif", "path/name/" for a
+       sequence directory or "path/name.128x64.gray" give "path/name")."""
+    filename = str(filename).rstrip("/" + os.sep)
+    if os.path.isdir(filename):
+        return filename
+    if is_raw_gray(filename):
+        return filename.rsplit(".", 2)[0]
+    return filename.rsplit(".", 1)[0]
+
+
+class SSD1306_FrameSource:
+    """Frames decoded lazily one at a time with the PIL image interface used by the encoder
+       (see ssd1306_image_encoder.iter_frames()): seek() loads the frame and releases the
+       previous one, the other attributes & methods (convert(), crop(), tobytes()...) are the
+       ones of the current frame. The subclasses implement load_frame(frame)."""
+
+    def __init__(self, filename, n_frames:int):
+        self.filename = str(filename)
+        self.n_frames = n_frames
+        self.frame = None
+        self.img = None
+        self.seek(0)
+        self.size = self.img.size
+        self.width, self.height = self.size
+
+    def load_frame(self, frame:int):
+        raise NotImplementedError
+
+    def seek(self, frame:int):
+        if not 0 <= frame < self.n_frames:
+            raise EOFError("no more frames") # end of the ImageSequence iteration
+        if frame != self.frame:
+            if self.img is not None:
+                self.img.close()
+            self.img = self.load_frame(frame)
+            self.frame = frame
+
+    def tell(self) -> int:
+        return self.frame
+
+    def __getattr__(self, name):
+        return getattr(self.img, name)
+
+    def close(self):
+        if self.img is not None:
+            self.img.close()
+            self.img = None
+
+
+class SSD1306_ImageSequence(SSD1306_FrameSource):
+    """Numbered PNG/BMP files of a directory ("frame_0001.png", "frame_0002.png"...), in the
+       order of their numbers.
+
+    Args:
+        directory (str): sequence directory
+    """
+
+    format = "SEQUENCE"
+
+    def __init__(self, directory):
+        filenames = []
+        for filename in os.listdir(directory):
+            match = SEQUENCE_NUMBER_RE.search(os.path.splitext(filename)[0])
+            if os.path.splitext(filename)[1].lower() in SEQUENCE_EXTENSIONS and match:
+                filenames.append((int(match.group(1)), filename))
+        if not filenames:
+            raise ValueError("no numbered {} files in {}".format(" or ".join(SEQUENCE_EXTENSIONS), directory))
+        self.filenames = [os.path.join(directory, filename) for (number, filename) in sorted(filenames)]
+        super().__init__(directory, len(self.filenames))
+
+    def load_frame(self, frame):
+        from PIL import Image
+        img = Image.open(self.filenames[frame])
+        img.load()
+        if frame and img.size != self.size:
+            raise ValueError("{} size {}x{} is not the sequence size {}x{}".format(
+                self.filenames[frame], img.width, img.height, self.width, self.height))
+        return img
+
+
+class SSD1306_RawGraySequence(SSD1306_FrameSource):
+    """Raw gray frame dump "name.WIDTHxHEIGHT.gray" (see RAW_GRAY_EXTENSION), each frame is read
+       at its offset in the file.
+
+    Args:
+        filename (str): raw gray frames filename
+    """
+
+    format = "GRAY"
+
+    def __init__(self, filename):
+        try:
+            (width, height) = (int(n) for n in str(filename).split(".")[-2].split("x"))
+        except ValueError:
+            raise ValueError("{} is not a name.WIDTHxHEIGHT.{} file".format(filename, RAW_GRAY_EXTENSION))
+        self.frame_size = (width, height)
+        self.frame_size_in_bytes = width * height
+        file_size = os.path.getsize(filename)
+        if not file_size or file_size % self.frame_size_in_bytes:
+            raise ValueError("{} size is not a multiple of the {}x{} frame size".format(filename, width, height))
+        self.f = open(filename, "rb")
+        super().__init__(filename, file_size // self.frame_size_in_bytes)
+
+    def load_frame(self, frame):
+        from PIL import Image
+        self.f.seek(frame * self.frame_size_in_bytes)
+        return Image.frombytes("L", self.frame_size, self.f.read(self.frame_size_in_bytes))
+
+    def close(self):
+        super().close()
+        self.f.close()
@@ -0,0 +1,101 @@
+"""
+Per-frame statistics of images for ssd1306-like Oled panel
+https://github.com/coolcornucopia/convert-animated-gif-for-ssd1306-panel
+
+MIT License
+
+Copyright (c) 2022 coolcornucopia
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import csv
+import json
+import zlib
+
+
+def count_pixels(buf) -> int:
+    """Count the pixels set in a 1-bit per pixel buffer."""
+    return bin(int.from_bytes(buf, "big")).count("1")
+
+
+class SSD1306_FrameStats:
+    """Collect statistics for each frame (ssd1306-like format) then save them in CSV or JSON:
+       - compressed_bytes: bytes added to the zlib stream by the frame (the size of the zlib
+         stream sync-flushed after the frame minus the one after the previous frame),
+         or the frame size without compression
+       - changed_pixels & changed_pages: pixels & pages different from the previous frame
+         (the first frame is compared to a black screen)
+       - white_ratio: ratio of white (set) pixels
+       - time_ms: time spent to convert (or read) the frame
+
+    Args:
+        width (int): width in pixels
+        height (int): height in pixels
+        zlib_window_size (int): zlib window size, None if not compressed
+    """
+
+    FIELDS = ("frame", "compressed_bytes", "changed_pixels", "changed_pages", "white_ratio", "time_ms")
+
+    def __init__(self, width:int, height:int, zlib_window_size=None):
+        self.width = width
+        self.height = height
+        self.buf_size_in_bytes = (width * height) // 8
+        self.prev_buf = bytes(self.buf_size_in_bytes) # black screen
+        self.z_obj = None
+        if zlib_window_size is not None:
+            self.z_obj = zlib.compressobj(9, zlib.DEFLATED, zlib_window_size)
+        self.z_size = 0         # compressed bytes returned by z_obj
+        self.z_prev_total = 0   # compressed stream size (sync-flushed) after the previous frame
+        self.frames = []
+
+    def add_frame(self, buf, time_ms):
+        if self.z_obj is not None:
+            self.z_size += len(self.z_obj.compress(buf))
+            z_total = self.z_size + len(self.z_obj.copy().flush(zlib.Z_SYNC_FLUSH))
+            compressed_bytes = z_total - self.z_prev_total
+            self.z_prev_total = z_total
+        else:
+            compressed_bytes = len(buf)
+
+        diff = (int.from_bytes(buf, "big") ^ int.from_bytes(self.prev_buf, "big")).to_bytes(len(buf), "big")
+        changed_pages = 0
+        for page in range(self.height // 8):
+            if any(diff[page * self.width : (page + 1) * self.width]):
+                changed_pages += 1
+
+        self.frames.append({
+            "frame": len(self.frames),
+            "compressed_bytes": compressed_bytes,
+            "changed_pixels": count_pixels(diff),
+            "changed_pages": changed_pages,
+            "white_ratio": round(count_pixels(buf) / (self.width * self.height), 4),
+            "time_ms": round(time_ms, 3),
+        })
+        self.prev_buf = bytes(buf)
+
+    def save(self, filename):
+        """Save the statistics in JSON if the filename ends with ".json", else in CSV."""
+        with open(filename, "w", newline="") as f:
+            if filename.endswith(".json"):
+                json.dump(self.frames, f, indent=1)
+            else:
+                writer = csv.DictWriter(f, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(self.frames)